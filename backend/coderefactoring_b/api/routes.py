@@ -1,43 +1,89 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi.responses import StreamingResponse
 from websocket_manager import manager
-from services.analysis_service import run_project_analysis
-from services.refactor_service import run_package_refactoring
-import asyncio
+from services.job_service import jobs, scheduler, JobRejectedError
+from services.upload_service import receive_project_upload, UploadError
+from services.artifact_service import get_upgrade_result, list_export_files, list_patch_files, iter_project_zip
+from config import UPLOAD_CHUNK_BYTES, UPLOAD_MAX_BYTES
 import json
-import shutil
 import os
 router = APIRouter()
 
 @router.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
+    """
+    Subscribes a client to its job's event stream. A new client uploads its project, which is
+    queued as a job; a reconnecting client is replayed the job's events so far. Either way the
+    socket then forwards client commands (e.g. start_upgrade, cancel_job) to the job. Closing it
+    does not stop the job straight away: an unsubscribed job is cancelled after a grace period.
+    """
     await manager.connect(websocket, client_id)
     temp_dir = f"./temp/{client_id}"
+    upload_path = f"./temp/{client_id}-upload.zip"
+    job = jobs.get(client_id)
     try:
-        # --- Phase 1: Analysis ---
-        await websocket.send_json({"type": "connection_ready"})
-        zip_bytes = await websocket.receive_bytes()
-        print("INFO:     File received, starting analysis task...")
-        await run_project_analysis(client_id, zip_bytes, temp_dir)
-        print("INFO:     Analysis phase complete. Waiting for upgrade instructions.")
+        if job is None:
+            if not scheduler.can_admit():
+                raise JobRejectedError("The server is busy. Please try again in a few minutes.")
+            # --- Upload, then hand the project to a job worker ---
+            await manager.send_json(client_id, {"type": "connection_ready", "upload": {"chunkSize": UPLOAD_CHUNK_BYTES, "maxBytes": UPLOAD_MAX_BYTES}}, record=False)
+            upload_size = await receive_project_upload(websocket, upload_path)
+            print(f"INFO:     File received ({upload_size} bytes), queueing job {client_id}.")
+            job = jobs.submit(client_id, temp_dir, upload_path)
+        else:
+            print(f"INFO:     Client {client_id} resubscribed to job in status {job.status}.")
+            jobs.attach(job)
 
-        # --- Phase 2: Refactoring ---
-        upgrade_data = await websocket.receive_text()
-        payload = json.loads(upgrade_data)
-        if payload.get("type") == "start_upgrade":
-            packages_to_upgrade = payload.get("packages", [])
-            print(f"INFO:     Received request to upgrade {len(packages_to_upgrade)} packages.")
-            await run_package_refactoring(client_id, packages_to_upgrade, temp_dir)
-            print("INFO:     Refactoring phase complete.")
+        while True:
+            payload = json.loads(await websocket.receive_text())
+            if payload.get("type") == "cancel_job":
+                jobs.cancel(job)
+            else:
+                job.commands.put_nowait(payload)
 
     except WebSocketDisconnect:
         print(f"INFO:     Client {client_id} disconnected.")
+    except (UploadError, JobRejectedError) as e:
+        print(f"ERROR:    Job rejected for client {client_id}: {e}")
+        await manager.send_json(client_id, {"type": "log", "status": "error", "message": f"Upload rejected: {e}"}, record=False)
+        await manager.flush(client_id)
     except Exception as e:
         print(f"ERROR:    An unexpected error occurred: {e}")
         await manager.send_json(client_id, {"type": "log", "status": "error", "message": str(e)})
     finally:
-        manager.disconnect(client_id)
-        # Final cleanup of the temporary directory
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-            print(f"INFO:     Cleaned up temp directory: {temp_dir}")
-        print(f"INFO:     Connection closed for client {client_id}.")
\ No newline at end of file
+        manager.disconnect(client_id, websocket)
+        if job is not None and client_id not in manager.active_connections:
+            jobs.detach(job)
+        if job is None:
+            # Nothing was queued, so nothing else will clean up after this connection.
+            manager.forget(client_id)
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
+        print(f"INFO:     Connection closed for client {client_id}.")
+
+@router.get("/jobs/{exec_id}")
+def get_job_status(exec_id: str):
+    job = jobs.get(exec_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Unknown job.")
+    return jobs.describe(job)
+
+@router.get("/download/{exec_id}")
+def download_upgraded_project(exec_id: str, mode: str = "full"):
+    """Streams the upgraded project as a zip; mode=patch returns only changed files plus package.json."""
+    result = get_upgrade_result(exec_id)
+    if not result or not os.path.isdir(result["project_root"]):
+        raise HTTPException(status_code=404, detail="No upgraded project found for this execution.")
+    if mode == "patch":
+        files = list_patch_files(result["project_root"], result["changed_files"])
+        filename = f"{exec_id}-upgrade-patch.zip"
+    elif mode == "full":
+        files = list_export_files(result["project_root"])
+        filename = f"{exec_id}-upgraded.zip"
+    else:
+        raise HTTPException(status_code=400, detail="mode must be 'full' or 'patch'.")
+    return StreamingResponse(
+        iter_project_zip(result["project_root"], files),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
\ No newline at end of file
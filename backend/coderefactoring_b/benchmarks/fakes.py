@@ -0,0 +1,151 @@
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import textwrap
+from types import SimpleNamespace
+from urllib.parse import quote
+
+# Stand-in for npm/npx/node. Behaviour is driven by BENCH_* environment variables so the same
+# scripts serve every benchmark size.
+FAKE_TOOL = textwrap.dedent('''\
+    #!{python}
+    import os, sys, json, time
+    tool = os.path.basename(sys.argv[0])
+    args = sys.argv[1:]
+
+    def emit(lines, seconds):
+        delay = seconds / max(lines, 1)
+        for i in range(lines):
+            print(f"{{tool}} {{' '.join(args[:2])}}: progress line {{i}}", flush=True)
+            if delay:
+                time.sleep(delay)
+
+    if args[:1] == ["--version"]:
+        print({{"node": "v20.11.0", "npm": "10.2.4", "npx": "10.2.4"}}[tool])
+    elif args[:1] == ["install"]:
+        emit(int(os.environ.get("BENCH_INSTALL_LINES", 0)), float(os.environ.get("BENCH_INSTALL_SECONDS", 0)))
+        with open("package.json") as f:
+            manifest = json.load(f)
+        os.makedirs("node_modules/.bin", exist_ok=True)
+        root = {{k: manifest[k] for k in ("dependencies", "devDependencies", "optionalDependencies", "peerDependencies") if k in manifest}}
+        with open("package-lock.json", "w") as f:
+            json.dump({{"lockfileVersion": 3, "packages": {{"": root}}}}, f)
+        with open("node_modules/.package-lock.json", "w") as f:
+            json.dump({{"lockfileVersion": 3}}, f)
+    elif args[:2] == ["run", "build"]:
+        emit(int(os.environ.get("BENCH_BUILD_LINES", 0)), float(os.environ.get("BENCH_BUILD_SECONDS", 0)))
+    else:
+        print(f"unsupported: {{tool}} {{args}}", file=sys.stderr)
+        sys.exit(1)
+''')
+
+
+def install_fake_toolchain(bin_dir: str):
+    """Writes node/npm/npx stand-ins into bin_dir and puts it first on PATH (POSIX only)."""
+    os.makedirs(bin_dir, exist_ok=True)
+    script = FAKE_TOOL.format(python=sys.executable)
+    for tool in ("node", "npm", "npx"):
+        path = os.path.join(bin_dir, tool)
+        with open(path, "w") as f:
+            f.write(script)
+        os.chmod(path, 0o755)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+
+
+def seed_registry_cache(cache_dir: str, dependencies: dict, latest: dict):
+    """
+    Writes fresh registry metadata for every dependency into the registry disk cache, so planning
+    needs no network: a package's latest release is latest[name], or the base of its range.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    for name, spec in dependencies.items():
+        base = spec.lstrip("^~")
+        newest = latest.get(name, base)
+        metadata = {"name": name, "dist-tags": {"latest": newest}, "versions": sorted({base, newest}), "fetched_at": time.time()}
+        with open(os.path.join(cache_dir, quote(name, safe="") + ".json"), "w", encoding="utf-8") as f:
+            json.dump(metadata, f)
+
+
+_ORIGINAL_CODE = re.compile(r"\*\*Original Code:\*\*\n```(\w*)\n(.*)\n```", re.DOTALL)
+_REGIONS = re.compile(r"\*\*Regions:\*\*\n```\n(.*)\n```", re.DOTALL)
+_REGION_END = re.compile(r"^(// @@END REGION \d+)$", re.MULTILINE)
+
+
+class FakeModel:
+    """
+    Deterministic replacement for the Gemini model: waits `latency` seconds (plus up to `jitter`,
+    derived from the prompt so runs are repeatable) and returns the original code with one line
+    added (after each region for region prompts, after the first line for edit prompts), in the
+    shape the parsers expect. With stream=True the same text arrives in a few chunks spread over
+    the latency, the last one carrying the usage.
+    """
+
+    def __init__(self, latency: float = 0.2, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        self.prompt_chars = 0
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        self.calls += 1
+        self.prompt_chars += len(prompt)
+        spread = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+        latency = self.latency + self.jitter * spread
+        if stream:
+            return self._stream(prompt, latency)
+        await asyncio.sleep(latency)
+        return self._response(prompt)
+
+    async def _stream(self, prompt, latency, chunks=4):
+        response = self._response(prompt)
+        size = -(-len(response.text) // chunks)
+        for i in range(chunks):
+            await asyncio.sleep(latency / chunks)
+            last = i == chunks - 1
+            yield SimpleNamespace(text=response.text[i * size:(i + 1) * size], usage_metadata=response.usage_metadata if last else None)
+
+    def _response(self, prompt):
+        regions = _REGIONS.search(prompt)
+        if regions:
+            code = _REGION_END.sub(lambda m: "// migrated by benchmark model\n" + m.group(1), regions.group(1))
+            text = f"```\n{code}\n```"
+        else:
+            match = _ORIGINAL_CODE.search(prompt)
+            lang, code = (match.group(1), match.group(2)) if match else ("", "")
+            if "<<<<<<< SEARCH" in prompt:
+                first_line = code.split("\n", 1)[0]
+                text = f"<<<<<<< SEARCH\n{first_line}\n=======\n{first_line}\n// migrated by benchmark model\n>>>>>>> REPLACE"
+            else:
+                text = f"```{lang}\n{code}\n// migrated by benchmark model\n```"
+        usage = SimpleNamespace(prompt_token_count=len(prompt) // 4, candidates_token_count=len(text) // 4)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+
+class CountingSocket:
+    """Stands in for a browser: counts frames and bytes, and keeps the payloads the driver needs."""
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.phase_one = None
+        self.refactor_complete = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.frames += 1
+        self.bytes += len(text)
+        message = json.loads(text)
+        if message.get("type") == "phase_one_complete":
+            self.phase_one = message["payload"]
+        elif message.get("type") == "refactor_complete":
+            self.refactor_complete = message
+
+
+async def fake_package_docs(pkg_name: str, from_version=None, to_version=None) -> str:
+    return f"# {pkg_name}\n\n## Migrating to {to_version}\n\n" + ("- Renamed an API.\n" * 200)
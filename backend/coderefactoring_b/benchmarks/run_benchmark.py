@@ -0,0 +1,246 @@
+"""
+Offline benchmark for the analysis and refactor pipeline.
+
+Drives run_project_analysis and run_package_refactoring end to end against a generated React
+project, with a deterministic fake LLM and stand-in node/npm/npx executables (POSIX only), and
+reports per-phase wall time, peak RSS, WebSocket frames and refactor throughput.
+
+Run from the service root:
+
+    python benchmarks/run_benchmark.py --files 200 --dependencies 30 --upgrades 5
+    python benchmarks/run_benchmark.py --save-baseline      # record benchmarks/baseline.json
+    python benchmarks/run_benchmark.py                      # compare; exits 1 on a regression
+
+Baselines are machine-specific: record one on the machine that runs the comparison.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import resource
+import statistics
+import tempfile
+
+SERVICE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(SERVICE_ROOT, "benchmarks", "baseline.json")
+
+# Metrics where a larger value is better; everything else is a cost.
+HIGHER_IS_BETTER = {"files_per_minute"}
+# Workload descriptors, reported but not compared.
+INFORMATIONAL = {"files_refactored", "llm_calls_per_run"}
+# Smallest absolute change in a timed phase that can count as a regression; sub-second phases
+# move by more than this on scheduler noise alone.
+MIN_SECONDS_DELTA = 0.25
+# A timed phase must also move by more than this many times its run-to-run spread (max - min
+# over --repeat runs, in the baseline or the current run).
+SPREAD_FACTOR = 2.0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1], formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=100, help="component files in the synthetic project")
+    parser.add_argument("--dependencies", type=int, default=20, help="dependencies in package.json")
+    parser.add_argument("--upgrades", type=int, default=5, help="packages reported outdated and upgraded")
+    parser.add_argument("--file-lines", type=int, default=40, help="filler lines per component")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="fake LLM latency per call, seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="extra deterministic latency, up to this many seconds")
+    parser.add_argument("--prompt-mode", choices=("regions", "full"), default="regions", help="REFACTOR_PROMPT_MODE for the run")
+    parser.add_argument("--install-lines", type=int, default=2000, help="output lines printed by each npm install")
+    parser.add_argument("--install-seconds", type=float, default=1.0, help="duration of each npm install")
+    parser.add_argument("--build-lines", type=int, default=500, help="output lines printed by npm run build")
+    parser.add_argument("--build-seconds", type=float, default=0.5, help="duration of npm run build")
+    parser.add_argument("--warm-pool", action="store_true", help="keep the node_modules pool between runs (measures warm installs)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark; the median is reported")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file to compare against or save to")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown before a metric counts as a regression")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    return parser.parse_args()
+
+
+def prepare_environment(workdir: str, args):
+    """Points every cache and output directory into workdir before the service modules read config."""
+    os.environ.update({
+        "LLM_CACHE_ENABLED": "false",
+        "REFACTOR_PROMPT_MODE": args.prompt_mode,
+        # Cold installs by default, so every run does the same work.
+        "DEPENDENCY_STORE_ENABLED": "true" if args.warm_pool else "false",
+        "DEPENDENCY_STORE_DIR": os.path.join(workdir, "pool"),
+        "REGISTRY_CACHE_DIR": os.path.join(workdir, "registry"),
+        "DOCS_CACHE_DIR": os.path.join(workdir, "docs"),
+        "TELEMETRY_LOG_DIR": os.path.join(workdir, "logs"),
+        "BENCH_INSTALL_LINES": str(args.install_lines),
+        "BENCH_INSTALL_SECONDS": str(args.install_seconds),
+        "BENCH_BUILD_LINES": str(args.build_lines),
+        "BENCH_BUILD_SECONDS": str(args.build_seconds),
+    })
+    sys.path.insert(0, SERVICE_ROOT)
+    os.chdir(SERVICE_ROOT)
+
+
+def phase_times(spans) -> dict:
+    """Wall time per phase: analysis/upgrade and their direct children, summed by name."""
+    times = {}
+    for top in spans:
+        times[top.name] = times.get(top.name, 0) + top.duration
+        for child in top.children:
+            key = f"{top.name}.{child.name}"
+            times[key] = times.get(key, 0) + child.duration
+    return times
+
+
+async def run_once(run_id: int, workdir: str, args) -> dict:
+    from websocket_manager import manager
+    from services.analysis_service import run_project_analysis
+    from services.refactor_service import run_package_refactoring
+    from services.project_index import drop_project_index
+    from services.telemetry import span, trace
+    from benchmarks.synthetic import build_project
+    from benchmarks.fakes import CountingSocket, seed_registry_cache
+
+    archive, dependencies, latest = build_project(args.files, args.dependencies, args.upgrades, args.seed, args.file_lines)
+    seed_registry_cache(os.environ["REGISTRY_CACHE_DIR"], dependencies, latest)
+    exec_id = f"bench-{run_id}"
+    temp_dir = os.path.join(workdir, "temp", exec_id)
+    archive_path = os.path.join(workdir, f"{exec_id}.zip")
+    with open(archive_path, "wb") as f:
+        f.write(archive)
+
+    socket = CountingSocket()
+    await manager.connect(socket, exec_id)
+    started = time.perf_counter()
+    with trace(exec_id) as job_trace:
+        with span("analysis"):
+            await run_project_analysis(exec_id, archive_path, temp_dir)
+        await manager.flush(exec_id, timeout=30)
+        if not socket.phase_one:
+            raise RuntimeError("Analysis did not complete; see the log output above.")
+        packages = [p for p in socket.phase_one["deprecatedDependencies"] if p["name"] in latest]
+        with span("upgrade", packages=len(packages)):
+            await run_package_refactoring(exec_id, packages, temp_dir)
+    total = time.perf_counter() - started
+    await manager.flush(exec_id, timeout=30)
+    manager.disconnect(exec_id, socket)
+    manager.forget(exec_id)
+    drop_project_index(exec_id)
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    if socket.refactor_complete is None:
+        raise RuntimeError("Refactoring did not complete; see the log output above.")
+
+    times = phase_times(job_trace.spans)
+    refactored = sum(
+        1 for top in job_trace.spans for group in top.children if group.name == "refactor_files"
+        for child in group.children if child.name == "refactor_file"
+    )
+    refactor_seconds = times.get("upgrade.refactor_files", 0)
+    return {
+        "total_seconds": total,
+        **{f"{name}_seconds": value for name, value in times.items()},
+        "files_refactored": refactored,
+        "files_per_minute": refactored / refactor_seconds * 60 if refactor_seconds else 0.0,
+        "websocket_frames": socket.frames,
+        "websocket_bytes": socket.bytes,
+    }
+
+
+def peak_rss_mb() -> dict:
+    # ru_maxrss is KB on Linux, bytes on macOS.
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        "peak_child_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+
+async def run_benchmark(workdir: str, args) -> tuple:
+    """Returns (median per metric, max - min per metric) over args.repeat runs."""
+    import services.llm_service as llm_service
+    import services.refactor_service as refactor_service
+    from services.http_client import close_http_client
+    from benchmarks.fakes import FakeModel, fake_package_docs, install_fake_toolchain
+
+    install_fake_toolchain(os.path.join(workdir, "bin"))
+    model = FakeModel(args.llm_latency, args.llm_jitter)
+    llm_service.set_model(model)
+    refactor_service.get_package_docs = fake_package_docs
+    try:
+        runs = [await run_once(i, workdir, args) for i in range(args.repeat)]
+    finally:
+        await close_http_client()
+    keys = sorted({k for run in runs for k in run})
+    results = {k: statistics.median(run.get(k, 0) for run in runs) for k in keys}
+    spread = {k: max(run.get(k, 0) for run in runs) - min(run.get(k, 0) for run in runs) for k in keys}
+    results.update(peak_rss_mb())
+    results["llm_calls_per_run"] = model.calls / args.repeat
+    return results, spread
+
+
+def noise_allowance(key: str, spread: dict, baseline: dict) -> float:
+    """Absolute change a timed metric must exceed before it can count as a regression."""
+    observed = max(spread.get(key, 0), baseline.get("spread", {}).get(key, 0))
+    return max(MIN_SECONDS_DELTA, SPREAD_FACTOR * observed)
+
+
+def compare(results: dict, spread: dict, baseline: dict, tolerance: float) -> list:
+    """Returns (metric, baseline, current, relative change, regressed) for metrics present in both."""
+    rows = []
+    for key in sorted(set(results) & set(baseline["results"]) - INFORMATIONAL):
+        old, new = baseline["results"][key], results[key]
+        if not old:
+            continue
+        change = (new - old) / old
+        regressed = change < -tolerance if key in HIGHER_IS_BETTER else change > tolerance
+        if key.endswith("_seconds") and abs(new - old) <= noise_allowance(key, spread, baseline):
+            regressed = False
+        rows.append((key, old, new, change, regressed))
+    return rows
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="upgrade-bench-")
+    prepare_environment(workdir, args)
+    try:
+        results, spread = asyncio.run(run_benchmark(workdir, args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    parameters = {k: v for k, v in vars(args).items() if k not in ("baseline", "save_baseline", "tolerance", "json")}
+
+    if args.json:
+        print(json.dumps({"parameters": parameters, "results": results}, indent=2))
+    else:
+        print(f"\nBenchmark ({args.repeat} runs, median): {args.files} files, {args.dependencies} dependencies, {args.upgrades} upgrades")
+        for key, value in results.items():
+            print(f"  {key:<40} {value:12.3f}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"parameters": parameters, "results": results, "spread": spread}, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to record one.")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("parameters") != parameters:
+        print("\nWARNING: baseline was recorded with different parameters; comparison may be meaningless.")
+    rows = compare(results, spread, baseline, args.tolerance)
+    print(f"\nCompared with baseline (tolerance {args.tolerance:.0%}):")
+    for key, old, new, change, regressed in rows:
+        print(f"  {key:<40} {old:10.3f} -> {new:10.3f} ({change:+.1%}){'  REGRESSION' if regressed else ''}")
+    regressions = [row for row in rows if row[4]]
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed beyond {args.tolerance:.0%}.")
+        return 1
+    print("\nNo regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
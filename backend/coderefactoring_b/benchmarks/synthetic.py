@@ -0,0 +1,63 @@
+import io
+import json
+import random
+import zipfile
+from typing import Dict, List, Tuple
+
+# Realistic-looking package names; more are generated when a benchmark asks for more dependencies.
+BASE_PACKAGES = [
+    "react-router-dom", "axios", "lodash", "moment", "redux", "react-redux", "formik", "yup",
+    "styled-components", "classnames", "date-fns", "uuid", "react-query", "chart.js", "react-select",
+    "immer", "dayjs", "react-icons", "framer-motion", "zustand",
+]
+
+
+def package_names(count: int) -> List[str]:
+    names = BASE_PACKAGES[:count]
+    names += [f"bench-pkg-{i}" for i in range(len(names), count)]
+    return names
+
+
+def _component(name: str, imports: List[str], mention: str, rng: random.Random, lines: int) -> str:
+    out = ["import React, { useState, useEffect } from 'react';"]
+    for pkg in imports:
+        alias = "".join(part.capitalize() for part in pkg.replace(".", "-").split("-"))
+        out.append(f"import {alias} from '{pkg}';")
+    # Names in comments are common in real code and must not send the file to the LLM.
+    out.append(f"// Formerly built with {mention}; see the migration notes.")
+    out += ["", f"export default function {name}({{ items = [] }}) {{", "  const [state, setState] = useState(null);", ""]
+    out += ["  useEffect(() => {", f"    setState(items.length);", "  }, [items]);", ""]
+    for i in range(lines):
+        out.append(f"  const value{i} = items.map((item) => item.id * {rng.randint(1, 99)}).filter(Boolean);")
+    out += ["", "  return (", f"    <div className=\"{name.lower()}\">", "      {state}", "    </div>", "  );", "}", ""]
+    return "\n".join(out)
+
+
+def build_project(files: int, dependencies: int, upgrades: int, seed: int = 7, file_lines: int = 40) -> Tuple[bytes, Dict[str, str], Dict[str, str]]:
+    """
+    Generates a zipped React project with `files` components importing 1-3 of `dependencies`
+    packages and naming one more in a comment. Returns (zip bytes, dependencies as in package.json, {package: latest} for the
+    first `upgrades` packages, which the seeded registry cache reports as outdated).
+    """
+    rng = random.Random(seed)
+    names = package_names(dependencies)
+    deps = {name: f"^{rng.randint(1, 4)}.{rng.randint(0, 9)}.{rng.randint(0, 9)}" for name in names}
+    deps["react"] = "^17.0.2"
+    latest = {name: f"{int(deps[name][1:].split('.')[0]) + 1}.0.0" for name in names[:upgrades]}
+    manifest = {
+        "name": "bench-app",
+        "version": "1.0.0",
+        "private": True,
+        "dependencies": deps,
+        "scripts": {"build": "react-scripts build"},
+    }
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("bench-app/package.json", json.dumps(manifest, indent=2))
+        for i in range(files):
+            imports = rng.sample(names, k=min(len(names), rng.randint(1, 3))) if names else []
+            mention = rng.choice(names) if names else "react"
+            zf.writestr(f"bench-app/src/components/Component{i}.jsx", _component(f"Component{i}", imports, mention, rng, file_lines))
+        zf.writestr("bench-app/src/index.js", "import React from 'react';\nimport App from './components/Component0';\n")
+    return buffer.getvalue(), deps, latest
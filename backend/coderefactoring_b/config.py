@@ -0,0 +1,133 @@
+import os
+
+# --- Refactoring ---
+# Number of files refactored concurrently per package. 1 restores the old sequential behaviour.
+REFACTOR_CONCURRENCY = max(1, int(os.getenv("REFACTOR_CONCURRENCY", 4)))
+
+# --- LLM result cache ---
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "./cache/llm")
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# --- HTTP / npm registry ---
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 50))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", 10))
+NPM_REGISTRY_URL = os.getenv("NPM_REGISTRY_URL", "https://registry.npmjs.org")
+REGISTRY_CONCURRENCY = int(os.getenv("REGISTRY_CONCURRENCY", 16))
+REGISTRY_CACHE_TTL_SECONDS = int(os.getenv("REGISTRY_CACHE_TTL_SECONDS", 60 * 60))
+REGISTRY_CACHE_DIR = os.getenv("REGISTRY_CACHE_DIR", "./cache/registry")
+
+# --- Package documentation ---
+DOCS_CDN_URL = os.getenv("DOCS_CDN_URL", "https://cdn.jsdelivr.net/npm")
+DOCS_LISTING_URL = os.getenv("DOCS_LISTING_URL", "https://data.jsdelivr.com/v1/packages/npm")
+DOCS_CACHE_DIR = os.getenv("DOCS_CACHE_DIR", "./cache/docs")
+DOCS_MAX_CHARS = int(os.getenv("DOCS_MAX_CHARS", 4000))
+
+# --- Project upload & extraction ---
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", 1024 * 1024))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 512 * 1024 * 1024))
+EXTRACT_MAX_BYTES = int(os.getenv("EXTRACT_MAX_BYTES", 1024 * 1024 * 1024))
+EXTRACT_MAX_FILES = int(os.getenv("EXTRACT_MAX_FILES", 50000))
+EXTRACT_MAX_RATIO = float(os.getenv("EXTRACT_MAX_RATIO", 100))
+
+# --- Upgraded project download ---
+RESULT_RETENTION_SECONDS = int(os.getenv("RESULT_RETENTION_SECONDS", 30 * 60))
+
+# --- node_modules warm pool ---
+DEPENDENCY_STORE_ENABLED = os.getenv("DEPENDENCY_STORE_ENABLED", "true").lower() == "true"
+DEPENDENCY_STORE_DIR = os.getenv("DEPENDENCY_STORE_DIR", "./cache/node_modules")
+DEPENDENCY_STORE_MAX_BYTES = int(os.getenv("DEPENDENCY_STORE_MAX_BYTES", 10 * 1024 * 1024 * 1024))
+# "hardlink" shares inodes with the pool (fastest; npm replaces files rather than editing them),
+# "copy" gives every job private files (use when postinstall scripts patch node_modules in place).
+DEPENDENCY_STORE_LINK_MODE = os.getenv("DEPENDENCY_STORE_LINK_MODE", "hardlink")
+
+# --- Command output streaming ---
+LOG_FLUSH_INTERVAL_SECONDS = float(os.getenv("LOG_FLUSH_INTERVAL_SECONDS", 0.25))
+LOG_BATCH_MAX_LINES = int(os.getenv("LOG_BATCH_MAX_LINES", 200))
+LOG_BATCH_MAX_BYTES = int(os.getenv("LOG_BATCH_MAX_BYTES", 16 * 1024))
+LOG_RETAIN_LINES = int(os.getenv("LOG_RETAIN_LINES", 2000))
+LOG_ERROR_TAIL_CHARS = int(os.getenv("LOG_ERROR_TAIL_CHARS", 2000))
+
+# --- Job scheduling ---
+MAX_CONCURRENT_JOBS = max(1, int(os.getenv("MAX_CONCURRENT_JOBS", 2)))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", 10))
+JOB_UPGRADE_WAIT_SECONDS = int(os.getenv("JOB_UPGRADE_WAIT_SECONDS", 30 * 60))
+JOB_EVENT_HISTORY = int(os.getenv("JOB_EVENT_HISTORY", 5000))
+
+# --- WebSocket delivery ---
+WS_SEND_QUEUE_MAX = int(os.getenv("WS_SEND_QUEUE_MAX", 500))
+# Non-droppable events may queue past WS_SEND_QUEUE_MAX up to this limit (enough to replay a full job
+# history); beyond it the oldest events are skipped for that client too.
+WS_SEND_QUEUE_HARD_MAX = int(os.getenv("WS_SEND_QUEUE_HARD_MAX", 5000))
+
+# --- Commands ---
+COMMAND_TIMEOUT_SECONDS = int(os.getenv("COMMAND_TIMEOUT_SECONDS", 300))
+# A running job nobody is subscribed to is cancelled after this long.
+JOB_ORPHAN_GRACE_SECONDS = int(os.getenv("JOB_ORPHAN_GRACE_SECONDS", 600))
+
+# --- Telemetry ---
+TELEMETRY_LOG_DIR = os.getenv("TELEMETRY_LOG_DIR", "./logs")
+# Time every module's first import for the /startup report. Off by default: it hooks every import
+# (a small cost each), and warnings a module raises for its importer then point at the timer
+# instead. Turn it on when investigating slow cold starts.
+STARTUP_PROFILE_IMPORTS = os.getenv("STARTUP_PROFILE_IMPORTS", "false").lower() == "true"
+
+# --- LLM refactoring prompts ---
+LLM_MAX_OUTPUT_TOKENS = int(os.getenv("LLM_MAX_OUTPUT_TOKENS", 8192))
+
+# --- LLM client ---
+# Process-wide quotas shared by all jobs (0 disables a limit). Tokens are estimated from the prompt
+# up front and corrected with the usage the model reports.
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", 300))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 2_000_000))
+# Concurrent requests: starts at LLM_CONCURRENCY, grows while calls succeed and halves on 429/503.
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 8))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", 1))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 32))
+LLM_CALL_TIMEOUT_SECONDS = float(os.getenv("LLM_CALL_TIMEOUT_SECONDS", 120))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 4))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", 1.0))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", 30.0))
+# Send a second identical request when the first has not answered after this long (0 = off).
+LLM_HEDGE_AFTER_SECONDS = float(os.getenv("LLM_HEDGE_AFTER_SECONDS", 0))
+# Stream responses, so progress is reported as they are generated and malformed ones are cut short.
+# Streamed calls are not hedged.
+LLM_STREAMING = os.getenv("LLM_STREAMING", "true").lower() == "true"
+LLM_PROGRESS_INTERVAL_SECONDS = float(os.getenv("LLM_PROGRESS_INTERVAL_SECONDS", 1.0))
+# Initialize Vertex AI in the background at startup, instead of on the first refactor.
+LLM_WARMUP = os.getenv("LLM_WARMUP", "false").lower() == "true"
+# "regions": large files are sent as just their imports plus the top-level regions that use the
+# package; "full": every file is sent and returned whole.
+REFACTOR_PROMPT_MODE = os.getenv("REFACTOR_PROMPT_MODE", "regions")
+# Files below this size are always sent whole.
+REFACTOR_REGION_MIN_FILE_CHARS = int(os.getenv("REFACTOR_REGION_MIN_FILE_CHARS", 6000))
+# Region code per call (~4 chars per token), so the rewrite stays well under LLM_MAX_OUTPUT_TOKENS.
+REFACTOR_REGION_BUDGET_CHARS = int(os.getenv("REFACTOR_REGION_BUDGET_CHARS", 16000))
+# How whole-file prompts are answered: "edits" (search/replace blocks applied locally, falling back
+# to a full rewrite when they do not apply) or "code" (the complete file).
+REFACTOR_OUTPUT_FORMAT = os.getenv("REFACTOR_OUTPUT_FORMAT", "edits")
+# Refactor each file once for all the selected packages it imports, instead of once per package.
+REFACTOR_COMBINE_PACKAGES = os.getenv("REFACTOR_COMBINE_PACKAGES", "true").lower() == "true"
+# A combined prompt (whole file plus every package's docs, ~4 chars per token) larger than this is
+# split into several calls, down to one per package.
+REFACTOR_PROMPT_MAX_TOKENS = int(os.getenv("REFACTOR_PROMPT_MAX_TOKENS", 32000))
+# Per-file patches sent to the client are cut to this size.
+REFACTOR_PATCH_MAX_CHARS = int(os.getenv("REFACTOR_PATCH_MAX_CHARS", 20000))
+
+# --- Build verification ---
+# Check the changed files (syntax, then the project's tsc --noEmit or an esbuild parse) before
+# running the full build, so broken output fails in seconds.
+VERIFY_FAST_CHECKS = os.getenv("VERIFY_FAST_CHECKS", "true").lower() == "true"
+VERIFY_CHECK_TIMEOUT_SECONDS = int(os.getenv("VERIFY_CHECK_TIMEOUT_SECONDS", 180))
+# tsc build info and build tool caches, per exec_id, so retries of a job start warm.
+VERIFY_CACHE_DIR = os.getenv("VERIFY_CACHE_DIR", "./cache/verify")
+VERIFY_CACHE_TTL_SECONDS = int(os.getenv("VERIFY_CACHE_TTL_SECONDS", 24 * 60 * 60))
+
+# --- Build repair ---
+# After a failed verification, the files with errors are sent back to the model with their errors,
+# then verified again, for at most this many rounds and this much time in total.
+REPAIR_ENABLED = os.getenv("REPAIR_ENABLED", "true").lower() == "true"
+REPAIR_MAX_ROUNDS = int(os.getenv("REPAIR_MAX_ROUNDS", 3))
+REPAIR_TIME_BUDGET_SECONDS = int(os.getenv("REPAIR_TIME_BUDGET_SECONDS", 600))
+# Files repaired per round; more failing files than this usually means the upgrade itself is wrong.
+REPAIR_MAX_FILES = int(os.getenv("REPAIR_MAX_FILES", 20))
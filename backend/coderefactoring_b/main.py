@@ -1,7 +1,19 @@
+# Imported first, so the import timer sees every module loaded after it.
+from services.startup import timed_init, mark_ready, startup_report
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from api import routes
+from services.http_client import close_http_client
+from services.toolchain import get_toolchain
+from websocket_manager import manager
+from services.job_service import scheduler
+from services.telemetry import render_metrics
+from services.llm_client import llm_client
+from services.llm_service import load_model
+from config import LLM_WARMUP
 import os
+import asyncio
 import logging
 
 # Configure logging
@@ -35,6 +47,29 @@ app.add_middleware(
 # Include the API router
 app.include_router(routes.router)
 
+@app.on_event("startup")
+async def probe_toolchain_versions():
+    # Probe node/npm once up front so jobs read the cached versions.
+    with timed_init("toolchain"):
+        await get_toolchain()
+
+def _log_warmup_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"LLM warm-up failed: {task.exception()}")
+
+@app.on_event("startup")
+async def warm_up_llm():
+    if LLM_WARMUP:
+        # In the background, so the service is ready before the SDK is. The reference keeps the
+        # task from being garbage collected before it finishes.
+        app.state.llm_warmup = asyncio.create_task(load_model())
+        app.state.llm_warmup.add_done_callback(_log_warmup_failure)
+    mark_ready()
+
+@app.on_event("shutdown")
+async def close_shared_clients():
+    await close_http_client()
+
 @app.get("/")
 def read_root():
     return {"message": "Upgrade Agent Backend is running"}
@@ -44,9 +79,33 @@ def health_check():
     return {
         "status": "healthy",
         "service": "code-refactoring",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "websocket": manager.stats(),
     }
 
+@app.get("/startup")
+def startup_times():
+    """Where startup time went: import time by module and initialization steps (lazy ones once run)."""
+    return startup_report()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus scrape endpoint: phase duration histograms, LLM usage and live queue gauges."""
+    ws_stats = manager.stats()
+    job_stats = scheduler.stats()
+    llm_stats = llm_client.stats()
+    return render_metrics({
+        "upgrade_websocket_connections": ws_stats["connections"],
+        "upgrade_websocket_queued_messages": ws_stats["queuedMessages"],
+        "upgrade_websocket_max_queue_depth": ws_stats["maxQueueDepth"],
+        "upgrade_websocket_sent_messages": ws_stats["sentMessages"],
+        "upgrade_websocket_dropped_messages": ws_stats["droppedMessages"],
+        "upgrade_jobs_running": job_stats["running"],
+        "upgrade_jobs_queued": job_stats["queued"],
+        "upgrade_llm_concurrency_limit": llm_stats["concurrencyLimit"],
+        "upgrade_llm_in_flight": llm_stats["inFlight"],
+    })
+
 # For local development
 if __name__ == "__main__":
     import uvicorn
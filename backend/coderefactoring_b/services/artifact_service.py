@@ -0,0 +1,115 @@
+import os
+import time
+import shutil
+import asyncio
+import zipfile
+import logging
+from typing import Dict, Iterator, List, Optional
+from services.upload_service import SKIPPED_ARCHIVE_FILES, is_skipped_dir
+from services.telemetry import record_duration
+from config import RESULT_RETENTION_SECONDS
+
+logger = logging.getLogger(__name__)
+
+ZIP_READ_CHUNK_BYTES = 256 * 1024
+# Always part of a patch-only archive so the upgraded dependency set travels with the code.
+PATCH_MANIFEST_FILES = ("package.json", "package-lock.json")
+
+_results: Dict[str, dict] = {}
+
+
+# --- Upgrade results ---
+
+def register_upgrade_result(exec_id: str, project_root: str, changed_files: List[str]):
+    _results[exec_id] = {
+        "project_root": project_root,
+        "changed_files": sorted(set(changed_files)),
+        "created_at": time.time(),
+    }
+
+
+def get_upgrade_result(exec_id: str) -> Optional[dict]:
+    return _results.get(exec_id)
+
+
+def discard_upgrade_result(exec_id: str):
+    _results.pop(exec_id, None)
+
+
+def schedule_result_cleanup(exec_id: str, temp_dir: str, delay: int = RESULT_RETENTION_SECONDS) -> asyncio.Task:
+    """Keeps an upgraded project downloadable for `delay` seconds after its job ends, then removes it."""
+    async def cleanup():
+        await asyncio.sleep(delay)
+        discard_upgrade_result(exec_id)
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            logger.info(f"Removed expired upgrade result: {temp_dir}")
+    return asyncio.create_task(cleanup())
+
+
+# --- Archive streaming ---
+
+def list_export_files(project_root: str) -> List[str]:
+    """Project files (relative paths) to ship back, without dependencies, VCS data or build output."""
+    files = []
+    for root, dirs, names in os.walk(project_root):
+        in_project_root = "package.json" in names
+        dirs[:] = sorted(d for d in dirs if not is_skipped_dir(d, in_project_root))
+        for name in sorted(names):
+            if name not in SKIPPED_ARCHIVE_FILES:
+                files.append(os.path.relpath(os.path.join(root, name), project_root))
+    return files
+
+
+def list_patch_files(project_root: str, changed_files: List[str]) -> List[str]:
+    files = list(dict.fromkeys([*changed_files, *PATCH_MANIFEST_FILES]))
+    return [f for f in files if os.path.isfile(os.path.join(project_root, f))]
+
+
+class _ZipStream:
+    """Write-only sink for ZipFile; not seekable, so zipfile writes data descriptors and we can stream."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> Iterator[bytes]:
+        if self._buffer:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            yield data
+
+
+def iter_project_zip(project_root: str, files: List[str]) -> Iterator[bytes]:
+    """Yields a zip of `files` (relative to project_root) chunk by chunk as it is generated."""
+    stream = _ZipStream()
+    started = time.perf_counter()
+    status = "error"
+    try:
+        with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as zf:
+            for rel_path in files:
+                path = os.path.join(project_root, rel_path)
+                try:
+                    info = zipfile.ZipInfo.from_file(path, rel_path.replace(os.sep, "/"))
+                except OSError:
+                    continue
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with open(path, "rb") as src, zf.open(info, "w") as dst:
+                    while True:
+                        block = src.read(ZIP_READ_CHUNK_BYTES)
+                        if not block:
+                            break
+                        dst.write(block)
+                        yield from stream.drain()
+                yield from stream.drain()
+        yield from stream.drain()
+        status = "ok"
+    finally:
+        # Includes time the client took to read; a span cannot stay open across the response.
+        record_duration("zip", time.perf_counter() - started, status)
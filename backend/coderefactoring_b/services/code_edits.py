@@ -0,0 +1,77 @@
+import re
+import difflib
+from typing import List, Optional, Tuple
+
+# Search/replace edit blocks, as returned by the model in "edits" output mode:
+#
+#   <<<<<<< SEARCH
+#   exact lines from the original file
+#   =======
+#   replacement lines
+#   >>>>>>> REPLACE
+EDIT_BLOCK = re.compile(r"^<{7} SEARCH\n(.*?)^={7}\n(.*?)^>{7} REPLACE$", re.DOTALL | re.MULTILINE)
+NO_CHANGES_MARKER = "NO_CHANGES"
+
+
+class EditApplyError(ValueError):
+    """An edit's search text was not found exactly once in the file."""
+
+
+def parse_edit_blocks(response_text: str) -> Optional[List[Tuple[str, str]]]:
+    """
+    (search, replace) pairs from a model response; [] when the model reported NO_CHANGES,
+    None when the response contains neither.
+    """
+    edits = [(m.group(1), m.group(2)) for m in EDIT_BLOCK.finditer(response_text.replace("\r\n", "\n"))]
+    if edits:
+        return edits
+    return [] if NO_CHANGES_MARKER in response_text else None
+
+
+def _find_lines(lines: List[str], needle: List[str]) -> List[int]:
+    """Start indexes where needle occurs in lines, comparing with trailing whitespace ignored."""
+    wanted = [l.rstrip() for l in needle]
+    stripped = [l.rstrip() for l in lines]
+    return [i for i in range(len(lines) - len(needle) + 1) if stripped[i:i + len(needle)] == wanted]
+
+
+def apply_edits(content: str, edits: List[Tuple[str, str]]) -> str:
+    """
+    Applies edits in order. Each search text must occur exactly once, either verbatim or line by
+    line with trailing whitespace ignored. Raises EditApplyError otherwise.
+    """
+    for number, (search, replace) in enumerate(edits, start=1):
+        if not search.strip():
+            raise EditApplyError(f"edit {number} has an empty search block")
+        occurrences = content.count(search)
+        if occurrences == 1:
+            content = content.replace(search, replace, 1)
+            continue
+        if occurrences > 1:
+            raise EditApplyError(f"edit {number} matches {occurrences} places")
+        lines = content.splitlines(keepends=True)
+        needle = search.splitlines()
+        matches = _find_lines(lines, needle)
+        if len(matches) != 1:
+            raise EditApplyError(f"edit {number} matches {len(matches)} places")
+        start = matches[0]
+        end = start + len(needle)
+        ending = "\n" if lines[end - 1].endswith("\n") else ""
+        replacement = replace if replace.endswith("\n") or not replace else replace + ending
+        content = "".join(lines[:start]) + replacement + "".join(lines[end:])
+    return content
+
+
+def diff_stats(original: str, refactored: str, path: str, max_patch_chars: int) -> dict:
+    """Line counts from a real diff, plus the unified patch (cut to max_patch_chars)."""
+    patch_lines = list(difflib.unified_diff(
+        original.splitlines(keepends=True), refactored.splitlines(keepends=True),
+        fromfile=f"a/{path}", tofile=f"b/{path}",
+    ))
+    added = sum(1 for l in patch_lines if l.startswith("+") and not l.startswith("+++"))
+    removed = sum(1 for l in patch_lines if l.startswith("-") and not l.startswith("---"))
+    patch = "".join(l if l.endswith("\n") else l + "\n\\ No newline at end of file\n" for l in patch_lines)
+    truncated = len(patch) > max_patch_chars
+    if truncated:
+        patch = patch[:max_patch_chars] + "\n... (patch truncated)\n"
+    return {"added": added, "removed": removed, "patch": patch, "patchTruncated": truncated}
@@ -0,0 +1,105 @@
+import re
+import shutil
+import asyncio
+import logging
+from typing import Dict, List, Optional
+from services.log_stream import LogStreamer, RetainedLines, error_tail
+from config import COMMAND_TIMEOUT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+async def _spawn(command: List[str], cwd: Optional[str]) -> asyncio.subprocess.Process:
+    # Resolve through PATH (and PATHEXT on Windows, where npm/npx are .cmd shims) without a shell.
+    executable = shutil.which(command[0])
+    if executable is None:
+        raise FileNotFoundError(f"{command[0]} not found on PATH")
+    return await asyncio.create_subprocess_exec(
+        executable, *command[1:],
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+    )
+
+
+async def _terminate(process: asyncio.subprocess.Process):
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        await process.wait()
+
+
+async def run_command(command: List[str], cwd: str = None, timeout: float = COMMAND_TIMEOUT_SECONDS) -> Dict[str, any]:
+    """
+    Runs a command (argument list, no shell) and collects its output without blocking the event loop.
+    The process is killed on timeout, or if the calling task is cancelled.
+    """
+    logger.info(f"Running command: {' '.join(command)} in {cwd}")
+    try:
+        process = await _spawn(command, cwd)
+    except OSError as e:
+        logger.error(f"Command failed: {e}")
+        return {"success": False, "stdout": "", "stderr": str(e), "return_code": -1}
+    try:
+        stdout_bytes, stderr_bytes = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        logger.error(f"Command timed out after {timeout}s: {' '.join(command)}")
+        return {"success": False, "stdout": "", "stderr": "Command timed out", "return_code": -1}
+    finally:
+        await _terminate(process)
+    return {
+        "success": process.returncode == 0,
+        "stdout": stdout_bytes.decode("utf-8", errors="replace"),
+        "stderr": stderr_bytes.decode("utf-8", errors="replace"),
+        "return_code": process.returncode,
+    }
+
+
+async def run_command_streamed(command: List[str], cwd: str, exec_id: str, keep_pattern: Optional[re.Pattern] = None):
+    """
+    Runs a command and streams its stdout/stderr to the client in batched log frames.
+    Returns the retained stdout, stderr (the last LOG_RETAIN_LINES lines of each, plus any
+    stderr lines matching keep_pattern) and the exit code upon completion. Cancelling the
+    calling task kills the process.
+    """
+    logger.info(f"Streaming command: {' '.join(command)} in {cwd}")
+    try:
+        process = await _spawn(command, cwd)
+    except OSError as e:
+        logger.error(f"Error running streamed command: {e}")
+        return "", str(e), -1
+
+    stdout_lines = RetainedLines()
+    stderr_lines = RetainedLines(keep_pattern=keep_pattern)
+    try:
+        async with LogStreamer(exec_id, ' '.join(command[:2])) as streamer:
+            async def read_stream(stream, retained, status_type):
+                while True:
+                    line_bytes = await stream.readline()
+                    if not line_bytes:
+                        break
+                    line = line_bytes.decode('utf-8', errors='replace').strip()
+                    if line:  # Only add non-empty lines
+                        retained.append(line)
+                        await streamer.add(line, status_type)
+
+            # Run stream readers concurrently
+            await asyncio.gather(
+                read_stream(process.stdout, stdout_lines, "info"),
+                read_stream(process.stderr, stderr_lines, "warning")
+            )
+            await process.wait()
+        await streamer.send_summary(stdout_lines.dropped + stderr_lines.dropped)
+    except Exception as e:
+        logger.error(f"Error running streamed command: {e}")
+        return "", str(e), -1
+    finally:
+        await _terminate(process)
+
+    full_stdout = stdout_lines.text()
+    full_stderr = stderr_lines.text()
+    if process.returncode != 0:
+        logger.error(f"Command failed with exit code {process.returncode}: {error_tail(full_stderr)}")
+    return full_stdout, full_stderr, process.returncode
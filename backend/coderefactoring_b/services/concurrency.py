@@ -0,0 +1,53 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Tuple, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+async def bounded_map_ordered(
+    func: Callable[[T], Awaitable[R]],
+    items: Iterable[T],
+    limit: int,
+) -> AsyncIterator[Tuple[int, T, R]]:
+    """
+    Runs `func` over `items` with at most `limit` calls in flight.
+    Results are yielded as (index, item, result) in input order, while the work itself
+    completes in whatever order it finishes. Exceptions raised by `func` are re-raised
+    when their item's turn comes up; remaining workers are cancelled on exit.
+    """
+    items = list(items)
+    if not items:
+        return
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for index, item in enumerate(items):
+        queue.put_nowait((index, item))
+    loop = asyncio.get_running_loop()
+    futures = [loop.create_future() for _ in items]
+
+    async def worker():
+        while True:
+            try:
+                index, item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                futures[index].set_result(await func(item))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                futures[index].set_exception(e)
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(max(1, limit), len(items)))]
+    try:
+        for index, item in enumerate(items):
+            yield index, item, await futures[index]
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for future in futures:
+            # Mark unconsumed failures as retrieved so they are not reported as never-awaited.
+            if future.done() and not future.cancelled():
+                future.exception()
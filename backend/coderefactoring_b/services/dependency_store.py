@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from collections import Counter
+from typing import Optional, Sequence
+from config import DEPENDENCY_STORE_ENABLED, DEPENDENCY_STORE_DIR, DEPENDENCY_STORE_MAX_BYTES, DEPENDENCY_STORE_LINK_MODE
+
+logger = logging.getLogger(__name__)
+
+# package.json fields that decide what ends up in node_modules.
+DEPENDENCY_FIELDS = (
+    "dependencies", "devDependencies", "optionalDependencies", "peerDependencies",
+    "bundleDependencies", "bundledDependencies", "overrides", "resolutions", "workspaces",
+)
+LOCKFILE_NAME = "package-lock.json"
+META_FILE = "meta.json"
+# Evicted entries are renamed to this prefix before they are deleted.
+EVICTING_PREFIX = ".evicting-"
+
+
+def dependency_set_key(project_root: str, extra: Sequence[str] = ()) -> Optional[str]:
+    """
+    Hashes the dependency-relevant parts of package.json (plus package-lock.json and .npmrc when
+    present) together with `extra` (toolchain versions, install flags). None if package.json is
+    unreadable.
+    """
+    try:
+        with open(os.path.join(project_root, "package.json"), "r", encoding="utf-8") as f:
+            pkg_data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    digest = hashlib.sha256()
+    digest.update(json.dumps({k: pkg_data.get(k) for k in DEPENDENCY_FIELDS}, sort_keys=True).encode("utf-8"))
+    for name in (LOCKFILE_NAME, ".npmrc"):
+        path = os.path.join(project_root, name)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                digest.update(name.encode("utf-8") + b"\0" + f.read())
+    for value in extra:
+        digest.update(b"\0" + str(value).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Cross-device or unsupported filesystem.
+        shutil.copy2(src, dst)
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class DependencyStore:
+    """
+    Content-addressed pool of installed node_modules trees. Each entry lives in <root>/<key>/ with
+    the node_modules tree, the package-lock.json npm produced and a meta.json (size, install log).
+    Projects are populated by hard-linking (or copying) an entry; entries are evicted least recently
+    used first once the pool exceeds max_bytes, except those a restore is reading from right now.
+    """
+
+    def __init__(self, root: str, max_bytes: int, link_mode: str = "hardlink"):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.copy_function = _link_or_copy if link_mode == "hardlink" else shutil.copy2
+        # Restores in progress per key; restore and evict run in worker threads.
+        self._lock = threading.Lock()
+        self._pins: Counter = Counter()
+        os.makedirs(root, exist_ok=True)
+
+    def _copy_tree(self, source: str, target: str):
+        """
+        Copies a node_modules tree with copy_function, except the top-level `.`-entries
+        (.package-lock.json, .cache, ...): npm and build tools rewrite those in place, which would
+        change the pool entry (or a project restored from it) through a shared hard link.
+        """
+        def copy(src: str, dst: str):
+            if os.path.relpath(src, source).startswith("."):
+                return shutil.copy2(src, dst)
+            return self.copy_function(src, dst)
+        shutil.copytree(source, target, symlinks=True, copy_function=copy)
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def _read_meta(self, key: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(self._entry(key), META_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def restore(self, key: str, project_root: str) -> Optional[dict]:
+        """
+        Populates project_root/node_modules (and package-lock.json) from the pool.
+        Returns the entry's metadata on a hit, None on a miss or a failed restore. Blocking.
+        The entry is pinned meanwhile, so evict() cannot remove it mid-copy.
+        """
+        with self._lock:
+            self._pins[key] += 1
+        try:
+            return self._restore(key, project_root)
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+
+    def _restore(self, key: str, project_root: str) -> Optional[dict]:
+        entry = self._entry(key)
+        meta = self._read_meta(key)
+        if meta is None or not os.path.isdir(os.path.join(entry, "node_modules")):
+            return None
+        target = os.path.join(project_root, "node_modules")
+        try:
+            if os.path.exists(target):
+                shutil.rmtree(target)
+            self._copy_tree(os.path.join(entry, "node_modules"), target)
+            lockfile = os.path.join(entry, LOCKFILE_NAME)
+            if os.path.isfile(lockfile):
+                shutil.copy2(lockfile, os.path.join(project_root, LOCKFILE_NAME))
+            os.utime(os.path.join(entry, META_FILE))
+        except OSError as e:
+            logger.warning(f"Could not restore node_modules {key[:12]} from pool: {e}")
+            shutil.rmtree(target, ignore_errors=True)
+            return None
+        logger.info(f"Restored node_modules {key[:12]} from pool into {project_root}")
+        return meta
+
+    def save(self, key: str, project_root: str, install_log: str = ""):
+        """Adds a freshly installed project's node_modules to the pool, then enforces the disk budget. Blocking."""
+        entry = self._entry(key)
+        source = os.path.join(project_root, "node_modules")
+        if os.path.isdir(entry) or not os.path.isdir(source):
+            return
+        staging = os.path.join(self.root, f".staging-{key}-{uuid.uuid4().hex[:8]}")
+        try:
+            os.makedirs(staging)
+            self._copy_tree(source, os.path.join(staging, "node_modules"))
+            lockfile = os.path.join(project_root, LOCKFILE_NAME)
+            if os.path.isfile(lockfile):
+                shutil.copy2(lockfile, os.path.join(staging, LOCKFILE_NAME))
+            with open(os.path.join(staging, META_FILE), "w", encoding="utf-8") as f:
+                json.dump({"size": _tree_size(staging), "created_at": time.time(), "install_log": install_log}, f)
+            os.rename(staging, entry)
+        except OSError as e:
+            # Another job may have published the same key first; that copy is just as good.
+            if not os.path.isdir(entry):
+                logger.warning(f"Could not add node_modules {key[:12]} to pool: {e}")
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        logger.info(f"Added node_modules {key[:12]} to pool")
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used entries until the pool fits max_bytes, skipping pinned ones.
+        Victims are chosen and renamed aside under the lock (a restore then sees a miss, never a
+        half-deleted tree) and deleted after it is released.
+        """
+        victims = []
+        with self._lock:
+            entries = []
+            for key in os.listdir(self.root):
+                if key.startswith(EVICTING_PREFIX):
+                    # Left behind by an interrupted eviction.
+                    victims.append(os.path.join(self.root, key))
+                if key.startswith("."):
+                    continue
+                meta_path = os.path.join(self._entry(key), META_FILE)
+                meta = self._read_meta(key)
+                try:
+                    last_used = os.stat(meta_path).st_mtime
+                except OSError:
+                    last_used = 0
+                entries.append((last_used, key, (meta or {}).get("size", 0)))
+            total = sum(size for *_, size in entries)
+            for _, key, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if self._pins[key]:
+                    continue
+                doomed = os.path.join(self.root, f"{EVICTING_PREFIX}{key}-{uuid.uuid4().hex[:8]}")
+                try:
+                    os.rename(self._entry(key), doomed)
+                except OSError as e:
+                    logger.warning(f"Could not evict node_modules {key[:12]} from pool: {e}")
+                    continue
+                victims.append(doomed)
+                total -= size
+                logger.info(f"Evicted node_modules {key[:12]} from pool")
+        for path in victims:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+_store: Optional[DependencyStore] = None
+_store_failed = False
+
+
+def get_dependency_store() -> Optional[DependencyStore]:
+    """Returns the shared pool, or None when disabled or the pool directory is unavailable."""
+    global _store, _store_failed
+    if not DEPENDENCY_STORE_ENABLED or _store_failed:
+        return None
+    if _store is None:
+        try:
+            _store = DependencyStore(DEPENDENCY_STORE_DIR, DEPENDENCY_STORE_MAX_BYTES, DEPENDENCY_STORE_LINK_MODE)
+        except OSError as e:
+            logger.error(f"node_modules pool disabled, could not open {DEPENDENCY_STORE_DIR}: {e}")
+            _store_failed = True
+    return _store
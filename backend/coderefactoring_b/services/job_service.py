@@ -0,0 +1,248 @@
+import os
+import time
+import shutil
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set
+from websocket_manager import manager
+from services.analysis_service import run_project_analysis
+from services.refactor_service import run_package_refactoring
+from services.project_index import drop_project_index
+from services.artifact_service import get_upgrade_result, schedule_result_cleanup
+from services.telemetry import span, trace
+from config import MAX_CONCURRENT_JOBS, MAX_QUEUED_JOBS, JOB_UPGRADE_WAIT_SECONDS, JOB_ORPHAN_GRACE_SECONDS, RESULT_RETENTION_SECONDS
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = {"completed", "failed", "cancelled", "expired"}
+
+# Fire-and-forget tasks, referenced until they finish so they are not garbage-collected mid-run.
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def _keep(task: asyncio.Task) -> asyncio.Task:
+    _background_tasks.add(task)
+    task.add_done_callback(_background_done)
+    return task
+
+
+def _background_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Background task failed", exc_info=task.exception())
+
+
+class JobRejectedError(Exception):
+    """The scheduler queue is full; the client should retry later."""
+
+
+@dataclass
+class Job:
+    exec_id: str
+    temp_dir: str
+    upload_path: str
+    status: str = "queued"
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    commands: asyncio.Queue = field(default_factory=asyncio.Queue)
+    task: Optional[asyncio.Task] = None
+    orphan_timer: Optional[asyncio.TimerHandle] = None
+
+    def set_status(self, status: str):
+        self.status = status
+        self.updated_at = time.time()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+
+class JobScheduler:
+    """
+    Bounds how many job phases (analysis, upgrade) run at once. Jobs beyond MAX_CONCURRENT_JOBS wait
+    in a FIFO queue and are told their position as it changes; new jobs are refused once
+    MAX_QUEUED_JOBS are already waiting.
+    """
+
+    def __init__(self, max_running: int = MAX_CONCURRENT_JOBS, max_queued: int = MAX_QUEUED_JOBS):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.running = 0
+        self._waiters: deque = deque()
+
+    def can_admit(self) -> bool:
+        return len(self._waiters) < self.max_queued
+
+    def queue_position(self, job: Job) -> Optional[int]:
+        for position, (waiting_job, _) in enumerate(self._waiters, start=1):
+            if waiting_job is job:
+                return position
+        return None
+
+    async def _report_positions(self):
+        for position, (job, _) in enumerate(list(self._waiters), start=1):
+            await manager.send_json(job.exec_id, {
+                "type": "log", "status": "info",
+                "message": f"Waiting for a free worker (position {position} in queue)...",
+                "queuePosition": position,
+            })
+
+    async def acquire(self, job: Job, admit: bool = True):
+        """Takes a worker slot, queueing if none is free. admit=False skips admission control for already-admitted jobs."""
+        if self.running < self.max_running and not self._waiters:
+            self.running += 1
+            return
+        if admit and not self.can_admit():
+            raise JobRejectedError("The server is busy. Please try again in a few minutes.")
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((job, future))
+        await self._report_positions()
+        try:
+            with span("queue_wait", position=len(self._waiters)):
+                await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we were cancelled; pass it on.
+                self.release()
+            else:
+                self._waiters = deque(w for w in self._waiters if w[1] is not future)
+            raise
+
+    def release(self):
+        self.running -= 1
+        while self._waiters:
+            _, future = self._waiters.popleft()
+            if not future.done():
+                self.running += 1
+                future.set_result(None)
+                break
+        if self._waiters:
+            _keep(asyncio.create_task(self._report_positions()))
+
+    @asynccontextmanager
+    async def slot(self, job: Job, admit: bool = True):
+        await self.acquire(job, admit)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {"running": self.running, "queued": len(self._waiters), "maxRunning": self.max_running, "maxQueued": self.max_queued}
+
+
+class JobRegistry:
+    """Jobs keyed by exec_id. Each job runs in its own task, independent of any WebSocket."""
+
+    def __init__(self, scheduler: JobScheduler):
+        self.scheduler = scheduler
+        self.jobs: Dict[str, Job] = {}
+
+    def get(self, exec_id: str) -> Optional[Job]:
+        return self.jobs.get(exec_id)
+
+    def submit(self, exec_id: str, temp_dir: str, upload_path: str) -> Job:
+        if not self.scheduler.can_admit():
+            raise JobRejectedError("The server is busy. Please try again in a few minutes.")
+        job = Job(exec_id=exec_id, temp_dir=temp_dir, upload_path=upload_path)
+        self.jobs[exec_id] = job
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    async def _run(self, job: Job):
+        # Spans recorded anywhere in the job end up in logs/exec-{exec_id}.json.
+        with trace(job.exec_id):
+            try:
+                # --- Phase 1: Analysis ---
+                async with self.scheduler.slot(job):
+                    job.set_status("analyzing")
+                    logger.info(f"Job {job.exec_id}: starting analysis")
+                    with span("analysis"):
+                        await run_project_analysis(job.exec_id, job.upload_path, job.temp_dir)
+                if os.path.exists(job.upload_path):
+                    os.remove(job.upload_path)
+
+                # --- Phase 2: Refactoring, once the client picks packages ---
+                job.set_status("awaiting_upgrade")
+                while True:
+                    payload = await asyncio.wait_for(job.commands.get(), JOB_UPGRADE_WAIT_SECONDS)
+                    if payload.get("type") == "start_upgrade":
+                        break
+                packages_to_upgrade = payload.get("packages", [])
+                logger.info(f"Job {job.exec_id}: upgrading {len(packages_to_upgrade)} packages")
+                async with self.scheduler.slot(job, admit=False):
+                    job.set_status("upgrading")
+                    with span("upgrade", packages=len(packages_to_upgrade)):
+                        succeeded = await run_package_refactoring(job.exec_id, packages_to_upgrade, job.temp_dir)
+                # The refactor step reports its own errors on the stream; it only tells us the outcome.
+                job.set_status("completed" if succeeded else "failed")
+            except asyncio.TimeoutError:
+                job.set_status("expired")
+                await manager.send_json(job.exec_id, {"type": "log", "status": "error", "message": "No upgrade request received in time; the job has expired."})
+            except asyncio.CancelledError:
+                # Cancelling the task kills whatever npm/npx process the job was running.
+                job.set_status("cancelled")
+                await manager.send_json(job.exec_id, {"type": "log", "status": "error", "message": "The job was cancelled."})
+                raise
+            except JobRejectedError as e:
+                job.set_status("failed")
+                await manager.send_json(job.exec_id, {"type": "log", "status": "error", "message": str(e)})
+            except Exception as e:
+                logger.exception(f"Job {job.exec_id} failed")
+                job.set_status("failed")
+                await manager.send_json(job.exec_id, {"type": "log", "status": "error", "message": str(e)})
+            finally:
+                self._cleanup(job)
+
+    def cancel(self, job: Job):
+        if job.task and not job.finished:
+            logger.info(f"Job {job.exec_id}: cancelling")
+            job.task.cancel()
+
+    def attach(self, job: Job):
+        """A client subscribed to the job; it is no longer orphaned."""
+        if job.orphan_timer:
+            job.orphan_timer.cancel()
+            job.orphan_timer = None
+
+    def detach(self, job: Job, grace: float = JOB_ORPHAN_GRACE_SECONDS):
+        """The job's client went away; cancel the job unless someone resubscribes within `grace` seconds."""
+        self.attach(job)
+        if not job.finished:
+            job.orphan_timer = asyncio.get_running_loop().call_later(grace, self.cancel, job)
+
+    def _cleanup(self, job: Job):
+        self.attach(job)
+        drop_project_index(job.exec_id)
+        if os.path.exists(job.upload_path):
+            os.remove(job.upload_path)
+        if get_upgrade_result(job.exec_id):
+            # Keep the upgraded project around so it can still be downloaded.
+            _keep(schedule_result_cleanup(job.exec_id, job.temp_dir))
+        elif os.path.exists(job.temp_dir):
+            shutil.rmtree(job.temp_dir, ignore_errors=True)
+            logger.info(f"Cleaned up temp directory: {job.temp_dir}")
+
+        async def forget_later():
+            # Late or reconnecting clients can still read the status and replay events for a while.
+            await asyncio.sleep(RESULT_RETENTION_SECONDS)
+            if self.jobs.get(job.exec_id) is job:
+                del self.jobs[job.exec_id]
+                manager.forget(job.exec_id)
+        _keep(asyncio.get_running_loop().create_task(forget_later()))
+
+    def describe(self, job: Job) -> dict:
+        return {
+            "execId": job.exec_id,
+            "status": job.status,
+            "queuePosition": self.scheduler.queue_position(job),
+            "createdAt": job.created_at,
+            "updatedAt": job.updated_at,
+        }
+
+
+scheduler = JobScheduler()
+jobs = JobRegistry(scheduler)
@@ -0,0 +1,271 @@
+import re
+from dataclasses import dataclass, field
+from typing import FrozenSet, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+# A lexer for JS/TS/JSX that is just precise enough to find top-level statement boundaries and
+# module specifiers: it understands comments, strings, template literals (with nested ${...}),
+# regex literals and bracket depth, and treats everything else as identifiers and punctuation.
+
+IDENTIFIER_START = re.compile(r"[A-Za-z_$\u0080-\uffff]")
+IDENTIFIER = re.compile(r"[\w$\u0080-\uffff]+")
+NUMBER = re.compile(r"\.?\d[\w.]*")
+# After these, a `/` starts a regex literal rather than a division.
+REGEX_AFTER_KEYWORDS = {"return", "typeof", "instanceof", "in", "of", "new", "delete", "void", "throw", "case", "do", "else", "yield", "await"}
+REGEX_AFTER_PUNCT = set("(,=:[!&|?{};+-*%~^")
+OPENERS = {"(": ")", "[": "]", "{": "}"}
+IMPORT_STATEMENT = re.compile(r"(?:(?:/\*.*?\*/|//[^\n]*)\s*)*(?:import\b(?!\s*\()|export\b[^;]*?\bfrom\b|(?:const|let|var)\s+[^=;]+=\s*require\s*\()", re.DOTALL)
+
+
+class Token(NamedTuple):
+    kind: str  # ident, string, template, regex, number, punct, comment
+    value: str
+    start: int
+    end: int
+    depth: int  # bracket depth at the token's start
+
+
+class LexError(ValueError):
+    """The source could not be tokenized reliably (unbalanced brackets, unterminated literal)."""
+
+
+def tokenize(source: str) -> Iterator[Token]:
+    """Yields tokens; raises LexError when the source is not balanced enough to trust the result."""
+    i, n = 0, len(source)
+    stack: List[str] = []  # expected closers; "`" marks a ${ inside a template literal
+    prev: Optional[Token] = None
+
+    def scan_template(pos: int) -> Tuple[int, bool]:
+        """Scans template text from pos; returns (end, stopped_at_substitution)."""
+        while pos < n:
+            ch = source[pos]
+            if ch == "\\":
+                pos += 2
+            elif ch == "`":
+                return pos + 1, False
+            elif ch == "$" and source.startswith("${", pos):
+                return pos + 2, True
+            else:
+                pos += 1
+        raise LexError("unterminated template literal")
+
+    while i < n:
+        ch = source[i]
+        if ch in " \t\r\n\f\v\ufeff":
+            i += 1
+            continue
+        depth = len(stack)
+        start = i
+        if source.startswith("//", i) or (i == 0 and source.startswith("#!")):
+            end = source.find("\n", i)
+            i = n if end == -1 else end
+            token = Token("comment", source[start:i], start, i, depth)
+        elif source.startswith("/*", i):
+            end = source.find("*/", i + 2)
+            if end == -1:
+                raise LexError("unterminated block comment")
+            i = end + 2
+            token = Token("comment", source[start:i], start, i, depth)
+        elif ch in "'\"":
+            i += 1
+            while i < n and source[i] != ch:
+                if source[i] == "\\":
+                    i += 1
+                elif source[i] == "\n":
+                    # Not a string after all (e.g. an apostrophe in JSX text): stop at the line end.
+                    break
+                i += 1
+            i = min(i + 1, n)
+            token = Token("string", source[start:i], start, i, depth)
+        elif ch == "`":
+            i, substitution = scan_template(i + 1)
+            if substitution:
+                stack.append("`")
+            token = Token("template", source[start:i], start, i, depth)
+        elif ch == "}" and stack and stack[-1] == "`":
+            stack.pop()
+            i, substitution = scan_template(i + 1)
+            if substitution:
+                stack.append("`")
+            token = Token("template", source[start:i], start, i, len(stack))
+        elif ch == "/" and _regex_allowed(prev):
+            i += 1
+            in_class = False
+            while i < n and source[i] != "\n":
+                c = source[i]
+                if c == "\\":
+                    i += 1
+                elif c == "[":
+                    in_class = True
+                elif c == "]":
+                    in_class = False
+                elif c == "/" and not in_class:
+                    break
+                i += 1
+            if i < n and source[i] == "/":
+                i += 1
+                match = IDENTIFIER.match(source, i)
+                if match:
+                    i = match.end()
+                token = Token("regex", source[start:i], start, i, depth)
+            else:
+                # Unterminated on this line: it was punctuation (e.g. inside JSX text).
+                i = start + 1
+                token = Token("punct", "/", start, i, depth)
+        elif IDENTIFIER_START.match(ch):
+            i = IDENTIFIER.match(source, i).end()
+            token = Token("ident", source[start:i], start, i, depth)
+        elif NUMBER.match(source, i):
+            i = NUMBER.match(source, i).end()
+            token = Token("number", source[start:i], start, i, depth)
+        else:
+            i += 1
+            if ch in OPENERS:
+                stack.append(OPENERS[ch])
+            elif ch in ")]}":
+                if not stack or stack[-1] != ch:
+                    raise LexError(f"unbalanced {ch!r} at offset {start}")
+                stack.pop()
+            token = Token("punct", ch, start, i, len(stack) if ch in ")]}" else depth)
+        if token.kind != "comment":
+            prev = token
+        yield token
+    if stack:
+        raise LexError("unbalanced brackets at end of file")
+
+
+def _regex_allowed(prev: Optional[Token]) -> bool:
+    if prev is None:
+        return True
+    if prev.kind == "punct":
+        return prev.value in REGEX_AFTER_PUNCT
+    if prev.kind == "ident":
+        return prev.value in REGEX_AFTER_KEYWORDS
+    return False
+
+
+def string_value(token: Token) -> str:
+    return token.value[1:-1] if token.kind in ("string", "template") and len(token.value) >= 2 else token.value
+
+
+def module_specifiers(tokens: List[Token]) -> List[str]:
+    """
+    Module specifiers in a token stream: `import ... from 'x'`, `import 'x'`, `export ... from 'x'`,
+    `require('x')` and `import('x')` (static string arguments only).
+    """
+    specifiers = []
+    for i, token in enumerate(tokens):
+        if token.kind not in ("string", "template") or "${" in token.value:
+            continue
+        before = tokens[i - 1] if i else None
+        before2 = tokens[i - 2] if i > 1 else None
+        if before is None:
+            continue
+        if before.kind == "ident" and before.value in ("from", "import"):
+            specifiers.append(string_value(token))
+        elif before.value == "(" and before2 is not None and before2.value in ("require", "import"):
+            specifiers.append(string_value(token))
+    return list(dict.fromkeys(specifiers))
+
+
+@dataclass
+class Region:
+    """A top-level slice of a source file: an import/export statement, declaration or expression."""
+    index: int
+    start: int
+    end: int
+    text: str
+    identifiers: FrozenSet[str] = field(default_factory=frozenset)
+    specifiers: Tuple[str, ...] = ()
+
+    @property
+    def is_import(self) -> bool:
+        """An import statement, re-export or top-level `x = require(...)`."""
+        return bool(self.specifiers) and bool(IMPORT_STATEMENT.match(self.text.lstrip()))
+
+
+def split_top_level_regions(source: str) -> Optional[List[Region]]:
+    """
+    Splits a module into consecutive top-level regions that concatenate back to the exact source.
+    A region starts at a column-0 identifier, string or comment outside any bracket; leading
+    comments stay with the code they precede. None when the source cannot be tokenized reliably.
+    """
+    try:
+        tokens = list(tokenize(source))
+    except LexError:
+        return None
+
+    starts = []
+    for position, token in enumerate(tokens):
+        at_line_start = token.start == 0 or source[token.start - 1] == "\n"
+        if token.depth == 0 and at_line_start and (token.kind in ("ident", "string", "comment") or token.value == "@"):
+            starts.append(position)
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+
+    # Fold comment-only groups into the region that follows them.
+    groups: List[List[Token]] = []
+    for a, b in zip(starts, starts[1:] + [len(tokens)]):
+        group = tokens[a:b]
+        if groups and all(t.kind == "comment" for t in groups[-1]):
+            groups[-1].extend(group)
+        else:
+            groups.append(group)
+
+    regions = []
+    for group in groups:
+        if not group:
+            continue
+        start = 0 if not regions else regions[-1].end
+        regions.append(Region(
+            index=len(regions),
+            start=start,
+            end=group[-1].end,
+            text=source[start:group[-1].end],
+            identifiers=frozenset(t.value for t in group if t.kind == "ident"),
+            specifiers=tuple(module_specifiers(group)),
+        ))
+    if regions:
+        # Trailing whitespace/newline belongs to the last region.
+        last = regions[-1]
+        regions[-1] = Region(last.index, last.start, len(source), source[last.start:], last.identifiers, last.specifiers)
+    return regions
+
+
+def matches_package(specifier: str, pkg_name: str) -> bool:
+    return specifier == pkg_name or specifier.startswith(pkg_name + "/")
+
+
+IMPORT_SYNTAX = {"import", "export", "from", "type", "typeof", "as", "const", "let", "var", "require", "default"}
+
+
+def imported_bindings(region: Region, pkg_name: str) -> Set[str]:
+    """Local names an import/require region binds from pkg_name (or its subpaths)."""
+    if not any(matches_package(s, pkg_name) for s in region.specifiers):
+        return set()
+    try:
+        tokens = list(tokenize(region.text))
+    except LexError:
+        return set()
+    names = set()
+    for i, token in enumerate(tokens):
+        if token.kind in ("string", "template") or (token.kind == "punct" and token.value == "="):
+            break
+        if token.kind != "ident" or token.value in IMPORT_SYNTAX:
+            continue
+        following = tokens[i + 1] if i + 1 < len(tokens) else None
+        # `a as b` and `{ a: b }` bind b, not a.
+        if following is not None and (following.value == "as" or following.value == ":"):
+            continue
+        names.add(token.value)
+    return names
+
+
+def regions_using_package(regions: List[Region], pkg_name: str) -> List[Region]:
+    """Regions that import pkg_name or reference a name bound from it."""
+    bindings: Set[str] = set()
+    for region in regions:
+        bindings |= imported_bindings(region, pkg_name)
+    return [
+        r for r in regions
+        if any(matches_package(s, pkg_name) for s in r.specifiers) or (bindings & r.identifiers)
+    ]
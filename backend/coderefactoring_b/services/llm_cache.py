@@ -0,0 +1,120 @@
+import os
+import json
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional
+from config import LLM_CACHE_ENABLED, LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+def make_refactor_cache_key(content_hash: str, packages: dict | list, model_name: str, prompt_version: str) -> str:
+    """Content-addressed key for one file refactored for one package upgrade (or several at once)."""
+    parts = [content_hash]
+    for package in packages if isinstance(packages, list) else [packages]:
+        parts += [
+            package['name'],
+            package.get('newName', package['name']),
+            str(package.get('current', '')),
+            str(package['latest']),
+        ]
+    parts += [model_name, prompt_version]
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+class RefactorCache:
+    """
+    Disk-backed LRU cache of LLM refactor results. Each entry is one file under `cache_dir`;
+    recency is tracked in memory and mirrored to file mtimes so it survives restarts.
+    Entries are evicted least-recently-used first once the store exceeds `max_bytes`.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load(self):
+        found = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, file_name))
+            except OSError:
+                continue
+            found.append((stat.st_mtime, file_name[:-len(".json")], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self.total_bytes += size
+        self._evict()
+        logger.info(f"Loaded LLM cache with {len(self._entries)} entries ({self.total_bytes} bytes)")
+
+    def get(self, key: str) -> Optional[str]:
+        if key not in self._entries:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)["result"]
+            os.utime(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Dropping unreadable LLM cache entry {key}: {e}")
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: str):
+        path = self._path(key)
+        data = json.dumps({"result": value}).encode('utf-8')
+        if len(data) > self.max_bytes:
+            return
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write LLM cache entry {key}: {e}")
+            return
+        self.total_bytes -= self._entries.pop(key, 0)
+        self._entries[key] = len(data)
+        self.total_bytes += len(data)
+        self._evict()
+
+    def _remove(self, key: str):
+        self.total_bytes -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+
+
+_cache: Optional[RefactorCache] = None
+_cache_failed = False
+
+
+def get_refactor_cache() -> Optional[RefactorCache]:
+    """Returns the shared cache, or None when caching is disabled or the store is unavailable."""
+    global _cache, _cache_failed
+    if not LLM_CACHE_ENABLED or _cache_failed:
+        return None
+    if _cache is None:
+        try:
+            _cache = RefactorCache(LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES)
+        except OSError as e:
+            logger.error(f"LLM cache disabled, could not open {LLM_CACHE_DIR}: {e}")
+            _cache_failed = True
+    return _cache
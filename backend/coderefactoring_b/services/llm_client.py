@@ -0,0 +1,293 @@
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from types import SimpleNamespace
+from typing import Awaitable, Callable, List, Optional
+from services.telemetry import LLM_REQUESTS, account_llm
+from config import (
+    LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_CONCURRENCY, LLM_MIN_CONCURRENCY, LLM_MAX_CONCURRENCY,
+    LLM_CALL_TIMEOUT_SECONDS, LLM_MAX_RETRIES, LLM_RETRY_BASE_SECONDS, LLM_RETRY_MAX_SECONDS, LLM_HEDGE_AFTER_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses (google.api_core exceptions carry them in `.code`) worth another attempt, and the
+# subset that means "slow down".
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+OVERLOAD_STATUS = {429, 503}
+# The same, by exception class name, for errors that do not carry a status.
+RETRYABLE_ERRORS = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "BadGateway", "GatewayTimeout", "Aborted"}
+OVERLOAD_ERRORS = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable"}
+
+
+class LLMError(RuntimeError):
+    """The model call failed for good: a non-retryable error, or retries were exhausted."""
+
+
+class StreamAborted(Exception):
+    """Raised by a stream consumer to stop a response it has judged unusable; never retried."""
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    code = getattr(error, "code", None)
+    return int(code) if isinstance(code, int) else None
+
+
+def is_overload(error: BaseException) -> bool:
+    return error_status(error) in OVERLOAD_STATUS or type(error).__name__ in OVERLOAD_ERRORS
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    return error_status(error) in RETRYABLE_STATUS or type(error).__name__ in RETRYABLE_ERRORS
+
+
+def describe_error(error: BaseException) -> str:
+    if isinstance(error, asyncio.TimeoutError):
+        return f"no response within {LLM_CALL_TIMEOUT_SECONDS:g}s"
+    return f"{type(error).__name__}: {error}"
+
+
+class TokenBucket:
+    """
+    Refills at rate_per_minute up to a minute's worth. acquire(n) waits, first come first served,
+    until n tokens are available (n is capped at the capacity so a huge request cannot wait forever).
+    A rate of 0 disables the bucket.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        if self.rate <= 0:
+            return
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+    def try_acquire(self, amount: float = 1) -> bool:
+        if self.rate <= 0:
+            return True
+        self._refill()
+        if self._lock.locked() or self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def adjust(self, amount: float):
+        """Takes (or, when negative, returns) tokens after the fact, e.g. actual usage above the estimate."""
+        if self.rate > 0:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD concurrency limit: grows by about one slot per `limit` successful calls and halves on an
+    overload error (at most once per `cooldown` seconds, so one burst of 429s counts once).
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, cooldown: float = 5.0):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._waiters: deque = deque()
+
+    async def acquire(self):
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= int(self.limit) or self._waiters:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._wake()
+
+    def on_overload(self):
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self._last_decrease = now
+            self.limit = max(self.minimum, self.limit / 2)
+            logger.warning(f"LLM overloaded; concurrency limit lowered to {int(self.limit)}")
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+class LLMClient:
+    """
+    Calls the model with process-wide request and token rate limits, adaptive concurrency, a
+    per-call timeout, jittered exponential retries and optional hedging. Usage is accounted to the
+    current job's trace.
+    """
+
+    def __init__(self):
+        self.requests = TokenBucket(LLM_REQUESTS_PER_MINUTE)
+        self.tokens = TokenBucket(LLM_TOKENS_PER_MINUTE)
+        self.concurrency = AdaptiveConcurrency(LLM_CONCURRENCY, LLM_MIN_CONCURRENCY, LLM_MAX_CONCURRENCY)
+
+    async def generate(self, model, prompt: str):
+        """Returns the model's response; raises LLMError once retrying no longer makes sense."""
+        estimate = len(prompt) // 4
+        return await self._with_retries(estimate, lambda: self._call_hedged(model, prompt, estimate))
+
+    async def generate_stream(self, model, prompt: str, new_reader: Callable[[], Callable[[str], Awaitable[bool]]]):
+        """
+        Streams the response, passing each new piece of text to a reader, which returns True once it
+        has everything it needs (the rest is not read) or raises StreamAborted to give up on it.
+        new_reader is called at the start of every attempt: a stream that fails part-way is retried
+        from the start, and the reader must not see the failed attempt's text. Returns an object
+        with the text received, usage_metadata and candidates, like a response. Streams are never hedged.
+        """
+        estimate = len(prompt) // 4
+        return await self._with_retries(estimate, lambda: self._stream(model, prompt, new_reader()))
+
+    async def _with_retries(self, estimate: int, attempt_call: Callable[[], Awaitable]):
+        last_error: Optional[BaseException] = None
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            if attempt:
+                # Full jitter, so callers that failed together do not retry together.
+                await asyncio.sleep(random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** (attempt - 1))))
+                LLM_REQUESTS.inc(outcome="retry")
+                account_llm(retries=1)
+            await self.requests.acquire(1)
+            await self.tokens.acquire(estimate)
+            await self.concurrency.acquire()
+            try:
+                account_llm(requests=1)
+                response = await attempt_call()
+            except StreamAborted:
+                LLM_REQUESTS.inc(outcome="aborted")
+                account_llm(aborted=1)
+                raise
+            except Exception as e:
+                last_error = e
+                if is_overload(e):
+                    self.concurrency.on_overload()
+                if not is_retryable(e):
+                    break
+                logger.warning(f"LLM call failed ({describe_error(e)}); attempt {attempt + 1}/{LLM_MAX_RETRIES + 1}")
+                continue
+            finally:
+                self.concurrency.release()
+            self.concurrency.on_success()
+            usage = getattr(response, "usage_metadata", None)
+            used = (getattr(usage, "prompt_token_count", 0) or 0) + (getattr(usage, "candidates_token_count", 0) or 0)
+            if used:
+                self.tokens.adjust(used - estimate)
+            LLM_REQUESTS.inc(outcome="ok")
+            return response
+        LLM_REQUESTS.inc(outcome="error")
+        account_llm(errors=1)
+        raise LLMError(f"The model request failed: {describe_error(last_error)}") from last_error
+
+    async def _stream(self, model, prompt: str, on_text: Callable[[str], Awaitable[bool]]):
+        # The timeout bounds the wait for each chunk, so a long but steady response is not cut off.
+        stream = await asyncio.wait_for(model.generate_content_async(prompt, stream=True), LLM_CALL_TIMEOUT_SECONDS)
+        chunks = stream.__aiter__()
+        parts: List[str] = []
+        usage = candidates = None
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), LLM_CALL_TIMEOUT_SECONDS)
+                except StopAsyncIteration:
+                    break
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                candidates = getattr(chunk, "candidates", None) or candidates
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # A chunk without text, e.g. the final one carrying only usage.
+                    text = ""
+                if text:
+                    parts.append(text)
+                    if await on_text(text):
+                        break
+        finally:
+            # Closing the stream early stops generation, so we stop paying for it.
+            close = getattr(chunks, "aclose", None)
+            if close is not None:
+                await close()
+        return SimpleNamespace(text="".join(parts), usage_metadata=usage, candidates=candidates)
+
+    async def _call(self, model, prompt: str):
+        return await asyncio.wait_for(model.generate_content_async(prompt), LLM_CALL_TIMEOUT_SECONDS)
+
+    async def _call_hedged(self, model, prompt: str, estimate: int):
+        """
+        One attempt. With hedging on, a slow first request gets a twin after LLM_HEDGE_AFTER_SECONDS,
+        but only when there is spare capacity, and the first answer wins.
+        """
+        if LLM_HEDGE_AFTER_SECONDS <= 0:
+            return await self._call(model, prompt)
+        primary = asyncio.ensure_future(self._call(model, prompt))
+        tasks = [primary]
+        hedged = False
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=LLM_HEDGE_AFTER_SECONDS)
+            if not done and self.concurrency.try_acquire():
+                if self.requests.try_acquire(1) and self.tokens.try_acquire(estimate):
+                    hedged = True
+                    LLM_REQUESTS.inc(outcome="hedge")
+                    account_llm(hedges=1)
+                    tasks.append(asyncio.ensure_future(self._call(model, prompt)))
+                else:
+                    self.concurrency.release()
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+            raise primary.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            if hedged:
+                self.concurrency.release()
+
+    def stats(self) -> dict:
+        return {"concurrencyLimit": int(self.concurrency.limit), "inFlight": self.concurrency.in_flight}
+
+
+llm_client = LLMClient()
@@ -1,57 +1,102 @@
 import os
 import re
 import json
-import requests
-import vertexai
-from vertexai.generative_models import GenerativeModel, GenerationConfig
+import asyncio
+import time
+import hashlib
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from services.llm_cache import get_refactor_cache, make_refactor_cache_key
+from services.js_lexer import Region, split_top_level_regions, regions_using_package
+from services.llm_client import llm_client, LLMError, StreamAborted
+from services.code_edits import parse_edit_blocks, apply_edits, EditApplyError, NO_CHANGES_MARKER
+from services.package_docs import get_relevant_package_docs
+from services.telemetry import span, current_span, record_llm_call
+from services.startup import timed_init
+from config import LLM_MAX_OUTPUT_TOKENS, LLM_STREAMING, LLM_PROGRESS_INTERVAL_SECONDS, REFACTOR_PROMPT_MODE, REFACTOR_COMBINE_PACKAGES, REFACTOR_PROMPT_MAX_TOKENS, REFACTOR_REGION_MIN_FILE_CHARS, REFACTOR_REGION_BUDGET_CHARS, REFACTOR_OUTPUT_FORMAT
+
+MODEL_NAME = "gemini-2.5-flash"
+# Bump whenever construct_refactor_prompt changes so cached results from older prompts are not reused.
+PROMPT_TEMPLATE_VERSION = "1"
 
 # --- Vertex AI Initialization ---
-try:
-    # IMPORTANT: Replace with your Google Cloud project ID and location
-    PROJECT_ID = "innate-booking-465311-a6"
-    LOCATION = "global"# e.g., "us-central1"
-    vertexai.init(project=PROJECT_ID, location=LOCATION)
-    
-    # Configure the model
-    generation_config = GenerationConfig(
-        temperature=0.2,
-        top_p=0.95,
-        max_output_tokens=8192,
-    )
-    model = GenerativeModel("gemini-2.5-flash", generation_config=generation_config)
-    print("Vertex AI initialized successfully.")
-except Exception as e:
-    print(f"ERROR: Could not initialize Vertex AI. LLM features will be disabled. Error: {e}")
-    model = None
+# IMPORTANT: Replace with your Google Cloud project ID and location
+PROJECT_ID = "innate-booking-465311-a6"
+LOCATION = "global"# e.g., "us-central1"
+
+# The SDK is imported and initialized on first use, so cold starts and health checks do not pay for it.
+_model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+def _init_model():
+    try:
+        with timed_init("vertexai"):
+            import vertexai
+            from vertexai.generative_models import GenerativeModel, GenerationConfig
+            vertexai.init(project=PROJECT_ID, location=LOCATION)
+
+            # Configure the model
+            generation_config = GenerationConfig(
+                temperature=0.2,
+                top_p=0.95,
+                max_output_tokens=LLM_MAX_OUTPUT_TOKENS,
+            )
+            model = GenerativeModel(MODEL_NAME, generation_config=generation_config)
+        print("Vertex AI initialized successfully.")
+        return model
+    except Exception as e:
+        print(f"ERROR: Could not initialize Vertex AI. LLM features will be disabled. Error: {e}")
+        return None
+
+def get_model():
+    """The Gemini model, initialized once on first use from any thread; None if Vertex AI is unavailable."""
+    global _model, _model_loaded
+    if not _model_loaded:
+        with _model_lock:
+            if not _model_loaded:
+                _model = _init_model()
+                _model_loaded = True
+    return _model
+
+async def load_model():
+    """get_model for async code: the first call initializes in a worker thread, off the event loop."""
+    return _model if _model_loaded else await asyncio.to_thread(get_model)
+
+def set_model(model):
+    """Uses `model` instead of initializing Vertex AI, e.g. a stand-in for benchmarks."""
+    global _model, _model_loaded
+    with _model_lock:
+        _model, _model_loaded = model, True
 # --- End Vertex AI Initialization ---
 
-def get_package_docs(pkg_name: str) -> str:
+async def get_package_docs(pkg_name: str, from_version: str | None = None, to_version: str | None = None) -> str:
     """
-    Fetches package README from jsDelivr CDN to provide context to the LLM.
+    Provides upgrade context for the LLM: the migration guide, changelog entries between
+    from_version and to_version, and a short README intro, taken from the docs published with
+    the target version (cached on disk per package@version).
     """
     try:
-        url = f"https://cdn.jsdelivr.net/npm/{pkg_name}/README.md"
-        resp = requests.get(url, timeout=10)
-        if resp.status_code == 200:
-            # Return the first 4000 characters to avoid an overly long prompt
-            return resp.text[:4000]
-        return "Could not retrieve README.md for this package."
-    except requests.RequestException as e:
+        docs = await get_relevant_package_docs(pkg_name, from_version, to_version)
+        return docs or "Could not retrieve README.md for this package."
+    except Exception as e:
         return f"Could not retrieve documentation due to an error: {e}"
 
-def construct_refactor_prompt(file_path: str, file_content: str, package: dict, package_docs: str) -> str:
+# One (package, package_docs) pair per package upgraded by a prompt.
+Upgrade = Tuple[dict, str]
+
+def describe_upgrades(upgrades: List[Upgrade]) -> dict:
     """
-    Constructs a detailed prompt for the LLM to perform a version upgrade.
+    The package-specific parts of the refactor prompts. A single upgrade reads exactly as it always
+    has (so cached results stay valid); several are listed together, each with its own docs.
     """
-    lang = "javascript"
-    if file_path.endswith(".jsx"): lang = "jsx"
-    elif file_path.endswith(".ts"): lang = "typescript"
-    elif file_path.endswith(".tsx"): lang = "tsx"
-
-    return f"""
-You are an expert AI programmer specializing in React and Node.js package migrations. Your task is to refactor a single file to upgrade a specific package, based on the provided documentation.
-
-**Package to Upgrade:**
+    if len(upgrades) == 1:
+        package, package_docs = upgrades[0]
+        return {
+            "task": "upgrade a specific package",
+            "section": f"""**Package to Upgrade:**
 - Name: `{package['name']}`
 - From Version: `{package['current']}`
 - To Version: `{package['latest']}`
@@ -59,17 +104,47 @@ You are an expert AI programmer specializing in React and Node.js package migrat
 **Package README/Documentation (for context on breaking changes):**
 ```
 {package_docs}
-```
+```""",
+            "names": f"`{package['name']}`",
+            "noun": "package",
+            "target": f"the new version (`{package['latest']}`)",
+            "import_from": f"`{package['name']}`",
+        }
+    listing = "\n".join(f"- `{p['name']}`: from `{p['current']}` to `{p['latest']}`" for p, _ in upgrades)
+    docs = "\n\n".join(f"**Documentation for `{p['name']}` (for context on breaking changes):**\n```\n{d}\n```" for p, d in upgrades)
+    return {
+        "task": "upgrade several packages at once",
+        "section": f"**Packages to Upgrade:**\n{listing}\n\n{docs}",
+        "names": ", ".join(f"`{p['name']}`" for p, _ in upgrades),
+        "noun": "packages",
+        "target": "the new versions listed above",
+        "import_from": "the same package",
+    }
+
+def construct_refactor_prompt(file_path: str, file_content: str, upgrades: List[Upgrade]) -> str:
+    """
+    Constructs a detailed prompt for the LLM to perform a version upgrade of one or more packages.
+    """
+    lang = "javascript"
+    if file_path.endswith(".jsx"): lang = "jsx"
+    elif file_path.endswith(".ts"): lang = "typescript"
+    elif file_path.endswith(".tsx"): lang = "tsx"
+    u = describe_upgrades(upgrades)
+
+    return f"""
+You are an expert AI programmer specializing in React and Node.js package migrations. Your task is to refactor a single file to {u['task']}, based on the provided documentation.
+
+{u['section']}
 
 **File to Refactor:** `{os.path.basename(file_path)}`
 
 **Instructions:**
-1.  Analyze the original code to identify any usage of the deprecated package (`{package['name']}`). This includes imports, function calls, and component usage.
+1.  Analyze the original code to identify any usage of the deprecated {u['noun']} ({u['names']}). This includes imports, function calls, and component usage.
 2.  Consult the provided documentation to understand the breaking changes between the old and new versions.
-3.  Apply only the necessary code changes to make the file compatible with the new version (`{package['latest']}`).
+3.  Apply only the necessary code changes to make the file compatible with {u['target']}.
 4.  Preserve the original code style, formatting, and all existing logic that is unrelated to the package upgrade.
 5.  Do NOT add, remove, or modify any functionality. This is a pure version upgrade.
-6.  If the file does not use the package, or if no changes are needed, return the original code.
+6.  If the file does not use the {u['noun']}, or if no changes are needed, return the original code.
 7.  Return the complete, refactored code for the file inside a single markdown code block. Do not add any explanation or commentary outside of the code block.
 
 **Original Code:**
@@ -78,35 +153,454 @@ You are an expert AI programmer specializing in React and Node.js package migrat
 ```
 """
 
+def construct_edit_refactor_prompt(file_path: str, file_content: str, upgrades: List[Upgrade]) -> str:
+    """
+    Same task as construct_refactor_prompt, but asks for search/replace edit blocks instead of the
+    whole file, so output size follows the size of the change rather than the size of the file.
+    """
+    full_prompt = construct_refactor_prompt(file_path, file_content, upgrades)
+    task, original = full_prompt.split("**Instructions:**", 1)[0], full_prompt.split("**Original Code:**", 1)[1]
+    u = describe_upgrades(upgrades)
+    return f"""{task}**Instructions:**
+1.  Analyze the original code to identify any usage of the deprecated {u['noun']} ({u['names']}). This includes imports, function calls, and component usage.
+2.  Consult the provided documentation to understand the breaking changes between the old and new versions.
+3.  Express only the necessary changes as search/replace blocks, in this exact format:
+<<<<<<< SEARCH
+lines copied exactly from the original code
+=======
+the replacement lines
+>>>>>>> REPLACE
+4.  Each SEARCH section must match the original code exactly once; include a few surrounding lines if needed to make it unique. Keep blocks small and do not repeat unchanged code.
+5.  Preserve the original code style, formatting, and all existing logic that is unrelated to the package upgrade.
+6.  If the file does not use the {u['noun']}, or if no changes are needed, reply with just `{NO_CHANGES_MARKER}`.
+7.  Do not add any explanation or commentary.
+
+**Original Code:**{original}"""
+
+# A bare fence at the start of a line; "```js" and the like open a block and never close one.
+_CLOSING_FENCE = re.compile(r"^```[ \t]*$", re.MULTILINE)
+# The first line after a closing fence that marks the end of the code: commentary, markdown or another block.
+_AFTER_CODE = re.compile(r"(?:[#*>-]|\d+\.\s|```|Here|This |The |These |I |I'|Note|Changes|Explanation|Key |Summary)", re.IGNORECASE)
+
+def _closes_code(after: str, final: bool) -> Optional[bool]:
+    """Whether a bare fence followed by `after` closes the code block; None while streaming text cannot tell yet."""
+    after = after.lstrip()
+    if (final and not after) or _AFTER_CODE.match(after):
+        return True
+    if not final and "\n" not in after:
+        return None
+    return False
+
+def find_code_block_end(text: str, start: int) -> Optional[int]:
+    """
+    Returns the offset of the fence that closes the code block whose body starts at start. A bare
+    fence only counts when nothing but commentary follows it, so markdown inside the code (e.g. in a
+    template literal) does not cut it short; failing that, the last bare fence is used.
+    """
+    last = None
+    for fence in _CLOSING_FENCE.finditer(text, start):
+        if _closes_code(text[fence.end():], final=True):
+            return fence.start()
+        last = fence.start()
+    return last
+
 def parse_llm_response(response_text: str) -> str | None:
     """Extracts code from a markdown code block."""
-    match = re.search(r"```(?:javascript|typescript|jsx|tsx)?\n(.*?)\n```", response_text, re.DOTALL)
-    if match:
-        return match.group(1).strip()
+    match = re.search(r"```(?:javascript|typescript|jsx|tsx|js|ts)?\n", response_text)
+    end = find_code_block_end(response_text, match.end()) if match else None
+    if end is not None:
+        return response_text[match.end():end].strip()
     # Fallback for responses that might just be raw code
     if not response_text.strip().startswith("```"):
         return response_text.strip()
     return None
 
-async def call_llm_for_refactor(prompt: str, original_content: str) -> str:
-    """Calls the Gemini model and returns the refactored code."""
+def response_truncated(response) -> bool:
+    """True when the model stopped at max_output_tokens, i.e. the code it returned is incomplete."""
+    for candidate in getattr(response, "candidates", None) or []:
+        reason = getattr(candidate, "finish_reason", None)
+        if getattr(reason, "name", str(reason)) == "MAX_TOKENS":
+            return True
+    return False
+
+# --- Streaming ---
+
+# Reports the characters received so far for the response being streamed; set per file by the caller.
+_progress_callback: contextvars.ContextVar[Optional[Callable[[int], Awaitable[None]]]] = contextvars.ContextVar("llm_progress", default=None)
+
+# A response that has not started its code (or edits) within this many characters is checked for prose.
+STREAM_PROBE_CHARS = 400
+# Opening lines that mean the model is talking instead of answering with code.
+PROSE_OPENING = re.compile(r"(?:Here|Sure|Certainly|Okay|OK|Unfortunately|Sorry|I |I'|As an|The |This |Below|To )", re.IGNORECASE)
+# A response longer than this multiple of its input (plus some slack) is runaway output.
+STREAM_RUNAWAY_FACTOR = 2
+STREAM_RUNAWAY_SLACK_CHARS = 4000
+
+@contextmanager
+def llm_progress(callback: Callable[[int], Awaitable[None]]):
+    """Streams started inside the block report their progress (characters received) to callback."""
+    token = _progress_callback.set(callback)
+    try:
+        yield
+    finally:
+        _progress_callback.reset(token)
+
+class ResponseMonitor:
+    """
+    Watches one streamed response as it arrives. expect is "code" (a fenced code block) or "edits"
+    (search/replace blocks or NO_CHANGES). feed() reports throttled progress, returns True once a
+    code block is known to be complete (so trailing commentary is not waited for) and raises
+    StreamAborted for prose instead of code or output far longer than its input. Each piece is
+    scanned once: only the opening and the code not yet known to be inside the block are kept.
+    """
+
+    def __init__(self, expect: str, input_chars: int):
+        self.expect = expect
+        self.max_chars = STREAM_RUNAWAY_FACTOR * input_chars + STREAM_RUNAWAY_SLACK_CHARS
+        self.chars = 0
+        self.progress = _progress_callback.get()
+        self.reported_at = 0.0
+        # The start of the response, until the prose probe and the opening fence line are settled.
+        self.head: Optional[str] = ""
+        self.probed = False
+        # Code block text from the first line that may still hold the closing fence; None until the
+        # opening fence line is complete, or for good when the response does not open with one.
+        self.pending: Optional[str] = None
+
+    async def feed(self, piece: str) -> bool:
+        self.chars += len(piece)
+        if self.progress is not None and time.monotonic() - self.reported_at >= LLM_PROGRESS_INTERVAL_SECONDS:
+            self.reported_at = time.monotonic()
+            await self.progress(self.chars)
+        if self.chars > self.max_chars:
+            raise StreamAborted(f"runaway response (over {self.max_chars} characters)")
+        if self.pending is not None:
+            self.pending += piece
+            return self._block_closed()
+        if self.head is None:
+            return False
+        self.head += piece
+        head = self.head.lstrip()
+        if not self.probed and len(head) >= STREAM_PROBE_CHARS:
+            self.probed = True
+            if not self._started(head[:STREAM_PROBE_CHARS]) and PROSE_OPENING.match(head):
+                raise StreamAborted("prose instead of code")
+        if self.expect != "code" or (head and not "```".startswith(head[:3])):
+            # Not a fenced block; keep the head only as long as the prose probe needs it.
+            if self.probed:
+                self.head = None
+            return False
+        first_line_end = head.find("\n")
+        if first_line_end == -1:
+            return False
+        self.pending = head[first_line_end + 1:]
+        self.head = None
+        return self._block_closed()
+
+    def _block_closed(self) -> bool:
+        position = 0
+        for fence in _CLOSING_FENCE.finditer(self.pending):
+            closes = _closes_code(self.pending[fence.end():], final=False)
+            if closes:
+                return True
+            if closes is None:
+                self.pending = self.pending[fence.start():]
+                return False
+            position = fence.end()
+        # Lines already scanned cannot hold the closing fence; keep only the unfinished last line.
+        self.pending = self.pending[self.pending.rfind("\n", position) + 1:]
+        return False
+
+    def _started(self, head: str) -> bool:
+        if "```" in head:
+            return True
+        return self.expect == "edits" and ("<<<<<<< SEARCH" in head or NO_CHANGES_MARKER in head)
+
+async def _generate(model, prompt: str, expect: str, input_chars: int):
+    if not LLM_STREAMING:
+        return await llm_client.generate(model, prompt)
+    # A fresh monitor per attempt, so a retried stream is not judged with the failed attempt's text.
+    return await llm_client.generate_stream(model, prompt, lambda: ResponseMonitor(expect, input_chars).feed)
+
+async def call_llm_for_refactor(prompt: str, original_content: str | None, cache_key: str | None = None, cache_stats: dict | None = None,
+                                parse: Callable[[str], Optional[str]] = parse_llm_response, expect: str = "code",
+                                input_chars: int | None = None) -> str:
+    """
+    Calls the Gemini model and returns the refactored code (as extracted by `parse`).
+    When a cache_key is given, a cached result is returned without calling the model, and
+    successfully parsed responses are stored. Hits and misses are counted into cache_stats.
+    Truncated, blocked or unparseable responses return original_content unchanged; a model that
+    cannot be reached raises LLMError, so the caller can report the file instead of passing it off
+    as needing no changes. With LLM_STREAMING, the response is read as it is generated and given up
+    on early when it is clearly malformed (see ResponseMonitor); expect is the response format and
+    input_chars the size of the code sent (default: original_content).
+    """
+    cache = get_refactor_cache() if cache_key else None
+    if cache:
+        cached = cache.get(cache_key)
+        if cache_stats is not None:
+            cache_stats["hits" if cached is not None else "misses"] += 1
+        if current_span() is not None:
+            current_span().set(cacheHit=cached is not None)
+        if cached is not None:
+            return cached
+
+    model = await load_model()
     if not model:
-        print("WARNING: Vertex AI model not initialized. Skipping refactor.")
+        raise LLMError("Vertex AI is not initialized, so the model cannot be called.")
+
+    print(f"--- SENDING PROMPT TO LLM (size: {len(prompt)}) ---")
+    with span("llm_call", model=MODEL_NAME):
+        try:
+            response = await _generate(model, prompt, expect, input_chars if input_chars is not None else len(original_content or ""))
+        except StreamAborted as e:
+            print(f"WARNING: Stopped the LLM response early: {e}. Returning original content.")
+            return original_content
+        try:
+            response_text = response.text
+        except ValueError as e:
+            # No usable candidate, e.g. the response was blocked.
+            print(f"WARNING: LLM returned no text ({e}). Returning original content.")
+            return original_content
+        record_llm_call(len(prompt), len(response_text), getattr(response, "usage_metadata", None))
+    print("--- RECEIVED RESPONSE FROM LLM ---")
+
+    if response_truncated(response):
+        print("WARNING: LLM response hit the output token limit. Returning original content.")
         return original_content
 
-    try:
-        print(f"--- SENDING PROMPT TO LLM (size: {len(prompt)}) ---")
-        response = await model.generate_content_async(prompt)
-        print("--- RECEIVED RESPONSE FROM LLM ---")
-        
-        refactored_code = parse_llm_response(response.text)
-        
-        if refactored_code:
-            return refactored_code
+    refactored_code = parse(response_text)
+    if refactored_code:
+        if cache:
+            cache.put(cache_key, refactored_code)
+        return refactored_code
+    print("WARNING: Could not parse LLM response. Returning original content.")
+    return original_content
+
+# --- Region-targeted refactoring ---
+
+def format_region_blocks(regions: List[Region]) -> str:
+    return "\n\n".join(f"// @@REGION {r.index}\n{r.text.strip()}\n// @@END REGION {r.index}" for r in regions)
+
+_REGION_BLOCK = re.compile(r"^// @@REGION (\d+)\n(.*?)\n?// @@END REGION \1\s*$", re.DOTALL | re.MULTILINE)
+
+def parse_region_blocks(code: str, expected_ids: List[int]) -> Optional[Dict[int, str]]:
+    """Region id -> rewritten code, or None unless exactly the expected regions came back."""
+    blocks = {int(m.group(1)): m.group(2) for m in _REGION_BLOCK.finditer(code)}
+    return blocks if sorted(blocks) == sorted(expected_ids) else None
+
+def splice_regions(content: str, regions: List[Region], replacements: Dict[int, str]) -> str:
+    """Rebuilds the file with rewritten regions, keeping each region's surrounding whitespace."""
+    parts = []
+    for region in regions:
+        text = region.text
+        if region.index in replacements:
+            stripped = text.strip()
+            leading = text[:len(text) - len(text.lstrip())]
+            trailing = text[len(text.rstrip()):] if stripped else ""
+            text = leading + replacements[region.index].strip() + trailing
+        parts.append(text)
+    return "".join(parts)
+
+def plan_region_batches(regions: List[Region], budget_chars: int) -> List[List[Region]]:
+    """Packs regions, in file order, into calls of at most budget_chars of code (oversized regions go alone)."""
+    batches, current, size = [], [], 0
+    for region in regions:
+        length = len(region.text)
+        if current and size + length > budget_chars:
+            batches.append(current)
+            current, size = [], 0
+        current.append(region)
+        size += length
+    if current:
+        batches.append(current)
+    return batches
+
+def construct_region_refactor_prompt(file_path: str, regions: List[Region], context_imports: List[Region], upgrades: List[Upgrade]) -> str:
+    """
+    Like construct_refactor_prompt, but sends only selected top-level regions of the file (plus its
+    other imports as read-only context) and asks for the same regions back.
+    """
+    context = "\n".join(r.text.strip() for r in context_imports) or "(none)"
+    u = describe_upgrades(upgrades)
+    return f"""
+You are an expert AI programmer specializing in React and Node.js package migrations. Your task is to refactor parts of a single file to {u['task']}, based on the provided documentation.
+
+{u['section']}
+
+**File:** `{os.path.basename(file_path)}`
+
+**Other imports in this file (context only, do not return them):**
+```
+{context}
+```
+
+**Instructions:**
+1.  Below are the top-level regions of the file that use {u['names']}, each between `// @@REGION <n>` and `// @@END REGION <n>` marker lines.
+2.  Consult the provided documentation to understand the breaking changes between the old and new versions.
+3.  Apply only the necessary code changes to make these regions compatible with {u['target']}. If new imports are needed, add them to a region that already imports from {u['import_from']}.
+4.  Preserve the original code style, formatting, and all existing logic that is unrelated to the package upgrade.
+5.  Return every region, changed or not, with its marker lines unchanged, all inside a single markdown code block. Do not add any explanation or commentary outside of the code block.
+
+**Regions:**
+```
+{format_region_blocks(regions)}
+```
+"""
+
+def plan_upgrade_groups(file_path: str, content: str, upgrades: List[Upgrade], max_prompt_tokens: int) -> List[List[Upgrade]]:
+    """
+    Packs upgrades, in order, into combined prompts whose whole-file form stays within
+    max_prompt_tokens (~4 chars per token); an upgrade that does not fit with others gets its own call.
+    """
+    groups: List[List[Upgrade]] = []
+    for upgrade in upgrades:
+        if groups and len(construct_refactor_prompt(file_path, content, groups[-1] + [upgrade])) // 4 <= max_prompt_tokens:
+            groups[-1].append(upgrade)
         else:
-            print("WARNING: Could not parse LLM response. Returning original content.")
-            return original_content
-            
-    except Exception as e:
-        print(f"ERROR: Error calling LLM: {e}")
-        return original_content
\ No newline at end of file
+            groups.append([upgrade])
+    return groups
+
+async def refactor_source(file_path: str, content: str, content_hash: str, upgrades: List[Upgrade], cache_stats: dict | None = None) -> str:
+    """
+    Refactors one file for the given package upgrades and returns the new content (unchanged when
+    no edit is needed or the model output cannot be used). With REFACTOR_COMBINE_PACKAGES, all
+    upgrades go into one prompt while it fits REFACTOR_PROMPT_MAX_TOKENS; otherwise (or for the
+    upgrades that do not fit) the file is refactored package by package, each call seeing the
+    previous call's result.
+    """
+    if REFACTOR_COMBINE_PACKAGES:
+        groups = plan_upgrade_groups(file_path, content, upgrades, REFACTOR_PROMPT_MAX_TOKENS)
+    else:
+        groups = [[upgrade] for upgrade in upgrades]
+    if current_span() is not None:
+        current_span().set(packages=len(upgrades), packageGroups=len(groups))
+    for group in groups:
+        refactored = await _refactor_group(file_path, content, content_hash, group, cache_stats)
+        if refactored != content:
+            content = refactored
+            content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    return content
+
+async def _refactor_group(file_path: str, content: str, content_hash: str, upgrades: List[Upgrade], cache_stats: dict | None) -> str:
+    """
+    One refactor of the file for one group of upgrades. In "regions" mode, files of at least
+    REFACTOR_REGION_MIN_FILE_CHARS that tokenize cleanly send only the regions using the packages,
+    split into several calls when they exceed REFACTOR_REGION_BUDGET_CHARS.
+    """
+    packages = [package for package, _ in upgrades]
+    if REFACTOR_PROMPT_MODE == "regions" and len(content) >= REFACTOR_REGION_MIN_FILE_CHARS:
+        regions = split_top_level_regions(content)
+        if regions:
+            target_ids = {r.index for package in packages for r in regions_using_package(regions, package['name'])}
+            if not target_ids:
+                return content
+            targets = [r for r in regions if r.index in target_ids]
+            return await _refactor_regions(file_path, content, content_hash, regions, targets, upgrades, cache_stats)
+
+    if REFACTOR_OUTPUT_FORMAT == "edits":
+        edited = await _refactor_with_edits(file_path, content, content_hash, upgrades, cache_stats)
+        if edited is not None:
+            return edited
+        print(f"WARNING: Edits for {file_path} could not be applied. Requesting the full file.")
+
+    prompt = construct_refactor_prompt(file_path, content, upgrades)
+    cache_key = make_refactor_cache_key(content_hash, packages, MODEL_NAME, PROMPT_TEMPLATE_VERSION)
+    return await call_llm_for_refactor(prompt, content, cache_key, cache_stats)
+
+def edit_parser(file_path: str, content: str) -> Callable[[str], Optional[str]]:
+    """A `parse` for call_llm_for_refactor: applies the response's search/replace edits to content."""
+    def parse(text: str) -> Optional[str]:
+        edits = parse_edit_blocks(text)
+        if edits is None:
+            return None
+        try:
+            return apply_edits(content, edits)
+        except EditApplyError as e:
+            print(f"WARNING: {file_path}: {e}")
+            return None
+    return parse
+
+async def _refactor_with_edits(file_path: str, content: str, content_hash: str, upgrades: List[Upgrade], cache_stats: dict | None) -> str | None:
+    """The file with the model's search/replace edits applied, or None if they are missing or do not apply."""
+    parse = edit_parser(file_path, content)
+    prompt = construct_edit_refactor_prompt(file_path, content, upgrades)
+    cache_key = make_refactor_cache_key(content_hash, [package for package, _ in upgrades], MODEL_NAME, f"{PROMPT_TEMPLATE_VERSION}-edits")
+    if current_span() is not None:
+        current_span().set(mode="edits")
+    return await call_llm_for_refactor(prompt, None, cache_key, cache_stats, parse=parse, expect="edits", input_chars=len(content))
+
+async def _refactor_regions(file_path: str, content: str, content_hash: str, regions: List[Region], targets: List[Region],
+                            upgrades: List[Upgrade], cache_stats: dict | None) -> str:
+    target_ids = {r.index for r in targets}
+    context_imports = [r for r in regions if r.is_import and r.index not in target_ids]
+    batches = plan_region_batches(targets, REFACTOR_REGION_BUDGET_CHARS)
+    if current_span() is not None:
+        current_span().set(mode="regions", regions=len(targets), calls=len(batches), sentChars=sum(len(r.text) for r in targets))
+
+    async def refactor_batch(batch: List[Region]) -> Dict[int, str]:
+        ids = [r.index for r in batch]
+        blocks = format_region_blocks(batch)
+        prompt = construct_region_refactor_prompt(file_path, batch, context_imports, upgrades)
+        batch_hash = hashlib.sha256(f"{content_hash}\0{blocks}".encode("utf-8")).hexdigest()
+        cache_key = make_refactor_cache_key(batch_hash, [package for package, _ in upgrades], MODEL_NAME, f"{PROMPT_TEMPLATE_VERSION}-regions")
+
+        def parse(text: str) -> Optional[str]:
+            code = parse_llm_response(text)
+            return code if code and parse_region_blocks(code, ids) is not None else None
+
+        result = await call_llm_for_refactor(prompt, blocks, cache_key, cache_stats, parse=parse)
+        return parse_region_blocks(result, ids) or {}
+
+    replacements = {}
+    # Let every batch finish before surfacing a failure, so none keeps calling the model unobserved.
+    for result in await asyncio.gather(*(refactor_batch(batch) for batch in batches), return_exceptions=True):
+        if isinstance(result, BaseException):
+            raise result
+        replacements.update(result)
+    return splice_regions(content, regions, replacements)
+
+# --- Build repair ---
+
+def construct_repair_prompt(file_path: str, file_content: str, errors: List[str], upgrades: List[Upgrade]) -> str:
+    """
+    Asks for search/replace edits that fix the build errors reported in one file after the upgrade.
+    """
+    edit_prompt = construct_edit_refactor_prompt(file_path, file_content, upgrades)
+    context, original = edit_prompt.split("**File to Refactor:**", 1)[0], edit_prompt.split("**Original Code:**", 1)[1]
+    context = context.replace("Your task is to refactor a single file to", "A project was just refactored to", 1)
+    error_list = "\n".join(errors)
+    return f"""{context}After that refactor, the project no longer builds.
+
+**File to Fix:** `{file_path}`
+
+**Build errors reported in this file:**
+```
+{error_list}
+```
+
+**Instructions:**
+1.  Fix only these errors, using the documentation to find the replacement for any API that was removed or renamed.
+2.  Express the changes as search/replace blocks, in this exact format:
+<<<<<<< SEARCH
+lines copied exactly from the original code
+=======
+the replacement lines
+>>>>>>> REPLACE
+3.  Each SEARCH section must match the original code exactly once; include a few surrounding lines if needed to make it unique. Keep blocks small and do not repeat unchanged code.
+4.  Preserve the original code style, formatting, and all logic unrelated to the errors.
+5.  If the errors cannot be fixed in this file, reply with just `{NO_CHANGES_MARKER}`.
+6.  Do not add any explanation or commentary.
+
+**Original Code:**{original}"""
+
+async def repair_source(file_path: str, content: str, errors: List[str], upgrades: List[Upgrade]) -> str:
+    """
+    Returns the file with the model's fixes for `errors` applied, or unchanged when the model has
+    no usable fix. Not cached: the same file can fail differently from one round to the next.
+    """
+    prompt = construct_repair_prompt(file_path, content, errors, upgrades)
+    if current_span() is not None:
+        current_span().set(mode="repair", errors=len(errors))
+    repaired = await call_llm_for_refactor(prompt, None, parse=edit_parser(file_path, content), expect="edits", input_chars=len(content))
+    return repaired if repaired is not None else content
@@ -0,0 +1,108 @@
+import re
+import time
+import asyncio
+from collections import deque
+from typing import Optional
+from websocket_manager import manager
+from config import (
+    LOG_FLUSH_INTERVAL_SECONDS, LOG_BATCH_MAX_LINES, LOG_BATCH_MAX_BYTES, LOG_RETAIN_LINES, LOG_ERROR_TAIL_CHARS,
+)
+
+
+def error_tail(text: str, limit: int = LOG_ERROR_TAIL_CHARS) -> str:
+    """The last `limit` characters of command output, where compiler and npm errors end up."""
+    return text if len(text) <= limit else "..." + text[-limit:]
+
+
+class RetainedLines:
+    """Bounded ring buffer of output lines, plus any lines matching keep_pattern (kept in full)."""
+
+    def __init__(self, maxlen: int = LOG_RETAIN_LINES, keep_pattern: Optional[re.Pattern] = None):
+        self.lines = deque(maxlen=maxlen)
+        self.kept = []
+        self.keep_pattern = keep_pattern
+        self.dropped = 0
+
+    def append(self, line: str):
+        if len(self.lines) == self.lines.maxlen:
+            dropped = self.lines[0]
+            self.dropped += 1
+            if self.keep_pattern and self.keep_pattern.search(dropped):
+                self.kept.append(dropped)
+        self.lines.append(line)
+
+    def text(self) -> str:
+        return "\n".join([*self.kept, *self.lines])
+
+
+class LogStreamer:
+    """
+    Coalesces command output into batched "log" frames. Lines are buffered and flushed every
+    LOG_FLUSH_INTERVAL_SECONDS, or earlier once a batch reaches LOG_BATCH_MAX_LINES/BYTES or the
+    status (stdout info vs stderr warning) changes. Frames keep the usual {"type": "log"} shape
+    with newline-joined messages, so clients need no changes. Frames are droppable: a client
+    that falls behind skips some output rather than stalling the job.
+    """
+
+    def __init__(self, exec_id: str, label: str):
+        self.exec_id = exec_id
+        self.label = label
+        self.lines_streamed = 0
+        self.bytes_streamed = 0
+        self.frames_sent = 0
+        self._pending = []
+        self._pending_bytes = 0
+        self._pending_status = None
+        self._lock = asyncio.Lock()
+        self._ticker: Optional[asyncio.Task] = None
+        self._started = time.monotonic()
+
+    async def __aenter__(self):
+        self._ticker = asyncio.create_task(self._tick())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._ticker.cancel()
+        await asyncio.gather(self._ticker, return_exceptions=True)
+        await self.flush()
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(LOG_FLUSH_INTERVAL_SECONDS)
+            await self.flush()
+
+    async def add(self, line: str, status: str):
+        if self._pending and status != self._pending_status:
+            await self.flush()
+        self._pending.append(line)
+        self._pending_status = status
+        self._pending_bytes += len(line) + 1
+        self.lines_streamed += 1
+        if len(self._pending) >= LOG_BATCH_MAX_LINES or self._pending_bytes >= LOG_BATCH_MAX_BYTES:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            lines, status = self._pending, self._pending_status
+            self._pending, self._pending_bytes = [], 0
+            message = "\n".join(lines)
+            self.bytes_streamed += len(message)
+            self.frames_sent += 1
+            await manager.send_json(self.exec_id, {"type": "log", "status": status, "message": message}, droppable=True)
+
+    async def send_summary(self, dropped_lines: int):
+        elapsed = time.monotonic() - self._started
+        await manager.send_json(self.exec_id, {
+            "type": "log",
+            "status": "info",
+            "message": f"{self.label}: {self.lines_streamed} output lines ({self.bytes_streamed / 1024:.1f} KB) streamed in {self.frames_sent} messages over {elapsed:.1f}s"
+                       + (f", {dropped_lines} older lines not retained." if dropped_lines else "."),
+            "stats": {
+                "linesStreamed": self.lines_streamed,
+                "bytesStreamed": self.bytes_streamed,
+                "framesSent": self.frames_sent,
+                "linesDropped": dropped_lines,
+            },
+        })
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import httpx
+from typing import Dict, Iterable, Optional
+from urllib.parse import quote
+from services.http_client import get_http_client
+from config import NPM_REGISTRY_URL, REGISTRY_CONCURRENCY, REGISTRY_CACHE_TTL_SECONDS, REGISTRY_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Abbreviated packuments carry dist-tags and the version list without per-version READMEs.
+ABBREVIATED_METADATA = "application/vnd.npm.install-v1+json; q=1.0, application/json; q=0.8"
+
+
+class NpmRegistryClient:
+    """
+    Async npm registry client. Package metadata is reduced to dist-tags and the published
+    version list, and kept in a TTL cache both in memory and on disk. Concurrent lookups of
+    the same package share a single request.
+    """
+
+    def __init__(self, base_url: str = NPM_REGISTRY_URL, cache_dir: Optional[str] = REGISTRY_CACHE_DIR,
+                 ttl: int = REGISTRY_CACHE_TTL_SECONDS, concurrency: int = REGISTRY_CONCURRENCY,
+                 client: Optional[httpx.AsyncClient] = None):
+        self.base_url = base_url.rstrip("/")
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self._client = client
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._memory: Dict[str, dict] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        if cache_dir:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+            except OSError as e:
+                logger.warning(f"Registry disk cache disabled, could not create {cache_dir}: {e}")
+                self.cache_dir = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self._client or get_http_client()
+
+    def _fresh(self, metadata: Optional[dict]) -> bool:
+        return bool(metadata) and time.time() - metadata.get("fetched_at", 0) < self.ttl
+
+    def _disk_path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, quote(name, safe="") + ".json")
+
+    def _read_disk(self, name: str) -> Optional[dict]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(name), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, name: str, metadata: dict):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(metadata, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write registry cache for {name}: {e}")
+
+    async def _fetch(self, name: str) -> Optional[dict]:
+        # Scoped names keep their leading "@" but the slash must be encoded.
+        url = f"{self.base_url}/{quote(name, safe='@')}"
+        async with self._semaphore:
+            try:
+                resp = await self.client.get(url, headers={"Accept": ABBREVIATED_METADATA})
+                resp.raise_for_status()
+                data = resp.json()
+            except (httpx.HTTPError, ValueError) as e:
+                logger.error(f"Failed to get registry metadata for {name}: {e}")
+                return None
+        return {
+            "name": name,
+            "dist-tags": data.get("dist-tags", {}),
+            "versions": list(data.get("versions", {}).keys()),
+            "fetched_at": time.time(),
+        }
+
+    async def get_metadata(self, name: str) -> Optional[dict]:
+        """Returns {"dist-tags", "versions", "fetched_at"} for a package, or None if it cannot be fetched."""
+        metadata = self._memory.get(name)
+        if self._fresh(metadata):
+            return metadata
+        metadata = self._read_disk(name)
+        if self._fresh(metadata):
+            self._memory[name] = metadata
+            return metadata
+
+        if name in self._inflight:
+            return await asyncio.shield(self._inflight[name])
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[name] = future
+        try:
+            metadata = await self._fetch(name)
+            if metadata:
+                self._memory[name] = metadata
+                self._write_disk(name, metadata)
+            future.set_result(metadata)
+            return metadata
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark as retrieved for callers that never shared it.
+            raise
+        finally:
+            del self._inflight[name]
+
+    async def get_latest_version(self, name: str) -> str:
+        metadata = await self.get_metadata(name)
+        if not metadata:
+            return "N/A"
+        return metadata["dist-tags"].get("latest", "N/A")
+
+    async def get_metadata_batch(self, names: Iterable[str]) -> Dict[str, Optional[dict]]:
+        names = list(dict.fromkeys(names))
+        results = await asyncio.gather(*(self.get_metadata(name) for name in names))
+        return dict(zip(names, results))
+
+    async def get_latest_versions(self, names: Iterable[str]) -> Dict[str, str]:
+        """Concurrently resolves the latest version of every package; failures map to "N/A"."""
+        metadata = await self.get_metadata_batch(names)
+        return {name: (meta["dist-tags"].get("latest", "N/A") if meta else "N/A") for name, meta in metadata.items()}
+
+
+_registry: Optional[NpmRegistryClient] = None
+
+
+def get_registry_client() -> NpmRegistryClient:
+    global _registry
+    if _registry is None:
+        _registry = NpmRegistryClient()
+    return _registry
@@ -0,0 +1,196 @@
+import os
+import re
+import json
+import asyncio
+import logging
+import httpx
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+from services.http_client import get_http_client
+from services.semver import coerce_version, parse_version
+from config import DOCS_CDN_URL, DOCS_LISTING_URL, DOCS_CACHE_DIR, DOCS_MAX_CHARS
+
+logger = logging.getLogger(__name__)
+
+# Markdown files worth reading for an upgrade, matched against paths at the package root or in docs/.
+DOC_FILE_PATTERN = re.compile(r"^/(?:docs?/)?(readme|changelog|changes|history|migrat\w*|upgrad\w*|breaking\w*)(?:[-_.]\w+)*\.md$", re.IGNORECASE)
+MIGRATION_HEADING_PATTERN = re.compile(r"migrat|upgrad|breaking|deprecat|removed|renamed", re.IGNORECASE)
+MAX_DOC_FILES = 4
+MAX_MEMORY_ENTRIES = 128
+MAX_SECTION_CHARS = 1500
+README_INTRO_CHARS = 600
+
+_HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_memory_cache: Dict[str, Dict[str, str]] = {}
+
+
+# --- Fetching & caching ---
+
+def _cache_path(pkg_name: str, version: str) -> str:
+    return os.path.join(DOCS_CACHE_DIR, quote(f"{pkg_name}@{version}", safe="") + ".json")
+
+
+def _read_cache(pkg_name: str, version: str) -> Optional[Dict[str, str]]:
+    try:
+        with open(_cache_path(pkg_name, version), "r", encoding="utf-8") as f:
+            return json.load(f)["files"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_cache(pkg_name: str, version: str, files: Dict[str, str]):
+    path = _cache_path(pkg_name, version)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(DOCS_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": files}, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write docs cache for {pkg_name}@{version}: {e}")
+
+
+async def _list_doc_files(client: httpx.AsyncClient, pkg_name: str, version: str) -> Tuple[List[str], bool]:
+    """The doc files to fetch, and whether the listing succeeded (otherwise just the README is tried)."""
+    try:
+        resp = await client.get(f"{DOCS_LISTING_URL}/{pkg_name}@{version}", params={"structure": "flat"})
+        resp.raise_for_status()
+        names = [f["name"] for f in resp.json().get("files", [])]
+    except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Could not list files for {pkg_name}@{version}, falling back to README: {e}")
+        return ["/README.md"], False
+    matched = [name for name in names if DOC_FILE_PATTERN.match(name)]
+    # Dedicated migration/changelog files first, README last; root files before docs/.
+    matched.sort(key=lambda name: (name.lower().lstrip("/").startswith(("readme", "docs/readme")), name.count("/"), name))
+    return matched[:MAX_DOC_FILES], True
+
+
+async def fetch_package_doc_files(pkg_name: str, version: str) -> Dict[str, str]:
+    """
+    Returns {path: markdown} for the README/CHANGELOG/migration guides published with pkg@version.
+    Exact versions are immutable, so results are cached on disk without expiry; "latest" is only
+    cached in memory for the lifetime of the process. Only complete fetches are cached: if the
+    listing or any file failed (other than a 404), the next call tries again.
+    """
+    cache_key = f"{pkg_name}@{version}"
+    if cache_key in _memory_cache:
+        return _memory_cache[cache_key]
+    exact = parse_version(version) is not None
+    files = _read_cache(pkg_name, version) if exact else None
+    if files is None:
+        client = get_http_client()
+        paths, complete = await _list_doc_files(client, pkg_name, version)
+
+        async def fetch(path: str) -> Tuple[str, Optional[str], bool]:
+            """(path, text or None, whether the outcome is final: fetched, or known to be missing)."""
+            try:
+                resp = await client.get(f"{DOCS_CDN_URL}/{pkg_name}@{version}{path}")
+                return path, resp.text if resp.status_code == 200 else None, resp.status_code in (200, 404)
+            except httpx.HTTPError as e:
+                logger.warning(f"Could not fetch {path} for {cache_key}: {e}")
+                return path, None, False
+
+        results = await asyncio.gather(*(fetch(p) for p in paths))
+        files = {path: text for path, text, _ in results if text}
+        complete = complete and all(final for *_, final in results)
+        if exact and files and complete:
+            _write_cache(pkg_name, version, files)
+        if not (files and complete):
+            return files
+    if len(_memory_cache) >= MAX_MEMORY_ENTRIES:
+        _memory_cache.pop(next(iter(_memory_cache)))
+    _memory_cache[cache_key] = files
+    return files
+
+
+# --- Section extraction ---
+
+def split_sections(markdown: str) -> List[Tuple[int, str, str]]:
+    """
+    Splits markdown into (level, heading, text) sections. A section's text runs until the next
+    heading of the same or a higher level, so it includes its subsections. Fenced code is not
+    scanned for headings.
+    """
+    lines = markdown.splitlines()
+    headings = []
+    in_fence = False
+    for i, line in enumerate(lines):
+        if line.lstrip().startswith(("```", "~~~")):
+            in_fence = not in_fence
+            continue
+        match = None if in_fence else _HEADING_PATTERN.match(line)
+        if match:
+            headings.append((i, len(match.group(1)), match.group(2)))
+    sections = []
+    for n, (start, level, title) in enumerate(headings):
+        end = next((h[0] for h in headings[n + 1:] if h[1] <= level), len(lines))
+        sections.append((level, title, "\n".join(lines[start:end]).strip()))
+    return sections
+
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit].rstrip() + "\n..."
+
+
+def extract_relevant_docs(files: Dict[str, str], from_version: Optional[str], to_version: Optional[str],
+                          max_chars: int = DOCS_MAX_CHARS) -> str:
+    """
+    Picks the parts of the package docs that matter for a from -> to upgrade: migration/breaking
+    change sections, changelog entries for versions in (from, to] (major releases first), and a
+    short README introduction, in that priority order, until max_chars is reached.
+    """
+    low = coerce_version(from_version) if from_version else None
+    high = coerce_version(to_version) if to_version else None
+
+    migration, changelog, intro = [], [], []
+    for path, markdown in files.items():
+        is_readme = "readme" in path.lower()
+        sections = split_sections(markdown)
+        if is_readme and markdown.strip():
+            first_heading = markdown.find("\n#", 1)
+            intro.append(_clip(markdown[:first_heading] if first_heading > 0 else markdown, README_INTRO_CHARS))
+        version_level = None
+        for level, title, text in sections:
+            # "Migrating to v5" names a version but is a guide, not a changelog entry.
+            is_migration = MIGRATION_HEADING_PATTERN.search(title) is not None
+            version = None if is_migration else coerce_version(title)
+            if version_level is not None and level > version_level:
+                # Subsections of a changelog entry travel with that entry.
+                continue
+            version_level = level if version and level > 1 else None
+            if version and level > 1:
+                if (low is None or version[:3] > low[:3]) and (high is None or version[:3] <= high[:3]):
+                    is_major = version[1] == 0 and version[2] == 0
+                    changelog.append((not is_major, tuple(-v for v in version[:3]), _clip(text, MAX_SECTION_CHARS)))
+            elif is_migration:
+                # Prefer guides that name the target major, e.g. "Migrating to v5".
+                mentions_target = bool(high) and re.search(rf"\b[vV]?{high[0]}(?:\.|\b)", title) is not None
+                migration.append((not mentions_target, level, _clip(text, MAX_SECTION_CHARS)))
+        if not sections and not is_readme and MIGRATION_HEADING_PATTERN.search(path):
+            migration.append((False, 0, _clip(markdown, MAX_SECTION_CHARS)))
+
+    parts = [text for *_, text in sorted(migration, key=lambda m: m[:2])]
+    parts += [text for *_, text in sorted(changelog, key=lambda c: c[:2])]
+    parts += intro
+
+    selected, used, seen = [], 0, set()
+    for text in parts:
+        if text in seen or any(text in s for s in selected):
+            continue
+        seen.add(text)
+        if used + len(text) > max_chars:
+            remaining = max_chars - used
+            if remaining > 200:
+                selected.append(_clip(text, remaining))
+            break
+        selected.append(text)
+        used += len(text) + 2
+    return "\n\n".join(selected)
+
+
+async def get_relevant_package_docs(pkg_name: str, from_version: Optional[str], to_version: Optional[str]) -> str:
+    """Fetches (or loads from cache) the docs for the target version and extracts the upgrade-relevant parts."""
+    target = coerce_version(to_version) if to_version else None
+    version = str(to_version).lstrip("^~=v ") if target and parse_version(str(to_version).lstrip("^~=v ")) else "latest"
+    files = await fetch_package_doc_files(pkg_name, version)
+    return extract_relevant_docs(files, from_version, to_version)
@@ -0,0 +1,241 @@
+import os
+import re
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+from services.js_lexer import tokenize, module_specifiers, LexError
+
+logger = logging.getLogger(__name__)
+
+IGNORED_DIRS = {"node_modules", ".git"}
+SOURCE_EXTENSIONS = ('.js', '.jsx', '.ts', '.tsx')
+COMPONENT_EXTENSIONS = ('.jsx', '.tsx')
+
+# Fast path: one left-to-right pass that consumes comments and string/template literals whole, so
+# specifier-like text inside them never matches. Captures the specifier of import x from 'pkg' /
+# import 'pkg' / export { x } from 'pkg' / require('pkg') / import('pkg'). Import clauses may span
+# lines and contain comments. It has no notion of regex literals (a quote inside one can throw it
+# off), so sources that may contain one go through the js_lexer tokenizer instead.
+_IMPORT_CLAUSE = r"(?:[\w$*{}\s,]|//[^\n]*|/\*.*?\*/)*?"
+_IMPORT_SCAN = re.compile(
+    # Every alternative starts with one of these; checking first lets most positions fail fast.
+    r"""(?=[/'"`ier])(?:"""
+    r"//[^\n]*"
+    r"|/\*.*?(?:\*/|\Z)"
+    r"|(?<![\w$.])(?:(?:import|export)\s*" + _IMPORT_CLAUSE + r"(?<![\w$])from\s*|import\s*|(?:require|import)\s*\(\s*)"
+    r"""(?P<quote>['"])(?P<specifier>[^'"\\\n]+)(?P=quote)"""
+    r"""|'(?:[^'\\\n]|\\.)*'?"""
+    r"""|"(?:[^"\\\n]|\\.)*"?"""
+    r"|`(?:[^`\\]|\\.)*`?)",
+    re.DOTALL,
+)
+# Code just before a slash that makes it the start of a regex literal rather than division, a JSX
+# closing tag or "/>". The scan above is exact up to the first regex literal, so if no slash between
+# its matches follows one of these, it read the whole file correctly.
+_REGEX_LITERAL_CONTEXT = re.compile(
+    r"(?:=>|[(,=:\[!&|?{;+\-*%~^]|(?<![\w$.])(?:return|typeof|case|do|else|in|of|new|delete|void|throw|yield|await))\Z"
+)
+_REGEX_CONTEXT_CHARS = 12
+
+
+def _starts_regex_literal(content: str, gap_start: int, slash: int) -> bool:
+    if content[slash + 1:slash + 2] in ("/", "*", ">"):
+        return False
+    before = content[max(gap_start, slash - _REGEX_CONTEXT_CHARS):slash].rstrip()
+    # Nothing but whitespace since the previous comment or literal: assume the worst.
+    return not before or _REGEX_LITERAL_CONTEXT.search(before) is not None
+
+
+def _needs_lexer(content: str, matches: List[re.Match]) -> bool:
+    """True if the file may contain a regex literal, or an import inside a template substitution."""
+    gaps = []
+    start = 0
+    for match in matches:
+        gaps.append((start, match.start()))
+        token = match.group()
+        if token.startswith("`") and "${" in token and ("import" in token or "require" in token):
+            return True
+        start = match.end()
+    gaps.append((start, len(content)))
+    for gap_start, gap_end in gaps:
+        slash = content.find("/", gap_start, gap_end)
+        while slash != -1:
+            if _starts_regex_literal(content, gap_start, slash):
+                return True
+            slash = content.find("/", slash + 1, gap_end)
+    return False
+
+
+def extract_import_specifiers(content: str) -> List[str]:
+    """
+    Returns the module specifiers imported by a JS/TS source file, in order of appearance. Uses the
+    regex scan unless _needs_lexer finds something only the js_lexer tokenizer reads correctly;
+    sources the lexer rejects keep the regex scan's result.
+    """
+    if "import" not in content and "require" not in content:
+        return []
+    matches = list(_IMPORT_SCAN.finditer(content))
+    specifiers = [m.group("specifier") for m in matches if m.group("specifier")]
+    if _needs_lexer(content, matches):
+        try:
+            specifiers = module_specifiers(list(tokenize(content)))
+        except LexError:
+            pass
+    return list(dict.fromkeys(specifiers))
+
+
+@dataclass
+class IndexedFile:
+    path: str
+    size: int
+    sha256: str
+    imports: List[str] = field(default_factory=list)
+
+
+class ProjectIndex:
+    """
+    A single-pass snapshot of an extracted project: every file outside node_modules/.git with its
+    size and content hash, the text of every JS/TS source file, and a map from import specifier to
+    the files that import it. Built once after unzip and shared by the analysis and refactor phases.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = os.path.abspath(root_dir)
+        self.files: Dict[str, IndexedFile] = {}
+        self.imports: Dict[str, Set[str]] = {}
+        self._contents: Dict[str, str] = {}
+
+    @classmethod
+    def build(cls, root_dir: str) -> "ProjectIndex":
+        index = cls(root_dir)
+        for root, dirs, files in os.walk(index.root_dir):
+            dirs[:] = sorted(d for d in dirs if d not in IGNORED_DIRS)
+            for file_name in sorted(files):
+                index._index_file(os.path.join(root, file_name))
+        logger.info(f"Indexed {len(index.files)} files ({len(index._contents)} sources) under {index.root_dir}")
+        return index
+
+    def _index_file(self, path: str):
+        scanned = self._scan_file(path)
+        if scanned:
+            self._store(*scanned)
+
+    @staticmethod
+    def _scan_file(path: str) -> Optional[Tuple[IndexedFile, Optional[str]]]:
+        """Reads, hashes and (for sources) scans the imports of one file without touching the index."""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            logger.warning(f"Could not index {path}: {e}")
+            return None
+        entry = IndexedFile(path=path, size=len(data), sha256=hashlib.sha256(data).hexdigest())
+        content = None
+        if path.endswith(SOURCE_EXTENSIONS):
+            try:
+                content = data.decode('utf-8')
+            except UnicodeDecodeError:
+                content = None
+            if content is not None:
+                entry.imports = extract_import_specifiers(content)
+        return entry, content
+
+    def _store(self, entry: IndexedFile, content: Optional[str]):
+        self._forget_imports(entry.path)
+        if content is not None:
+            self._contents[entry.path] = content
+            for specifier in entry.imports:
+                self.imports.setdefault(specifier, set()).add(entry.path)
+        self.files[entry.path] = entry
+
+    def _forget_imports(self, path: str):
+        previous = self.files.get(path)
+        if not previous:
+            return
+        for specifier in previous.imports:
+            importers = self.imports.get(specifier)
+            if importers:
+                importers.discard(path)
+                if not importers:
+                    del self.imports[specifier]
+        self._contents.pop(path, None)
+
+    # --- Queries ---
+
+    @property
+    def package_json_path(self) -> Optional[str]:
+        """The shallowest package.json in the project, mirroring a top-down walk."""
+        candidates = [p for p in self.files if os.path.basename(p) == "package.json"]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda p: (p.count(os.sep), p))
+
+    @property
+    def project_root(self) -> Optional[str]:
+        package_json_path = self.package_json_path
+        return os.path.dirname(package_json_path) if package_json_path else None
+
+    def source_files(self) -> List[str]:
+        """Readable JS/TS source files under the project root."""
+        project_root = self.project_root or self.root_dir
+        prefix = project_root.rstrip(os.sep) + os.sep
+        return [p for p in self._contents if p.startswith(prefix)]
+
+    def count_component_files(self) -> int:
+        return sum(1 for p in self.source_files() if p.endswith(COMPONENT_EXTENSIONS))
+
+    def read_text(self, path: str) -> str:
+        return self._contents[path]
+
+    def files_importing(self, pkg_name: str) -> List[str]:
+        """Files importing `pkg_name` itself or one of its subpaths (`pkg/sub`)."""
+        matched = set()
+        for specifier, importers in self.imports.items():
+            if specifier == pkg_name or specifier.startswith(pkg_name + "/"):
+                matched.update(importers)
+        return sorted(matched)
+
+    # --- Updates ---
+
+    async def write_text(self, path: str, content: str):
+        """
+        Writes a file and refreshes its index entry. The write and re-scan run in a worker thread;
+        the index itself is only updated on the event loop, so concurrent writers never race.
+        """
+        scanned = await asyncio.to_thread(self._write_and_scan, path, content)
+        if scanned:
+            self._store(*scanned)
+
+    def _write_and_scan(self, path: str, content: str) -> Optional[Tuple[IndexedFile, Optional[str]]]:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return self._scan_file(path)
+
+    def refresh_file(self, path: str):
+        """Re-indexes a file that was changed on disk outside of the index."""
+        self._index_file(os.path.abspath(path))
+
+
+# --- Per-execution registry ---
+
+_indexes: Dict[str, ProjectIndex] = {}
+
+
+def build_project_index(exec_id: str, temp_dir: str) -> ProjectIndex:
+    index = ProjectIndex.build(temp_dir)
+    _indexes[exec_id] = index
+    return index
+
+
+def get_project_index(exec_id: str, temp_dir: str) -> ProjectIndex:
+    """Returns the index built for this execution, building it if the analysis phase did not."""
+    index = _indexes.get(exec_id)
+    if index is None or index.root_dir != os.path.abspath(temp_dir):
+        index = build_project_index(exec_id, temp_dir)
+    return index
+
+
+def drop_project_index(exec_id: str):
+    _indexes.pop(exec_id, None)
@@ -1,24 +1,75 @@
 from websocket_manager import manager
-import asyncio
 import os
 import json
-import shutil
-from services.analysis_service import find_project_root, run_command_streamed
-from services.llm_service import get_package_docs, construct_refactor_prompt, call_llm_for_refactor
+import asyncio
+from services.analysis_service import install_dependencies, INSTALL_COMMAND, DEPRECATION_PATTERN
+from services.command_runner import run_command_streamed
+from services.verify_service import verify_upgrade, record_type_baseline
+from services.repair_service import repair_upgrade
+from services.log_stream import error_tail
+from services.project_index import get_project_index
+from services.llm_service import get_package_docs, refactor_source, llm_progress
+from services.artifact_service import register_upgrade_result
+from services.concurrency import bounded_map_ordered
+from services.telemetry import span, current_trace
+from services.llm_client import LLMError
+from services.code_edits import diff_stats
+from config import REFACTOR_CONCURRENCY, REFACTOR_PATCH_MAX_CHARS, REFACTOR_COMBINE_PACKAGES, REPAIR_ENABLED
+
 
+MANIFEST_DEPENDENCY_FIELDS = ("dependencies", "devDependencies", "optionalDependencies", "peerDependencies")
+
+def incremental_install_blocker(project_root: str, original_manifest: dict) -> str | None:
+    """
+    Returns why an incremental install on top of the analysis-phase tree would be unsafe,
+    or None if the existing node_modules and lockfile can be reused.
+    """
+    if original_manifest.get("workspaces"):
+        return "workspaces need a full install"
+    if not os.path.isdir(os.path.join(project_root, "node_modules")):
+        return "no node_modules from the analysis phase"
+    # npm writes the hidden lockfile only after a completed install.
+    if not os.path.isfile(os.path.join(project_root, "node_modules", ".package-lock.json")):
+        return "the analysis-phase install did not complete"
+    try:
+        with open(os.path.join(project_root, "package-lock.json"), "r", encoding="utf-8") as f:
+            lock_root = json.load(f).get("packages", {}).get("")
+    except (OSError, ValueError):
+        return "no usable package-lock.json from the analysis phase"
+    if lock_root is None:
+        return "package-lock.json predates lockfile v2"
+    for field in MANIFEST_DEPENDENCY_FIELDS:
+        if (lock_root.get(field) or {}) != (original_manifest.get(field) or {}):
+            return "package-lock.json is out of sync with package.json"
+    return None
 
-def count_lines_changed(original: str, refactored: str) -> int:
-    """A simple line-by-line comparison to count changed lines."""
-    original_lines = original.splitlines()
-    refactored_lines = refactored.splitlines()
-    # Using set for efficient lookup
-    original_set = set(original_lines)
-    # Count lines in refactored that are not in original
-    return sum(1 for line in refactored_lines if line not in original_set)
+async def install_upgraded_dependencies(exec_id: str, project_root: str, original_manifest: dict, specs: list):
+    """
+    Installs only the upgraded/renamed packages on top of the analysis-phase node_modules and
+    lockfile; npm prunes the replaced packages because package.json no longer lists them.
+    Falls back to a full install, reporting why, when that is not safe or does not succeed.
+    Returns (stderr, returncode).
+    """
+    reason = incremental_install_blocker(project_root, original_manifest)
+    if reason is None:
+        await manager.send_json(exec_id, {"type": "log", "status": "info", "message": f"Installing {len(specs)} changed packages on top of the existing dependency tree..."})
+        with span("install_incremental", packages=len(specs)):
+            _, install_stderr, install_returncode = await run_command_streamed([*INSTALL_COMMAND, *specs], cwd=project_root, exec_id=exec_id, keep_pattern=DEPRECATION_PATTERN)
+        if install_returncode == 0:
+            return install_stderr, install_returncode
+        reason = "the incremental install failed"
+    await manager.send_json(exec_id, {"type": "log", "status": "warning", "message": f"Running a full install because {reason}."})
+    return await install_dependencies(exec_id, project_root)
 
-async def run_package_refactoring(exec_id: str, packages: list, temp_dir: str):
+async def run_package_refactoring(exec_id: str, packages: list, temp_dir: str) -> bool:
+    """
+    Upgrades the selected packages, refactors the files that use them and verifies the build.
+    Errors are reported on the job's stream; returns whether the upgrade succeeded.
+    """
     major_step_message = "Upgrading Selected Packages"
-    project_root = find_project_root(temp_dir)
+    type_baseline = None
+    index = await asyncio.to_thread(get_project_index, exec_id, temp_dir)
+    project_root = index.project_root
     if not project_root:
         raise FileNotFoundError("Could not find project root for refactoring.")
 
@@ -28,8 +79,10 @@ async def run_package_refactoring(exec_id: str, packages: list, temp_dir: str):
         # --- Update package.json with all selected upgrades first ---
         await manager.send_json(exec_id, {"type": "log", "status": "loading", "message": "Updating package.json with selected versions..."})
         package_json_path = os.path.join(project_root, 'package.json')
+        install_specs = []
         with open(package_json_path, 'r+') as f:
             data = json.load(f)
+            original_manifest = json.loads(json.dumps(data))
             for package in packages:
                 old_name = package['name']
                 new_name = package.get('newName', old_name) # Use newName if it exists
@@ -45,97 +98,156 @@ async def run_package_refactoring(exec_id: str, packages: list, temp_dir: str):
                 # Add the new (or updated) package. Assume 'dependencies' for superseded.
                 if 'dependencies' not in data: data['dependencies'] = {}
                 data['dependencies'][new_name] = new_version
+                install_specs.append(f"{new_name}@{new_version}")
 
             f.seek(0)
             json.dump(data, f, indent=2)
             f.truncate()
+        index.refresh_file(package_json_path)
         await manager.send_json(exec_id, {"type": "log", "status": "success", "message": "package.json updated."})
         
         # --- Install all upgraded packages ---
         await manager.send_json(exec_id, {"type": "log", "status": "loading", "message": "Installing upgraded dependencies..."})
-        install_command = ["npm", "install", "--legacy-peer-deps"]
-        
-        # FIX: Use the async run_command_streamed which returns three values
-        _, install_stderr, install_returncode = await run_command_streamed(install_command, cwd=project_root, exec_id=exec_id)
+        install_stderr, install_returncode = await install_upgraded_dependencies(exec_id, project_root, original_manifest, install_specs)
         
         if install_returncode != 0:
-            await manager.send_json(exec_id, {"type": "log", "status": "error", "message": f"Failed to install upgraded dependencies: {install_stderr[:200]}..."})
+            await manager.send_json(exec_id, {"type": "log", "status": "error", "message": f"Failed to install upgraded dependencies: {error_tail(install_stderr, 500)}"})
             raise RuntimeError("Upgraded installation failed.")
         
         await manager.send_json(exec_id, {"type": "log", "status": "success", "message": "Upgraded dependencies installed."})
 
+        # Type errors the project already has, so verification only fails fast on new ones. tsc runs
+        # alongside the LLM calls; refactored files are written only once it has finished reading.
+        type_baseline = asyncio.create_task(record_type_baseline(exec_id, project_root))
+
         # --- LLM Refactoring Phase ---
+        cache_stats = {"hits": 0, "misses": 0}
+        changed_files = set()
+        # Pre-upgrade content of every changed file, keyed by path relative to the project root.
+        originals = {}
+        failed_files = []
+        # Selected packages (with their docs) imported by each file, in selection order.
+        file_upgrades = {}
         for package in packages:
             pkg_name = package.get('name')
             new_pkg_name = package.get('newName', pkg_name)
+            with span("refactor_package", package=pkg_name):
+                log_message = f"Refactoring for {pkg_name}"
+                if new_pkg_name != pkg_name:
+                    log_message += f" -> {new_pkg_name}"
+                await manager.send_json(exec_id, {"type": "log", "status": "info", "message": log_message})
             
-            log_message = f"Refactoring for {pkg_name}"
-            if new_pkg_name != pkg_name:
-                log_message += f" -> {new_pkg_name}"
-            await manager.send_json(exec_id, {"type": "log", "status": "info", "message": log_message})
-            
-            relevant_files = []
-            file_extensions = ('.js', '.jsx', '.ts', '.tsx')
-            for root, _, files in os.walk(project_root):
-                if 'node_modules' in root or '.git' in root:
+                # Only files that import the old package (or one of its subpaths) need the LLM;
+                # files that merely mention the name in a comment or string are skipped.
+                with span("scan_package", package=pkg_name) as scan_span:
+                    sources = set(index.source_files())
+                    relevant_files = [p for p in index.files_importing(pkg_name) if p in sources]
+                    mentioning = sum(1 for p in sources if pkg_name in index.read_text(p))
+                    skipped = max(mentioning - len(relevant_files), 0)
+                    scan_span.set(files=len(relevant_files), skipped=skipped)
+
+                skipped_note = f" Skipped {skipped} files that mention it without importing it." if skipped else ""
+                if not relevant_files:
+                    await manager.send_json(exec_id, {"type": "log", "status": "info", "message": f"No files import {pkg_name}. Skipping refactor.{skipped_note}"})
                     continue
-                for file in files:
-                    if file.endswith(file_extensions):
-                        file_path = os.path.join(root, file)
-                        try:
-                            with open(file_path, 'r', encoding='utf-8') as f:
-                                content = f.read()
-                                # Check for old package name in content for refactoring
-                                if pkg_name in content:
-                                    relevant_files.append(file_path)
-                        except Exception:
-                            continue
-            
-            if not relevant_files:
-                await manager.send_json(exec_id, {"type": "log", "status": "info", "message": f"No files found using {pkg_name}. Skipping refactor."})
-                continue
 
-            await manager.send_json(exec_id, {"type": "log", "status": "info", "message": f"Found {len(relevant_files)} files using {pkg_name}."})
-            package_docs = get_package_docs(new_pkg_name)
+                await manager.send_json(exec_id, {"type": "log", "status": "info", "message": f"Found {len(relevant_files)} files importing {pkg_name}.{skipped_note}"})
+                # The old version only bounds the changelog when the package itself is being upgraded.
+                from_version = package.get('current') if new_pkg_name == pkg_name else None
+                with span("package_docs", package=new_pkg_name):
+                    package_docs = await get_package_docs(new_pkg_name, from_version, package['latest'])
+                for file_path in relevant_files:
+                    file_upgrades.setdefault(file_path, []).append((package, package_docs))
 
-            for i, file_path in enumerate(relevant_files):
-                relative_path = os.path.relpath(file_path, project_root)
-                await manager.send_json(exec_id, {"type": "log", "status": "loading", "message": f"Refactoring {i+1}/{len(relevant_files)}: {relative_path}"})
-                
-                with open(file_path, 'r+', encoding='utf-8') as f:
-                    original_content = f.read()
-                    prompt = construct_refactor_prompt(relative_path, original_content, package, package_docs)
-                    refactored_content = await call_llm_for_refactor(prompt, original_content)
-                    if refactored_content != original_content:
-                        lines_changed = count_lines_changed(original_content, refactored_content)
-                        f.seek(0)
-                        f.write(refactored_content)
-                        f.truncate()
-                        await manager.send_json(exec_id, {"type": "log", "status": "success", "message": f"Refactored {relative_path} ({lines_changed} lines changed)."})
-                    else:
-                        await manager.send_json(exec_id, {"type": "log", "status": "info", "message": f"No changes needed for {relative_path}."})
-                await asyncio.sleep(1) # Small delay to allow UI to update
-
-        # --- Step 5: Automated Verification (Build Step) ---
-        await manager.send_json(exec_id, {"type": "log", "status": "loading", "message": "Verifying the upgrade by running the build command..."})
-        build_command = ["npm", "run", "build"]
-        
-        # FIX: Use the async run_command_streamed for the build step as well
-        _, build_stderr, build_returncode = await run_command_streamed(build_command, cwd=project_root, exec_id=exec_id)
+        async def refactor_file(file_path: str) -> dict:
+            relative_path = os.path.relpath(file_path, project_root)
+            original_content = index.read_text(file_path)
 
-        if build_returncode != 0:
-            await manager.send_json(exec_id, {"type": "log", "status": "error", "message": f"Build failed after upgrade! Error: {build_stderr[:300]}..."})
-            raise RuntimeError("Build verification failed. This is where the Repair Agent would take over.")
-        
-        await manager.send_json(exec_id, {"type": "log", "status": "success", "message": "Build successful! The upgrade appears to be stable."})
+            async def report_progress(chars: int):
+                # One updating line per file in the UI (keyed by file), replaced by the result event.
+                await manager.send_json(exec_id, {"type": "progress", "status": "info", "key": relative_path, "message": f"Generating changes for {relative_path}: {chars} characters so far..."}, droppable=True, record=False)
+
+            try:
+                with span("refactor_file", file=relative_path), llm_progress(report_progress):
+                    refactored_content = await refactor_source(relative_path, original_content, index.files[file_path].sha256, file_upgrades[file_path], cache_stats)
+            except LLMError as e:
+                return {"path": relative_path, "changed": False, "error": str(e)}
+            if refactored_content == original_content:
+                return {"path": relative_path, "changed": False}
+            originals[relative_path] = original_content
+            return {"path": relative_path, "changed": True, "content": refactored_content, **diff_stats(original_content, refactored_content, relative_path, REFACTOR_PATCH_MAX_CHARS)}
+
+        relevant_files = sorted(file_upgrades)
+        total = len(relevant_files)
+        if total:
+            shared = sum(1 for upgrades in file_upgrades.values() if len(upgrades) > 1)
+            message = f"Refactoring {total} files ({min(REFACTOR_CONCURRENCY, total)} at a time)..."
+            if shared and REFACTOR_COMBINE_PACKAGES:
+                message += f" {shared} of them import several selected packages and are refactored for all of them in one pass."
+            await manager.send_json(exec_id, {"type": "log", "status": "info", "message": message})
+        with span("refactor_files", files=total):
+            async for i, file_path, result in bounded_map_ordered(refactor_file, relevant_files, REFACTOR_CONCURRENCY):
+                relative_path = result["path"]
+                if result["changed"]:
+                    # Files are written in order as results come in, but not before the type baseline
+                    # has read the originals; the workers keep calling the model meanwhile.
+                    await type_baseline
+                    await index.write_text(file_path, result["content"])
+                    changed_files.add(relative_path)
+                    await manager.send_json(exec_id, {
+                        "type": "log", "status": "success",
+                        "message": f"Refactored {i+1}/{total}: {relative_path} (+{result['added']} -{result['removed']} lines).",
+                        "file": relative_path,
+                        "packages": [package['name'] for package, _ in file_upgrades[file_path]],
+                        "linesAdded": result["added"],
+                        "linesRemoved": result["removed"],
+                        "patch": result["patch"],
+                        "patchTruncated": result["patchTruncated"],
+                    })
+                elif result.get("error"):
+                    failed_files.append(relative_path)
+                    await manager.send_json(exec_id, {"type": "log", "status": "error", "message": f"Could not refactor {i+1}/{total}: {relative_path}. {result['error']}", "file": relative_path})
+                else:
+                    await manager.send_json(exec_id, {"type": "log", "status": "info", "message": f"No changes needed for {i+1}/{total}: {relative_path}.", "file": relative_path})
+
+        if failed_files:
+            await manager.send_json(exec_id, {"type": "log", "status": "warning", "message": f"{len(failed_files)} files were left unchanged because the model could not be reached: {', '.join(failed_files)}"})
+        if cache_stats["hits"] or cache_stats["misses"]:
+            await manager.send_json(exec_id, {"type": "log", "status": "info", "message": f"LLM cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses."})
+        usage = current_trace().llm_usage if current_trace() else {}
+        if usage.get("requests"):
+            await manager.send_json(exec_id, {
+                "type": "log", "status": "info",
+                "message": f"LLM usage so far: {usage['requests']} requests, {usage.get('promptTokens', 0)} prompt and {usage.get('responseTokens', 0)} response tokens, {usage.get('retries', 0)} retries.",
+                "llmUsage": dict(usage),
+            })
+
+        # --- Step 5: Automated Verification: quick checks of the changed files, then the build ---
+        await type_baseline
+        diagnostics = await verify_upgrade(exec_id, project_root, originals)
+        if diagnostics and REPAIR_ENABLED:
+            docs_by_name = {package['name']: docs for upgrades in file_upgrades.values() for package, docs in upgrades}
+            all_upgrades = [(package, docs_by_name.get(package['name'], "")) for package in packages]
+            upgrades_by_path = {os.path.relpath(p, project_root).replace(os.sep, "/"): u for p, u in file_upgrades.items()}
+            diagnostics, repaired_files = await repair_upgrade(exec_id, index, project_root, originals, diagnostics, upgrades_by_path, all_upgrades)
+            changed_files |= repaired_files
+        if diagnostics:
+            raise RuntimeError("Build verification failed and the errors could not be repaired automatically.")
 
-        # --- Finalize and Zip ---
-        await manager.send_json(exec_id, {"type": "log", "status": "loading", "message": "Zipping upgraded project files..."})
-        output_zip_path = f"./temp/{exec_id}-upgraded"
-        shutil.make_archive(output_zip_path, 'zip', project_root)
-        await manager.send_json(exec_id, {"type": "refactor_complete", "download_path": f"{output_zip_path}.zip"})
+        # --- Finalize: the archive is streamed by the download endpoint ---
+        register_upgrade_result(exec_id, project_root, sorted(changed_files))
+        await manager.send_json(exec_id, {
+            "type": "refactor_complete",
+            "download_path": f"download/{exec_id}",
+            "patch_download_path": f"download/{exec_id}?mode=patch",
+            "changed_files": sorted(changed_files),
+        })
+        return True
 
     except Exception as e:
         await manager.send_json(exec_id, {"type": "log", "status": "error", "message": f"An error occurred during refactoring: {e}"})
+        return False
     finally:
+        if type_baseline is not None and not type_baseline.done():
+            type_baseline.cancel()
         await manager.send_json(exec_id, {"type": "major_step_end", "message": major_step_message})
\ No newline at end of file
@@ -0,0 +1,118 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List, Set, Tuple
+from websocket_manager import manager
+from services.project_index import ProjectIndex
+from services.llm_service import Upgrade, repair_source
+from services.llm_client import LLMError
+from services.verify_service import Diagnostic, verify_upgrade
+from services.concurrency import bounded_map_ordered
+from services.code_edits import diff_stats
+from services.telemetry import span
+from config import REFACTOR_CONCURRENCY, REFACTOR_PATCH_MAX_CHARS, REPAIR_MAX_ROUNDS, REPAIR_TIME_BUDGET_SECONDS, REPAIR_MAX_FILES
+
+logger = logging.getLogger(__name__)
+
+# Errors sent to the model per file; the first ones usually explain the rest.
+MAX_ERRORS_PER_FILE = 20
+
+
+def group_by_file(diagnostics: List[Diagnostic]) -> Dict[str, List[Diagnostic]]:
+    """File-attributed diagnostics grouped by file, in order of first appearance."""
+    by_file: Dict[str, List[Diagnostic]] = {}
+    for diagnostic in diagnostics:
+        if diagnostic.file:
+            by_file.setdefault(diagnostic.file, []).append(diagnostic)
+    return by_file
+
+
+async def repair_upgrade(exec_id: str, index: ProjectIndex, project_root: str, originals: Dict[str, str],
+                         diagnostics: List[Diagnostic], file_upgrades: Dict[str, List[Upgrade]],
+                         all_upgrades: List[Upgrade]) -> Tuple[List[Diagnostic], Set[str]]:
+    """
+    Repairs a failed verification: sends each failing file with its errors to the model
+    (concurrently), writes the fixes back and verifies again, for at most REPAIR_MAX_ROUNDS rounds
+    and REPAIR_TIME_BUDGET_SECONDS. file_upgrades maps a refactored file (relative to project_root)
+    to the upgrades it was refactored for; other files get all_upgrades as context. Repaired files
+    are added to originals. Returns the diagnostics still failing ([] once verification passes)
+    and the files changed by the repair.
+    """
+    deadline = time.monotonic() + REPAIR_TIME_BUDGET_SECONDS
+    repaired_files: Set[str] = set()
+
+    for round_number in range(1, REPAIR_MAX_ROUNDS + 1):
+        failing = group_by_file(diagnostics)
+        if not failing:
+            await manager.send_json(exec_id, {"type": "log", "status": "warning", "message": "The build errors do not point at project files, so they cannot be repaired automatically."})
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            await manager.send_json(exec_id, {"type": "log", "status": "warning", "message": "The repair time budget is used up."})
+            break
+
+        files = list(failing)[:REPAIR_MAX_FILES]
+        await manager.send_json(exec_id, {"type": "log", "status": "info", "message": f"Repair round {round_number}/{REPAIR_MAX_ROUNDS}: fixing {len(files)} files with build errors..."})
+        try:
+            with span("repair_round", round=round_number, files=len(files)) as round_span:
+                changed = await asyncio.wait_for(_repair_files(exec_id, index, project_root, originals, failing, files, file_upgrades, all_upgrades), remaining)
+                round_span.set(changed=len(changed))
+                if not changed:
+                    await manager.send_json(exec_id, {"type": "log", "status": "warning", "message": "The model had no fixes for the failing files."})
+                    break
+                repaired_files |= changed
+                diagnostics = await asyncio.wait_for(verify_upgrade(exec_id, project_root, originals), deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            await manager.send_json(exec_id, {"type": "log", "status": "warning", "message": f"Repair stopped after {REPAIR_TIME_BUDGET_SECONDS}s."})
+            break
+        if not diagnostics:
+            await manager.send_json(exec_id, {"type": "log", "status": "success", "message": f"Build repaired in {round_number} round(s); {len(repaired_files)} files fixed."})
+            return [], repaired_files
+
+    return diagnostics, repaired_files
+
+
+async def _repair_files(exec_id: str, index: ProjectIndex, project_root: str, originals: Dict[str, str],
+                        failing: Dict[str, List[Diagnostic]], files: List[str],
+                        file_upgrades: Dict[str, List[Upgrade]], all_upgrades: List[Upgrade]) -> Set[str]:
+    """One round of concurrent repairs; returns the files that changed."""
+    async def repair_file(relative_path: str) -> dict:
+        file_path = os.path.join(project_root, relative_path)
+        try:
+            before = index.read_text(file_path)
+        except KeyError:
+            # Not an indexed source file (e.g. a .mjs config); read it from disk.
+            with open(file_path, "r", encoding="utf-8") as f:
+                before = f.read()
+        errors = [str(d) for d in failing[relative_path][:MAX_ERRORS_PER_FILE]]
+        try:
+            with span("repair_file", file=relative_path):
+                after = await repair_source(relative_path, before, errors, file_upgrades.get(relative_path) or all_upgrades)
+        except LLMError as e:
+            return {"path": relative_path, "changed": False, "error": str(e)}
+        if after == before:
+            return {"path": relative_path, "changed": False}
+        await index.write_text(file_path, after)
+        originals.setdefault(relative_path, before)
+        return {"path": relative_path, "changed": True, **diff_stats(before, after, relative_path, REFACTOR_PATCH_MAX_CHARS)}
+
+    changed = set()
+    total = len(files)
+    async for i, relative_path, result in bounded_map_ordered(repair_file, files, REFACTOR_CONCURRENCY):
+        if result["changed"]:
+            changed.add(relative_path)
+            await manager.send_json(exec_id, {
+                "type": "log", "status": "info",
+                "message": f"Repaired {i+1}/{total}: {relative_path} (+{result['added']} -{result['removed']} lines).",
+                "file": relative_path,
+                "linesAdded": result["added"],
+                "linesRemoved": result["removed"],
+                "patch": result["patch"],
+                "patchTruncated": result["patchTruncated"],
+            })
+        elif result.get("error"):
+            await manager.send_json(exec_id, {"type": "log", "status": "error", "message": f"Could not repair {i+1}/{total}: {relative_path}. {result['error']}", "file": relative_path})
+        else:
+            await manager.send_json(exec_id, {"type": "log", "status": "info", "message": f"No fix proposed for {i+1}/{total}: {relative_path}."})
+    return changed
@@ -0,0 +1,201 @@
+import re
+from typing import Iterable, List, Optional, Tuple
+
+_VERSION_PATTERN = re.compile(r"v?(\d+)(?:\.(\d+|[xX*]))?(?:\.(\d+|[xX*]))?(?:-([0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?")
+
+Version = Tuple[int, int, int, Tuple]
+
+
+def _prerelease_key(prerelease: Optional[str]) -> Tuple:
+    # A release sorts after all of its prereleases; numeric identifiers sort before alphanumeric ones.
+    if not prerelease:
+        return (1,)
+    parts = []
+    for part in prerelease.split("."):
+        parts.append((0, int(part), "") if part.isdigit() else (1, 0, part))
+    return (0, tuple(parts))
+
+
+def parse_version(text: str) -> Optional[Version]:
+    """Parses an exact version such as `1.2.3`, `v1.2.3` or `1.2.3-beta.1` into a sortable tuple."""
+    match = _VERSION_PATTERN.fullmatch(text.strip())
+    if not match or not (match.group(2) or "").isdigit() or not (match.group(3) or "").isdigit():
+        return None
+    return int(match.group(1)), int(match.group(2)), int(match.group(3)), _prerelease_key(match.group(4))
+
+
+def coerce_version(text: str) -> Optional[Version]:
+    """
+    Finds the first version-like token in `text` (`^1.2`, `~3`, `>=2.0.0`, `## [4.1.0] - 2023-01-01`)
+    and returns it as a version tuple, filling missing or wildcard parts with 0.
+    """
+    if not text:
+        return None
+    match = re.search(r"(?<![\w.])" + _VERSION_PATTERN.pattern, text)
+    if not match:
+        return None
+    minor = match.group(2) if (match.group(2) or "").isdigit() else "0"
+    patch = match.group(3) if (match.group(3) or "").isdigit() else "0"
+    return int(match.group(1)), int(minor), int(patch), _prerelease_key(match.group(4))
+
+
+def format_version(version: Version) -> str:
+    return f"{version[0]}.{version[1]}.{version[2]}"
+
+
+# --- Ranges (npm semantics) ---
+
+# One comparator set is a list of (operator, version) that must all hold; a range is satisfied by
+# any of its sets. An empty set matches every version.
+Comparator = Tuple[str, Version]
+Range = List[List[Comparator]]
+
+_PARTIAL = re.compile(r"v?(\d+|[xX*])(?:\.(\d+|[xX*])(?:\.(\d+|[xX*])(?:-([0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?)?)?")
+_TERM = re.compile(r"(\^|~>?|[<>]=?|=)?(.+)")
+_HYPHEN = re.compile(r"(\S+)\s+-\s+(\S+)")
+_OPERATORS = {
+    "=": lambda a, b: a == b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+}
+Partial = Tuple[Optional[int], Optional[int], Optional[int], Optional[str]]
+
+
+def _version(major: int, minor: int, patch: int, prerelease: Optional[str] = None) -> Version:
+    return major, minor, patch, _prerelease_key(prerelease)
+
+
+def _parse_partial(text: str) -> Optional[Partial]:
+    match = _PARTIAL.fullmatch(text)
+    if not match:
+        return None
+    parts = [int(g) if g and g.isdigit() else None for g in match.group(1, 2, 3)]
+    # Everything after a wildcard is a wildcard: `1.x.3` means `1.x`.
+    for i in (1, 2):
+        if parts[i - 1] is None:
+            parts[i] = None
+    return parts[0], parts[1], parts[2], match.group(4) if parts[2] is not None else None
+
+
+def _lowest_above(major: int, minor: Optional[int] = None) -> Version:
+    # `<2.0.0-0` rather than `<2.0.0`, so prereleases of the next version are excluded too.
+    return _version(major + 1, 0, 0, "0") if minor is None else _version(major, minor + 1, 0, "0")
+
+
+def _desugar(operator: str, partial: Partial) -> Optional[List[Comparator]]:
+    """Comparators for one range term; None for a term no version can satisfy."""
+    major, minor, patch, prerelease = partial
+    if operator in ("", "=") or (major is None and operator in ("~", "^")):
+        if major is None:
+            return []
+        if minor is None or patch is None:
+            return [(">=", _version(major, minor or 0, 0)), ("<", _lowest_above(major, minor))]
+        return [("=", _version(major, minor, patch, prerelease))]
+    lower = _version(major, minor or 0, patch or 0, prerelease) if major is not None else None
+    if operator == "~":
+        return [(">=", lower), ("<", _lowest_above(major, minor))]
+    if operator == "^":
+        if major > 0 or minor is None:
+            upper = _lowest_above(major)
+        elif minor > 0 or patch is None:
+            upper = _lowest_above(0, minor)
+        else:
+            upper = _version(0, 0, patch + 1, "0")
+        return [(">=", lower), ("<", upper)]
+    if major is None:
+        # `>=*` and `<=*` match anything, `>*` and `<*` nothing.
+        return [] if operator in (">=", "<=") else None
+    if operator == ">=":
+        return [(">=", lower)]
+    if operator == ">":
+        if patch is None:
+            return [(">=", _version(*_lowest_above(major, minor)[:3]))]
+        return [(">", lower)]
+    if operator == "<":
+        return [("<", lower if patch is not None else _version(major, minor or 0, 0, "0"))]
+    if patch is None:
+        return [("<", _lowest_above(major, minor))]
+    return [("<=", lower)]
+
+
+def _parse_comparator_set(text: str) -> Optional[List[Comparator]]:
+    hyphen = _HYPHEN.fullmatch(text)
+    if hyphen:
+        low, high = _parse_partial(hyphen.group(1)), _parse_partial(hyphen.group(2))
+        if low is None or high is None:
+            return None
+        return (_desugar(">=", low) or []) + (_desugar("<=", high) or [])
+    comparators: List[Comparator] = []
+    # `>= 1.2` is the same as `>=1.2`.
+    for term in re.sub(r"([<>=~^])\s+", r"\1", text).split():
+        match = _TERM.fullmatch(term)
+        partial = _parse_partial(match.group(2)) if match else None
+        if partial is None:
+            return None
+        desugared = _desugar((match.group(1) or "").replace("~>", "~"), partial)
+        if desugared is None:
+            return [("<", _version(0, 0, 0, "0"))]
+        comparators += desugared
+    return comparators
+
+
+def parse_range(text: str) -> Optional[Range]:
+    """
+    Parses an npm version range (`^1.2.3`, `~1.2`, `1.x`, `>=1.0.0 <2`, `1.2 - 2.3.4`, `^1 || ^2`,
+    `*`). Returns None for specs that are not ranges: dist-tags, URLs, git, file: and npm: aliases.
+    """
+    sets = []
+    for part in text.strip().split("||"):
+        comparators = _parse_comparator_set(part.strip())
+        if comparators is None:
+            return None
+        sets.append(comparators)
+    return sets
+
+
+def satisfies(version: Version, version_range: Range, include_prerelease: bool = False) -> bool:
+    """
+    As npm: a prerelease only satisfies a set that names a prerelease of the same major.minor.patch,
+    so `^1.2.3` does not pull in `2.0.0-beta`.
+    """
+    for comparators in version_range:
+        if not all(_OPERATORS[op](version, bound) for op, bound in comparators):
+            continue
+        if include_prerelease or version[3] == (1,):
+            return True
+        if any(bound[:3] == version[:3] and bound[3] != (1,) for _, bound in comparators):
+            return True
+    return False
+
+
+def matches_any_version(version_range: Range) -> bool:
+    """True for `*`, `x`, `""` and the like, which never need an upgrade."""
+    return any(not comparators for comparators in version_range)
+
+
+def min_version(version_range: Range) -> Optional[Version]:
+    """The lowest release the range allows (its "base" version), or None if it allows none."""
+    lowest = None
+    for comparators in version_range:
+        candidate = _version(0, 0, 0)
+        for op, bound in comparators:
+            if op in (">=", "=") and bound > candidate:
+                candidate = bound
+            elif op == ">" and bound >= candidate:
+                # The next release after the bound.
+                candidate = bound[:3] + (_prerelease_key(None),) if bound[3] != (1,) else (bound[0], bound[1], bound[2] + 1, (1,))
+        if satisfies(candidate, [comparators], include_prerelease=True) and (lowest is None or candidate < lowest):
+            lowest = candidate
+    return lowest
+
+
+def max_satisfying(versions: Iterable[str], version_range: Range) -> Optional[str]:
+    """The highest of the given versions that satisfies the range."""
+    best, best_text = None, None
+    for text in versions:
+        version = parse_version(text)
+        if version is not None and (best is None or version > best) and satisfies(version, version_range):
+            best, best_text = version, text
+    return best_text
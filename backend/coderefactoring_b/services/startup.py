@@ -0,0 +1,114 @@
+import sys
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from importlib.abc import MetaPathFinder
+from typing import Dict, Optional
+from config import STARTUP_PROFILE_IMPORTS
+
+logger = logging.getLogger(__name__)
+
+# Import time by module group: {"seconds" (its own, excluding nested imports), "modules"}.
+_imports: Dict[str, dict] = {}
+# Initialization steps (toolchain probe, Vertex AI, ...) in seconds; lazy ones are added when they run.
+_init: Dict[str, float] = {}
+_started = time.perf_counter()
+_ready_seconds: Optional[float] = None
+# Modules listed in the ready log line; startup_report has them all.
+LOGGED_IMPORTS = 10
+
+
+def import_group(name: str) -> str:
+    """Our own modules are reported one by one (services.llm_service); others by package (fastapi)."""
+    parts = name.split(".")
+    return ".".join(parts[:2]) if parts[0] in ("services", "api") else parts[0]
+
+
+class ImportTimer(MetaPathFinder):
+    """
+    Times the first load of every module imported after install(). Each module is charged only
+    its own execution time; the modules it imports are charged to their own group.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def install(self):
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+
+    def find_spec(self, name, path, target=None):
+        if getattr(self._local, "finding", False):
+            return None
+        self._local.finding = True
+        try:
+            for finder in sys.meta_path:
+                find_spec = getattr(finder, "find_spec", None) if finder is not self else None
+                spec = find_spec(name, path, target) if find_spec else None
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._local.finding = False
+        loader = spec.loader
+        # Shared loaders (builtins, frozen modules) are classes; only per-module loader instances are wrapped.
+        if loader is not None and not isinstance(loader, type) and hasattr(loader, "exec_module"):
+            try:
+                loader.exec_module = self._timed(name, loader.exec_module)
+            except AttributeError:
+                pass
+        return spec
+
+    def _timed(self, name: str, exec_module):
+        def timed_exec_module(module):
+            stack = self._local.__dict__.setdefault("stack", [])
+            frame = [time.perf_counter(), 0.0]  # start, time spent in nested imports
+            stack.append(frame)
+            try:
+                exec_module(module)
+            finally:
+                stack.pop()
+                elapsed = time.perf_counter() - frame[0]
+                if stack:
+                    stack[-1][1] += elapsed
+                entry = _imports.setdefault(import_group(name), {"seconds": 0.0, "modules": 0})
+                entry["seconds"] = round(entry["seconds"] + elapsed - frame[1], 4)
+                entry["modules"] += 1
+        return timed_exec_module
+
+
+import_timer = ImportTimer()
+if STARTUP_PROFILE_IMPORTS:
+    import_timer.install()
+
+
+@contextmanager
+def timed_init(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _init[name] = round(_init.get(name, 0) + time.perf_counter() - start, 4)
+
+
+def _slowest_imports() -> Dict[str, dict]:
+    return dict(sorted(_imports.items(), key=lambda item: item[1]["seconds"], reverse=True))
+
+
+def mark_ready():
+    """Called once the app can serve requests; logs where the startup time went."""
+    global _ready_seconds
+    _ready_seconds = round(time.perf_counter() - _started, 4)
+    imports = ", ".join(f"{name} {t['seconds']:.3f}s" for name, t in list(_slowest_imports().items())[:LOGGED_IMPORTS])
+    init = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in _init.items())
+    logger.info(f"Ready in {_ready_seconds:.3f}s. Slowest imports: {imports or 'not profiled'}. Init: {init or 'none'}.")
+
+
+def startup_report() -> dict:
+    """
+    Import time by module (slowest first; lazy imports are added when they happen; empty unless
+    STARTUP_PROFILE_IMPORTS) and init steps.
+    """
+    return {"readySeconds": _ready_seconds, "imports": _slowest_imports(), "init": dict(_init)}
@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from config import TELEMETRY_LOG_DIR
+
+logger = logging.getLogger(__name__)
+
+
+# --- Metrics (Prometheus text exposition format) ---
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+SIZE_BUCKETS = (1_000, 4_000, 16_000, 64_000, 256_000, 1_000_000)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...], buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            # Per-bucket (non-cumulative) counts + [sum, count]
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0, 0])
+            series[bisect_left(self.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for key, series in items:
+            base = _labels(self.labelnames, key)
+            cumulative = 0
+            for bound, hits in zip((*self.buckets, "+Inf"), series):
+                cumulative += hits
+                lines.append(f"{self.name}_bucket{_labels((*self.labelnames, 'le'), (*key, bound))} {cumulative}")
+            lines.append(f"{self.name}_sum{base} {series[-2]}")
+            lines.append(f"{self.name}_count{base} {series[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in items)
+        return lines
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+PHASE_SECONDS = Histogram("upgrade_phase_duration_seconds", "Wall time of pipeline phases.", ("phase", "status"))
+LLM_PAYLOAD_CHARS = Histogram("upgrade_llm_payload_chars", "Size of LLM prompts and responses in characters.", ("direction",), SIZE_BUCKETS)
+LLM_TOKENS = Counter("upgrade_llm_tokens_total", "Tokens reported by the model.", ("direction",))
+LLM_REQUESTS = Counter("upgrade_llm_requests_total", "LLM requests by outcome (ok, retry, hedge, aborted, error).", ("outcome",))
+METRICS = [PHASE_SECONDS, LLM_PAYLOAD_CHARS, LLM_TOKENS, LLM_REQUESTS]
+
+
+def render_metrics(gauges: Optional[Dict[str, float]] = None) -> str:
+    """All registered metrics, plus point-in-time gauges ({name: value}), as Prometheus text."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for name, value in (gauges or {}).items():
+        lines.extend([f"# TYPE {name} gauge", f"{name} {value}"])
+    return "\n".join(lines) + "\n"
+
+
+# --- Spans ---
+
+@dataclass
+class Span:
+    name: str
+    attributes: dict
+    started_at: float = field(default_factory=time.time)
+    duration: Optional[float] = None
+    status: str = "ok"
+    children: List["Span"] = field(default_factory=list)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            "step": self.name,
+            "timestamp": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat().replace("+00:00", "Z"),
+            "durationSeconds": round(self.duration, 4) if self.duration is not None else None,
+            "status": self.status,
+            **self.attributes,
+            **({"children": [c.to_dict() for c in self.children]} if self.children else {}),
+        }
+
+
+@dataclass
+class Trace:
+    exec_id: str
+    spans: List[Span] = field(default_factory=list)
+    # LLM requests, tokens, retries, hedges, aborted streams and errors of the job; see account_llm.
+    llm_usage: Dict[str, int] = field(default_factory=dict)
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Times a phase. Spans nest by context (including across asyncio tasks and to_thread calls
+    started inside them) and are attached to the current job's trace; every span also feeds the
+    phase duration histogram. `name` is a metric label, so keep per-item details in attributes.
+    """
+    record = Span(name, attributes)
+    parent = _current_span.get()
+    trace = _current_trace.get()
+    if parent is not None:
+        parent.children.append(record)
+    elif trace is not None:
+        trace.spans.append(record)
+    token = _current_span.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except asyncio.CancelledError:
+        record.status = "cancelled"
+        raise
+    except BaseException:
+        record.status = "error"
+        raise
+    finally:
+        record.duration = time.perf_counter() - start
+        _current_span.reset(token)
+        PHASE_SECONDS.observe(record.duration, phase=name, status=record.status)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def account_llm(**counts: Optional[int]):
+    """Adds to the current job's LLM usage, e.g. account_llm(requests=1, promptTokens=812)."""
+    record = _current_trace.get()
+    if record is not None:
+        for name, value in counts.items():
+            record.llm_usage[name] = record.llm_usage.get(name, 0) + (value or 0)
+
+
+def record_duration(name: str, seconds: float, status: str = "ok"):
+    """For phases that cannot hold a span open, e.g. work spread over a streamed response."""
+    PHASE_SECONDS.observe(seconds, phase=name, status=status)
+
+
+def record_llm_call(prompt_chars: int, response_chars: int, usage=None):
+    """Adds LLM payload sizes (and token counts, when the response reports usage) to the current span and the metrics."""
+    prompt_tokens = getattr(usage, "prompt_token_count", None)
+    response_tokens = getattr(usage, "candidates_token_count", None)
+    LLM_PAYLOAD_CHARS.observe(prompt_chars, direction="prompt")
+    LLM_PAYLOAD_CHARS.observe(response_chars, direction="response")
+    if prompt_tokens:
+        LLM_TOKENS.inc(prompt_tokens, direction="prompt")
+    if response_tokens:
+        LLM_TOKENS.inc(response_tokens, direction="response")
+    account_llm(promptTokens=prompt_tokens, responseTokens=response_tokens)
+    current = _current_span.get()
+    if current is not None:
+        current.set(promptChars=prompt_chars, responseChars=response_chars, promptTokens=prompt_tokens, responseTokens=response_tokens)
+
+
+@contextmanager
+def trace(exec_id: str):
+    """Collects the spans of one job; they are written to TELEMETRY_LOG_DIR/exec-{exec_id}.json when it ends."""
+    record = Trace(exec_id)
+    trace_token = _current_trace.set(record)
+    span_token = _current_span.set(None)
+    try:
+        yield record
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        persist_trace(record)
+
+
+def persist_trace(record: Trace):
+    path = os.path.join(TELEMETRY_LOG_DIR, f"exec-{record.exec_id}.json")
+    try:
+        os.makedirs(TELEMETRY_LOG_DIR, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"execId": record.exec_id, "llmUsage": record.llm_usage, "spans": [s.to_dict() for s in record.spans]}, f, indent=2, default=str)
+    except OSError as e:
+        logger.warning(f"Could not write trace for {record.exec_id}: {e}")
@@ -0,0 +1,41 @@
+import asyncio
+import logging
+from typing import Dict, Optional
+from services.command_runner import run_command
+
+logger = logging.getLogger(__name__)
+
+# Versions that decide what `npm install` produces; probed once per process.
+PROBES = {
+    "node": ["node", "--version"],
+    "npm": ["npm", "--version"],
+}
+
+_versions: Optional[Dict[str, Optional[str]]] = None
+_lock = asyncio.Lock()
+
+
+async def probe_toolchain() -> Dict[str, Optional[str]]:
+    """Runs the version probes concurrently. A missing tool maps to None."""
+    results = await asyncio.gather(*(run_command(command, timeout=30) for command in PROBES.values()))
+    versions = {
+        name: result["stdout"].strip() if result["success"] else None
+        for name, result in zip(PROBES, results)
+    }
+    logger.info(f"Toolchain: {versions}")
+    return versions
+
+
+async def get_toolchain() -> Dict[str, Optional[str]]:
+    """The cached toolchain versions, probing on first use if the startup probe has not run."""
+    global _versions
+    if _versions is None:
+        async with _lock:
+            if _versions is None:
+                _versions = await probe_toolchain()
+    return _versions
+
+
+def toolchain_fingerprint(versions: Dict[str, Optional[str]]) -> list:
+    """Stable `name=version` strings, e.g. for keying cached installs on the toolchain that made them."""
+    return [f"{name}={versions.get(name)}" for name in sorted(versions)]
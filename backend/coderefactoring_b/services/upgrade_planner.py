@@ -0,0 +1,98 @@
+import os
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from services.npm_registry import get_registry_client
+from services.semver import Version, parse_version, parse_range, min_version, max_satisfying, matches_any_version
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FIELDS = ("dependencies", "devDependencies")
+PRIORITY_ORDER = {"Must have": 1, "Should have": 2, "Could have": 3}
+
+
+@dataclass
+class UpgradePlan:
+    # {"name", "current" (the spec from package.json), "wanted", "latest", "priority"}, most urgent first.
+    upgrades: List[dict] = field(default_factory=list)
+    # Dependencies whose spec is not a version range (git, file:, URLs, tags, npm: aliases).
+    skipped: List[str] = field(default_factory=list)
+    # Dependencies the registry had no usable metadata for.
+    unavailable: List[str] = field(default_factory=list)
+
+
+def read_manifest_dependencies(project_root: str) -> Dict[str, str]:
+    with open(os.path.join(project_root, "package.json"), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    dependencies = {}
+    for field_name in MANIFEST_FIELDS:
+        dependencies.update(manifest.get(field_name) or {})
+    return dependencies
+
+
+def get_priority(current: Version, latest: Version) -> str:
+    """How far `latest` is ahead of `current`: a new major, minor or patch release."""
+    if latest <= current:
+        return "Won't have"
+    if latest[0] != current[0]:
+        return "Must have"
+    if latest[1] != current[1]:
+        return "Should have"
+    return "Could have"
+
+
+def latest_release(metadata: dict) -> Optional[str]:
+    """The `latest` dist-tag, or the highest stable version when the tag is missing or malformed."""
+    tagged = metadata.get("dist-tags", {}).get("latest")
+    if tagged and parse_version(tagged):
+        return tagged
+    stable = [(v, text) for text in metadata.get("versions", []) for v in [parse_version(text)] if v and v[3] == (1,)]
+    return max(stable)[1] if stable else None
+
+
+def plan_dependency(name: str, spec: str, metadata: dict) -> Optional[dict]:
+    """The upgrade for one dependency, or None when its range already starts at the latest release."""
+    version_range = parse_range(spec)
+    latest = latest_release(metadata)
+    if version_range is None or latest is None or matches_any_version(version_range):
+        return None
+    base = min_version(version_range)
+    if base is None:
+        return None
+    priority = get_priority(base, parse_version(latest))
+    if priority == "Won't have":
+        return None
+    return {
+        "name": name,
+        "current": spec,
+        "wanted": max_satisfying(metadata.get("versions", []), version_range),
+        "latest": latest,
+        "priority": priority,
+    }
+
+
+async def plan_upgrades(dependencies: Dict[str, str]) -> UpgradePlan:
+    """
+    Compares every dependency's range with the registry's latest release, fetching all metadata
+    in one concurrent batch (served from the registry cache when fresh), without running npm.
+    """
+    plan = UpgradePlan()
+    ranged = {}
+    for name, spec in dependencies.items():
+        if parse_range(str(spec)) is None:
+            plan.skipped.append(name)
+        else:
+            ranged[name] = str(spec)
+    metadata = await get_registry_client().get_metadata_batch(ranged)
+    for name, spec in ranged.items():
+        if not metadata.get(name):
+            plan.unavailable.append(name)
+            continue
+        upgrade = plan_dependency(name, spec, metadata[name])
+        if upgrade:
+            plan.upgrades.append(upgrade)
+    plan.upgrades.sort(key=lambda u: PRIORITY_ORDER[u["priority"]])
+    if plan.skipped:
+        logger.info(f"Not planning upgrades for non-registry dependencies: {', '.join(plan.skipped)}")
+    return plan
@@ -0,0 +1,141 @@
+import os
+import json
+import shutil
+import zipfile
+import logging
+from fastapi import WebSocket, WebSocketDisconnect
+from config import UPLOAD_CHUNK_BYTES, UPLOAD_MAX_BYTES, EXTRACT_MAX_BYTES, EXTRACT_MAX_FILES, EXTRACT_MAX_RATIO
+
+logger = logging.getLogger(__name__)
+
+# Directories that are never extracted, at any depth: installed dependencies, VCS data, macOS metadata.
+SKIPPED_ARCHIVE_DIRS = {"node_modules", ".git", "__MACOSX"}
+# Build output and tool caches, skipped only directly under a project root (a directory with a
+# package.json); elsewhere, e.g. src/build/ or src/utils/dist/, they are source.
+SKIPPED_BUILD_DIRS = {"build", "dist", ".next", ".nuxt", ".cache", "coverage"}
+SKIPPED_ARCHIVE_FILES = {".DS_Store", "Thumbs.db"}
+
+
+def is_skipped_dir(name: str, in_project_root: bool) -> bool:
+    """Whether a directory called name is left out of extraction and export."""
+    return name in SKIPPED_ARCHIVE_DIRS or (in_project_root and name in SKIPPED_BUILD_DIRS)
+
+
+class UploadError(Exception):
+    """The uploaded project was rejected (too large, malformed or unsafe)."""
+
+
+async def receive_project_upload(websocket: WebSocket, dest_path: str) -> int:
+    """
+    Receives the project archive and spools it to dest_path, returning the number of bytes received.
+
+    Chunked protocol: {"type": "upload_start", "size": N} as text, then binary chunks of at most
+    UPLOAD_CHUNK_BYTES, then {"type": "upload_end"}. A single binary message without upload_start
+    is accepted as the whole archive for older clients. Uploads above UPLOAD_MAX_BYTES are rejected
+    as soon as the declared size or the received bytes exceed the limit.
+    """
+    received = 0
+    chunked = False
+    with open(dest_path, "wb") as f:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes") is not None:
+                chunk = message["bytes"]
+                received += len(chunk)
+                if received > UPLOAD_MAX_BYTES:
+                    raise UploadError(f"Upload exceeds the {UPLOAD_MAX_BYTES // (1024 * 1024)} MB limit.")
+                f.write(chunk)
+                if not chunked:
+                    return received
+                continue
+            try:
+                payload = json.loads(message.get("text") or "")
+            except ValueError:
+                raise UploadError("Expected an upload control message.")
+            if payload.get("type") == "upload_start":
+                try:
+                    declared_size = int(payload.get("size") or 0)
+                except (TypeError, ValueError):
+                    raise UploadError("upload_start needs a numeric size.")
+                if declared_size > UPLOAD_MAX_BYTES:
+                    raise UploadError(f"Upload exceeds the {UPLOAD_MAX_BYTES // (1024 * 1024)} MB limit.")
+                chunked = True
+            elif payload.get("type") == "upload_end" and chunked:
+                return received
+            else:
+                raise UploadError(f"Unexpected message during upload: {payload.get('type')}")
+
+
+def _safe_member_path(name: str, dest_dir: str) -> str | None:
+    """Resolves an archive member inside dest_dir, or returns None for absolute/escaping paths."""
+    normalized = name.replace("\\", "/")
+    if normalized.startswith("/") or (len(normalized) > 1 and normalized[1] == ":"):
+        return None
+    target = os.path.realpath(os.path.join(dest_dir, normalized))
+    if not target.startswith(os.path.realpath(dest_dir) + os.sep):
+        return None
+    return target
+
+
+def _is_skipped_member(parts: list, is_dir: bool, project_dirs: set) -> bool:
+    dir_parts = parts if is_dir else parts[:-1]
+    if any(is_skipped_dir(part, tuple(dir_parts[:i]) in project_dirs) for i, part in enumerate(dir_parts)):
+        return True
+    return not is_dir and parts[-1] in SKIPPED_ARCHIVE_FILES
+
+
+def extract_project_archive(archive_path: str, dest_dir: str) -> dict:
+    """
+    Extracts a project zip member by member with bounded memory, skipping dependency/build
+    directories. Limits on file count, total uncompressed size and compression ratio are enforced
+    against the bytes actually written, not just the sizes the archive declares.
+    Blocking; run it in a worker thread.
+    """
+    archive_size = max(os.path.getsize(archive_path), 1)
+    max_total = min(EXTRACT_MAX_BYTES, int(archive_size * EXTRACT_MAX_RATIO))
+    stats = {"files": 0, "bytes": 0, "skipped": 0}
+    try:
+        with zipfile.ZipFile(archive_path) as z:
+            members = [(info, [p for p in info.filename.replace("\\", "/").split("/") if p]) for info in z.infolist()]
+            # Directories holding a package.json, as path tuples, for the build output rule.
+            project_dirs = {tuple(parts[:-1]) for info, parts in members if parts and parts[-1] == "package.json" and not info.is_dir()}
+            for info, parts in members:
+                if not parts or _is_skipped_member(parts, info.is_dir(), project_dirs):
+                    stats["skipped"] += 1
+                    continue
+                target = _safe_member_path(info.filename, dest_dir)
+                if target is None:
+                    raise UploadError(f"Archive entry escapes the project directory: {info.filename}")
+                if info.is_dir():
+                    os.makedirs(target, exist_ok=True)
+                    continue
+
+                stats["files"] += 1
+                if stats["files"] > EXTRACT_MAX_FILES:
+                    raise UploadError(f"Archive contains more than {EXTRACT_MAX_FILES} files.")
+                if info.compress_size and info.file_size / info.compress_size > EXTRACT_MAX_RATIO:
+                    raise UploadError(f"Suspicious compression ratio for {info.filename}.")
+                if stats["bytes"] + info.file_size > max_total:
+                    raise UploadError("Archive expands beyond the allowed uncompressed size.")
+
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with z.open(info) as src, open(target, "wb") as dst:
+                    while True:
+                        block = src.read(UPLOAD_CHUNK_BYTES)
+                        if not block:
+                            break
+                        stats["bytes"] += len(block)
+                        if stats["bytes"] > max_total:
+                            raise UploadError("Archive expands beyond the allowed uncompressed size.")
+                        dst.write(block)
+    except (UploadError, zipfile.BadZipFile) as e:
+        # Never leave a partially extracted project behind.
+        shutil.rmtree(dest_dir, ignore_errors=True)
+        os.makedirs(dest_dir, exist_ok=True)
+        if isinstance(e, zipfile.BadZipFile):
+            raise UploadError(f"The uploaded file is not a valid zip archive: {e}") from e
+        raise
+    logger.info(f"Extracted {stats['files']} files ({stats['bytes']} bytes), skipped {stats['skipped']} entries")
+    return stats
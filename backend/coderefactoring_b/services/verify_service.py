@@ -0,0 +1,398 @@
+import os
+import re
+import json
+import time
+import shutil
+import asyncio
+import logging
+from collections import Counter
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+from websocket_manager import manager
+from services.command_runner import run_command, run_command_streamed
+from services.js_lexer import tokenize, LexError
+from services.log_stream import error_tail
+from services.telemetry import span
+from config import VERIFY_FAST_CHECKS, VERIFY_CHECK_TIMEOUT_SECONDS, VERIFY_CACHE_DIR, VERIFY_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SOURCE_EXTENSIONS = ('.js', '.jsx', '.ts', '.tsx', '.mjs', '.cjs')
+BUILD_COMMAND = ["npm", "run", "build"]
+# Build tool caches (webpack/babel-loader, Next.js) that live inside the project. They are linked
+# to a per-exec_id directory outside it so a retried job builds warm.
+BUILD_CACHE_DIRS = (os.path.join("node_modules", ".cache"), os.path.join(".next", "cache"))
+# Diagnostics listed in a failure message; the full list travels in the event's `diagnostics`.
+MAX_LISTED_DIAGNOSTICS = 10
+# tsc diagnostics of the project before refactoring, in the exec_id's cache directory.
+TYPE_BASELINE_FILE = "tsc-baseline.json"
+
+# src/App.tsx(12,5): error TS2339: Property 'x' does not exist on type 'Y'.
+TSC_DIAGNOSTIC = re.compile(r"^(?P<file>[^\s(][^(\n]*)\((?P<line>\d+),(?P<column>\d+)\): error (?P<code>TS\d+): (?P<message>.*)$", re.MULTILINE)
+# X [ERROR] Expected ";" but found "x"
+#
+#     src/App.jsx:3:8:
+ESBUILD_DIAGNOSTIC = re.compile(r"^\S* ?\[ERROR\] (?P<message>.*)\n\s*\n\s+(?P<file>\S[^\n]*?):(?P<line>\d+):(?P<column>\d+):\s*$", re.MULTILINE)
+
+SOURCE_PATH = r"(?:\.{1,2}/|/)?[\w@$.\-/\\]+?\.(?:jsx?|tsx?|mjs|cjs)"
+# Single-line error formats of the common build tools; line and column are optional.
+BUILD_DIAGNOSTICS = (
+    TSC_DIAGNOSTIC,
+    # src/App.tsx:12:5 - error TS2339: ...  (tsc --pretty, fork-ts-checker, esbuild/Vite "file:" lines)
+    re.compile(rf"^(?:ERROR in |file: )?(?P<file>{SOURCE_PATH}):(?P<line>\d+):(?P<column>\d+)(?:[ \t]*-[ \t]*error)?[: \t]+(?P<message>\S.*)$", re.MULTILINE),
+    # SyntaxError: /app/src/App.js: Unexpected token (3:6)   (Babel)
+    re.compile(rf"^.*?SyntaxError: (?P<file>{SOURCE_PATH}): (?P<message>.*?) \((?P<line>\d+):(?P<column>\d+)\)", re.MULTILINE),
+    # "Switch" is not exported by "node_modules/...", imported by "src/App.jsx".   (Rollup/Vite)
+    re.compile(rf"^(?P<message>.*?(?:imported by|import \"[^\"]+\" from) \"(?P<file>{SOURCE_PATH})\".*)$", re.MULTILINE),
+)
+# webpack/CRA print a file header followed by that file's messages, up to a blank line:
+#   ./src/App.js
+#   Attempted import error: 'Switch' is not exported from 'react-router-dom'.
+# or, for ESLint:
+#   src/App.js
+#     Line 5:3:  'Switch' is not defined  react/jsx-no-undef
+WEBPACK_FILE_HEADER = re.compile(rf"^(?:ERROR in |\[eslint\]\s*)?(?P<file>{SOURCE_PATH})(?:[: ](?P<line>\d+):(?P<column>\d+)(?:-\d+)?)?\s*$")
+ESLINT_LINE = re.compile(r"^\s+Line (?P<line>\d+):(?P<column>\d+):\s+(?P<message>.*)$")
+
+
+@dataclass
+class Diagnostic:
+    """One problem found while verifying the upgrade; file is relative to the project root when known."""
+    file: Optional[str]
+    message: str
+    line: int = 0
+    column: int = 0
+    source: str = "build"
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def __str__(self) -> str:
+        location = f"{self.file}:{self.line}:{self.column}" if self.file and self.line else (self.file or "build")
+        return f"{location}: {self.message}"
+
+
+def _match_diagnostics(pattern: re.Pattern, output: str, project_root: str, source: str) -> List[Diagnostic]:
+    diagnostics = []
+    for match in pattern.finditer(output):
+        file_path = match.group("file").strip()
+        if os.path.isabs(file_path):
+            file_path = os.path.relpath(file_path, project_root)
+        message = match.group("message").strip()
+        if "code" in match.groupdict():
+            message = f"{match.group('code')}: {message}"
+        diagnostics.append(Diagnostic(file_path.replace(os.sep, "/"), message, int(match.group("line")), int(match.group("column")), source))
+    return diagnostics
+
+
+def _project_file(file_path: str, project_root: str) -> Optional[str]:
+    """file_path relative to the project root, or None if it is not one of the project's own files."""
+    path = file_path if os.path.isabs(file_path) else os.path.join(project_root, file_path)
+    relative = os.path.relpath(os.path.normpath(path), project_root).replace(os.sep, "/")
+    if relative.startswith("../") or "node_modules/" in relative or not os.path.isfile(os.path.join(project_root, relative)):
+        return None
+    return relative
+
+
+def parse_build_output(output: str, project_root: str) -> List[Diagnostic]:
+    """
+    File-attributed errors from tsc, webpack/CRA (including its ESLint blocks), Babel and
+    Rollup/Vite output. Errors in files outside the project (e.g. node_modules) are dropped.
+    """
+    found: List[Diagnostic] = []
+    for pattern in BUILD_DIAGNOSTICS:
+        for match in pattern.finditer(output):
+            groups = match.groupdict()
+            message = match.group("message").strip()
+            if groups.get("code"):
+                message = f"{groups['code']}: {message}"
+            found.append(Diagnostic(match.group("file").strip(), message, int(groups.get("line") or 0), int(groups.get("column") or 0)))
+
+    lines = output.splitlines()
+    for i, text in enumerate(lines):
+        header = WEBPACK_FILE_HEADER.match(text)
+        if not header:
+            continue
+        for following in lines[i + 1:]:
+            if not following.strip() or WEBPACK_FILE_HEADER.match(following) or any(p.match(following) for p in BUILD_DIAGNOSTICS):
+                break
+            eslint = ESLINT_LINE.match(following)
+            if eslint:
+                found.append(Diagnostic(header.group("file"), eslint.group("message").strip(), int(eslint.group("line")), int(eslint.group("column"))))
+            else:
+                found.append(Diagnostic(header.group("file"), following.strip(), int(header.group("line") or 0), int(header.group("column") or 0)))
+
+    diagnostics, seen = [], set()
+    for diagnostic in found:
+        diagnostic.file = _project_file(diagnostic.file, project_root)
+        key = (diagnostic.file, diagnostic.line, diagnostic.message)
+        if diagnostic.file and key not in seen:
+            seen.add(key)
+            diagnostics.append(diagnostic)
+    return diagnostics
+
+
+def parse_tsc_output(output: str, project_root: str) -> List[Diagnostic]:
+    return _match_diagnostics(TSC_DIAGNOSTIC, output, project_root, "tsc")
+
+
+def parse_esbuild_output(output: str, project_root: str) -> List[Diagnostic]:
+    return _match_diagnostics(ESBUILD_DIAGNOSTIC, output, project_root, "esbuild")
+
+
+def describe_failure(diagnostics: List[Diagnostic]) -> str:
+    listed = "\n".join(str(d) for d in diagnostics[:MAX_LISTED_DIAGNOSTICS])
+    more = len(diagnostics) - MAX_LISTED_DIAGNOSTICS
+    return listed + (f"\n... and {more} more" if more > 0 else "")
+
+
+# --- Per-exec_id caches ---
+
+def exec_cache_dir(exec_id: str) -> str:
+    path = os.path.join(VERIFY_CACHE_DIR, exec_id)
+    os.makedirs(path, exist_ok=True)
+    os.utime(path)
+    return path
+
+
+def prune_verify_caches(max_age: float = VERIFY_CACHE_TTL_SECONDS):
+    """Removes per-exec_id caches that have not been used for max_age seconds."""
+    if not os.path.isdir(VERIFY_CACHE_DIR):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(VERIFY_CACHE_DIR):
+        path = os.path.join(VERIFY_CACHE_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def link_build_caches(project_root: str, cache_dir: str):
+    """
+    Points the project's build tool caches at cache_dir. An existing cache in the project is moved
+    there first. Best effort: where symlinks are unavailable the build simply runs cold.
+    """
+    for relative in BUILD_CACHE_DIRS:
+        path = os.path.join(project_root, relative)
+        if not os.path.isdir(os.path.dirname(path)) or os.path.islink(path):
+            continue
+        target = os.path.abspath(os.path.join(cache_dir, "build", relative.replace(os.sep, "_")))
+        try:
+            if os.path.isdir(path):
+                if os.path.exists(target):
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(path, target)
+            os.makedirs(target, exist_ok=True)
+            os.symlink(target, path, target_is_directory=True)
+        except OSError as e:
+            logger.warning(f"Could not link build cache {relative}: {e}")
+
+
+# --- Checks ---
+
+def _local_bin(project_root: str, name: str) -> Optional[str]:
+    """The project's own copy of a tool; never downloaded, so a missing tool just skips its check."""
+    return shutil.which(os.path.join(project_root, "node_modules", ".bin", name))
+
+
+def check_syntax(project_root: str, originals: Dict[str, str]) -> List[Diagnostic]:
+    """
+    Changed files that the lexer can no longer read (unbalanced brackets, unterminated literals),
+    typically a truncated or mangled model response. The lexer is heuristic (JSX text such as
+    "Step 1)" trips it), so these are suspects for tsc/esbuild or the build to confirm. Files the
+    lexer could not read before the upgrade either are left to the other checks.
+    """
+    diagnostics = []
+    for relative_path, original in originals.items():
+        if not relative_path.endswith(SOURCE_EXTENSIONS):
+            continue
+        try:
+            list(tokenize(original))
+        except LexError:
+            continue
+        try:
+            with open(os.path.join(project_root, relative_path), "r", encoding="utf-8") as f:
+                list(tokenize(f.read()))
+        except (OSError, UnicodeDecodeError, LexError) as e:
+            diagnostics.append(Diagnostic(relative_path.replace(os.sep, "/"), str(e), source="syntax"))
+    return diagnostics
+
+
+async def check_types(project_root: str, cache_dir: str) -> Optional[List[Diagnostic]]:
+    """
+    `tsc --noEmit --incremental` with its build info kept in cache_dir. None when the project has no
+    tsconfig.json or local tsc, or tsc failed without reporting file diagnostics.
+    """
+    tsc = _local_bin(project_root, "tsc")
+    if not tsc or not os.path.isfile(os.path.join(project_root, "tsconfig.json")):
+        return None
+    command = [tsc, "--noEmit", "--incremental", "--tsBuildInfoFile", os.path.abspath(os.path.join(cache_dir, "tsconfig.tsbuildinfo")), "--pretty", "false", "-p", "tsconfig.json"]
+    result = await run_command(command, cwd=project_root, timeout=VERIFY_CHECK_TIMEOUT_SECONDS)
+    if result["success"]:
+        return []
+    diagnostics = parse_tsc_output(result["stdout"] + "\n" + result["stderr"], project_root)
+    if not diagnostics:
+        logger.warning(f"tsc failed without file diagnostics: {error_tail(result['stdout'] + result['stderr'], 500)}")
+        return None
+    return diagnostics
+
+
+async def record_type_baseline(exec_id: str, project_root: str):
+    """
+    Type-checks the project before it is refactored, so the checks afterwards can tell the errors
+    the upgrade introduced from those the project already had (many builds never type-check).
+    Also warms tsc's incremental build info. Does nothing without tsc or VERIFY_FAST_CHECKS.
+    """
+    if not VERIFY_FAST_CHECKS:
+        return
+    cache_dir = exec_cache_dir(exec_id)
+    path = os.path.join(cache_dir, TYPE_BASELINE_FILE)
+    with span("type_baseline") as check_span:
+        try:
+            diagnostics = await check_types(project_root, cache_dir)
+        except Exception as e:
+            # Runs as a background task; without a baseline, type errors are simply left to the build.
+            logger.warning(f"Could not record the type baseline: {e}")
+            diagnostics = None
+        check_span.set(diagnostics=None if diagnostics is None else len(diagnostics))
+    if diagnostics is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([d.to_dict() for d in diagnostics], f)
+    if diagnostics:
+        await manager.send_json(exec_id, {"type": "log", "status": "info", "message": f"The project has {len(diagnostics)} type errors before the upgrade; only new ones will fail the quick checks."})
+
+
+def load_type_baseline(cache_dir: str) -> Optional[List[Diagnostic]]:
+    try:
+        with open(os.path.join(cache_dir, TYPE_BASELINE_FILE), "r", encoding="utf-8") as f:
+            return [Diagnostic(**d) for d in json.load(f)]
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def new_diagnostics(diagnostics: List[Diagnostic], baseline: List[Diagnostic]) -> List[Diagnostic]:
+    """
+    The diagnostics not in the baseline. They are compared by file and message, not line, because
+    edits move lines; a message repeated more often than before counts as new.
+    """
+    known = Counter((d.file, d.message) for d in baseline)
+    new = []
+    for diagnostic in diagnostics:
+        key = (diagnostic.file, diagnostic.message)
+        if known[key] > 0:
+            known[key] -= 1
+        else:
+            new.append(diagnostic)
+    return new
+
+
+async def check_parse(project_root: str, cache_dir: str, files: List[str]) -> Optional[List[Diagnostic]]:
+    """
+    Parses the changed files with the project's esbuild (no bundling, so imports are not resolved).
+    None when esbuild is not installed or failed without reporting file diagnostics.
+    """
+    esbuild = _local_bin(project_root, "esbuild")
+    if not esbuild or not files:
+        return None
+    command = [
+        esbuild, *files, f"--outdir={os.path.abspath(os.path.join(cache_dir, 'esbuild'))}",
+        "--log-level=error", "--log-limit=0", "--color=false", "--loader:.js=jsx",
+    ]
+    result = await run_command(command, cwd=project_root, timeout=VERIFY_CHECK_TIMEOUT_SECONDS)
+    if result["success"]:
+        return []
+    diagnostics = parse_esbuild_output(result["stderr"], project_root)
+    if not diagnostics:
+        logger.warning(f"esbuild failed without file diagnostics: {error_tail(result['stderr'], 500)}")
+        return None
+    return diagnostics
+
+
+async def run_fast_checks(exec_id: str, project_root: str, originals: Dict[str, str], cache_dir: str) -> List[Diagnostic]:
+    """
+    Cheap checks scoped to the changed files. Returns the diagnostics in changed files that should
+    fail the upgrade without waiting for the full build; only tsc or esbuild can fail it, the
+    lexer's syntax check just points out files for them (or the build) to confirm.
+    """
+    with span("syntax_check", files=len(originals)) as check_span:
+        suspects = await asyncio.to_thread(check_syntax, project_root, originals)
+        check_span.set(diagnostics=len(suspects))
+
+    changed = {p.replace(os.sep, "/") for p in originals}
+    with span("type_check") as check_span:
+        tool = "tsc"
+        diagnostics = await check_types(project_root, cache_dir)
+        if diagnostics is None:
+            tool = "esbuild"
+            diagnostics = await check_parse(project_root, cache_dir, sorted(p for p in changed if p.endswith(SOURCE_EXTENSIONS)))
+        check_span.set(tool=tool if diagnostics is not None else None, diagnostics=len(diagnostics or []))
+    reported = {d.file for d in diagnostics or []}
+    unconfirmed = [d for d in suspects if d.file not in reported]
+    if unconfirmed:
+        why = f"{tool} reported no errors there" if diagnostics is not None else "neither tsc nor esbuild is installed to confirm it"
+        await manager.send_json(exec_id, {"type": "log", "status": "warning", "message": f"The quick syntax check could not read {', '.join(d.file for d in unconfirmed)}, but {why}; leaving it to the build."})
+    if not diagnostics:
+        return []
+
+    # Type errors may predate the upgrade (e.g. a Vite app that never type-checks), and errors
+    # elsewhere may be old too; only new errors in changed files fail fast, the build decides
+    # about the rest. esbuild only reports syntax errors, which the changed files did not have.
+    candidates, reason = diagnostics, "are in files the upgrade did not change"
+    if tool == "tsc":
+        baseline = load_type_baseline(cache_dir)
+        if baseline is None:
+            candidates, reason = [], "cannot be compared with a type check from before the upgrade"
+        else:
+            candidates, reason = new_diagnostics(diagnostics, baseline), "predate the upgrade or are in files it did not change"
+    failing = [d for d in candidates if d.file in changed]
+    deferred = len(diagnostics) - len(failing)
+    if deferred:
+        await manager.send_json(exec_id, {"type": "log", "status": "warning", "message": f"{deferred} {tool} errors {reason}; leaving them to the build."})
+    return failing
+
+
+async def verify_upgrade(exec_id: str, project_root: str, originals: Dict[str, str]) -> List[Diagnostic]:
+    """
+    Verifies the upgraded project: fast checks of the changed files (originals maps each changed
+    path, relative to project_root, to its content before the upgrade), then the full build.
+    Returns the diagnostics of the first stage that failed, or [] when the build succeeds.
+    """
+    prune_verify_caches()
+    cache_dir = exec_cache_dir(exec_id)
+
+    if VERIFY_FAST_CHECKS and originals:
+        await manager.send_json(exec_id, {"type": "log", "status": "loading", "message": f"Checking the {len(originals)} changed files..."})
+        diagnostics = await run_fast_checks(exec_id, project_root, originals, cache_dir)
+        if diagnostics:
+            await manager.send_json(exec_id, {
+                "type": "log", "status": "error",
+                "message": f"The changed files have {len(diagnostics)} errors:\n{describe_failure(diagnostics)}",
+                "diagnostics": [d.to_dict() for d in diagnostics],
+            })
+            return diagnostics
+        await manager.send_json(exec_id, {"type": "log", "status": "success", "message": "Changed files passed the quick checks."})
+
+    await manager.send_json(exec_id, {"type": "log", "status": "loading", "message": "Verifying the upgrade by running the build command..."})
+    link_build_caches(project_root, cache_dir)
+    with span("build") as build_span:
+        build_stdout, build_stderr, build_returncode = await run_command_streamed(BUILD_COMMAND, cwd=project_root, exec_id=exec_id)
+        build_span.set(returnCode=build_returncode)
+
+    if build_returncode != 0:
+        output = f"{build_stdout}\n{build_stderr}"
+        diagnostics = parse_build_output(output, project_root) or [Diagnostic(None, error_tail(build_stderr or build_stdout))]
+        await manager.send_json(exec_id, {
+            "type": "log", "status": "error",
+            "message": f"Build failed after upgrade! Error: {error_tail(build_stderr)}",
+            "diagnostics": [d.to_dict() for d in diagnostics],
+        })
+        return diagnostics
+
+    await manager.send_json(exec_id, {"type": "log", "status": "success", "message": "Build successful! The upgrade appears to be stable."})
+    return []
@@ -1,21 +1,167 @@
 from fastapi import WebSocket
-from typing import List, Dict
+from typing import Dict, Optional
+from collections import deque
+from config import JOB_EVENT_HISTORY, WS_SEND_QUEUE_MAX, WS_SEND_QUEUE_HARD_MAX
+import asyncio
 import json
+import logging
+
+try:
+    import orjson
+
+    def dumps(data: dict) -> str:
+        return orjson.dumps(data).decode("utf-8")
+except ImportError:  # orjson is optional; fall back to the stdlib encoder.
+    def dumps(data: dict) -> str:
+        return json.dumps(data, separators=(",", ":"))
+
+logger = logging.getLogger(__name__)
+
+
+class ClientConnection:
+    """
+    One subscribed socket with its own bounded outbound queue, drained by a writer task so callers
+    never wait on the client's network. When the queue is full, droppable events (streamed command
+    output) are discarded oldest-first; other events are delivered unless the queue reaches
+    hard_max, after which the oldest of those are discarded as well.
+    """
+    def __init__(self, websocket: WebSocket, max_queue: int = WS_SEND_QUEUE_MAX, hard_max: int = WS_SEND_QUEUE_HARD_MAX):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.hard_max = max(hard_max, max_queue)
+        # Droppable and other events queue separately, so evicting either kind is O(1); sequence
+        # numbers keep them in publishing order on the wire.
+        self._droppable: deque = deque()
+        self._kept: deque = deque()
+        self._seq = 0
+        self.sent = 0
+        self.dropped = 0
+        self._unreported_drops = 0
+        self._wakeup = asyncio.Event()
+        self._writer = asyncio.create_task(self._drain())
+        self._writer.add_done_callback(self._writer_done)
+
+    @property
+    def depth(self) -> int:
+        return len(self._droppable) + len(self._kept)
+
+    def enqueue(self, text: str, droppable: bool):
+        if self.depth >= self.max_queue:
+            if self._droppable:
+                self._droppable.popleft()
+                self._count_drop()
+            elif droppable:
+                self._count_drop()
+                return
+            elif self.depth >= self.hard_max:
+                self._kept.popleft()
+                self._count_drop()
+        self._seq += 1
+        (self._droppable if droppable else self._kept).append((self._seq, text))
+        self._wakeup.set()
+
+    def _pop_next(self) -> str:
+        if not self._kept or (self._droppable and self._droppable[0][0] < self._kept[0][0]):
+            return self._droppable.popleft()[1]
+        return self._kept.popleft()[1]
+
+    @staticmethod
+    def _writer_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Stopped sending to a WebSocket client: {task.exception()!r}")
+
+    def _count_drop(self):
+        self.dropped += 1
+        self._unreported_drops += 1
+
+    async def _drain(self):
+        while True:
+            if not self.depth:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if self._unreported_drops:
+                notice = {"type": "log", "status": "warning", "message": f"Skipped {self._unreported_drops} log messages because the connection is slow."}
+                self._unreported_drops = 0
+                await self.websocket.send_text(dumps(notice))
+            await self.websocket.send_text(self._pop_next())
+            self.sent += 1
+
+    @property
+    def closed(self) -> bool:
+        return self._writer.done()
+
+    async def flush(self, timeout: float):
+        """Waits (up to timeout) until everything queued so far has been written."""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while self.depth and not self.closed and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.01)
+
+    def close(self):
+        self._writer.cancel()
+
 
 class WebSocketManager:
+    """
+    Routes job events to whichever socket is subscribed to that exec_id. Every event is serialized
+    once and kept in a bounded per-job history, so a client that connects later (or reconnects) is
+    replayed the stream from the start. Delivery goes through per-client queues (see ClientConnection).
+    """
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+        self.active_connections: Dict[str, ClientConnection] = {}
+        self.history: Dict[str, deque] = {}
 
     async def connect(self, websocket: WebSocket, client_id: str):
         await websocket.accept()
-        self.active_connections[client_id] = websocket
+        connection = ClientConnection(websocket)
+        # History is queued ahead of anything new; no await between snapshot and subscribe.
+        for text, droppable in self.history.get(client_id, ()):
+            connection.enqueue(text, droppable)
+        previous = self.active_connections.get(client_id)
+        if previous:
+            previous.close()
+        self.active_connections[client_id] = connection
 
-    def disconnect(self, client_id: str):
-        if client_id in self.active_connections:
+    def disconnect(self, client_id: str, websocket: Optional[WebSocket] = None):
+        # A reconnect may already have replaced this socket; only remove the one that closed.
+        connection = self.active_connections.get(client_id)
+        if connection and websocket in (None, connection.websocket):
+            connection.close()
             del self.active_connections[client_id]
 
-    async def send_json(self, client_id: str, data: dict):
-        if client_id in self.active_connections:
-            await self.active_connections[client_id].send_text(json.dumps(data))
+    def forget(self, client_id: str):
+        self.history.pop(client_id, None)
+
+    async def flush(self, client_id: str, timeout: float = 2.0):
+        connection = self.active_connections.get(client_id)
+        if connection:
+            await connection.flush(timeout)
+
+    async def send_json(self, client_id: str, data: dict, droppable: bool = False, record: bool = True):
+        """
+        Publishes an event to a job's stream without waiting on the network. droppable marks
+        low-priority events (streamed command output) that may be skipped for a slow client;
+        record=False sends a connection-level message that is not replayed to later subscribers.
+        """
+        text = dumps(data)
+        if record:
+            self.history.setdefault(client_id, deque(maxlen=JOB_EVENT_HISTORY)).append((text, droppable))
+        connection = self.active_connections.get(client_id)
+        if connection is not None:
+            if connection.closed:
+                # The writer stopped because the client went away; the job carries on regardless.
+                self.disconnect(client_id, connection.websocket)
+            else:
+                connection.enqueue(text, droppable)
+
+    def stats(self) -> dict:
+        connections = self.active_connections.values()
+        return {
+            "connections": len(self.active_connections),
+            "queuedMessages": sum(c.depth for c in connections),
+            "maxQueueDepth": max((c.depth for c in connections), default=0),
+            "sentMessages": sum(c.sent for c in connections),
+            "droppedMessages": sum(c.dropped for c in connections),
+        }
 
-manager = WebSocketManager()
\ No newline at end of file
+manager = WebSocketManager()
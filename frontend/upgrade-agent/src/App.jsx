@@ -12,6 +12,7 @@ function App() {
   const [isProcessing, setIsProcessing] = useState(false);
   const [isUpgrading, setIsUpgrading] = useState(false);
   const [downloadPath, setDownloadPath] = useState(null);
+  const [patchDownloadPath, setPatchDownloadPath] = useState(null);
   const [fileToUpload, setFileToUpload] = useState(null);
   const [selectedPackages, setSelectedPackages] = useState([]);
   const socketRef = useRef(null);
@@ -62,6 +63,22 @@ function App() {
         }
         const currentStep = newLogs[newLogs.length - 1];
 
+        if (log.type === "progress") {
+          // Progress updates replace the previous update with the same key instead of piling up.
+          const existing = currentStep.logs.find(
+            (l) => l.type === "progress" && l.key === log.key
+          );
+          if (existing) existing.message = log.message;
+          else currentStep.logs.push(log);
+          return newLogs;
+        }
+        if (log.file) {
+          // The file's result supersedes its progress line.
+          currentStep.logs = currentStep.logs.filter(
+            (l) => !(l.type === "progress" && l.key === log.file)
+          );
+        }
+
         // Find a loading log that can be completed by the current message
         const loadingLogIndex = currentStep.logs.findIndex(
           (l) => l.status === "loading"
@@ -82,6 +99,21 @@ function App() {
     });
   };
 
+  const uploadInChunks = async (socket, file, chunkSize = 1024 * 1024) => {
+    socket.send(
+      JSON.stringify({ type: "upload_start", size: file.size, name: file.name })
+    );
+    for (let offset = 0; offset < file.size; offset += chunkSize) {
+      // Wait for the socket to drain so large uploads aren't buffered in memory.
+      while (socket.bufferedAmount > chunkSize * 4) {
+        await new Promise((resolve) => setTimeout(resolve, 20));
+      }
+      if (socket.readyState !== WebSocket.OPEN) return;
+      socket.send(await file.slice(offset, offset + chunkSize).arrayBuffer());
+    }
+    socket.send(JSON.stringify({ type: "upload_end" }));
+  };
+
   useEffect(() => {
     if (!fileToUpload) return;
 
@@ -105,7 +137,7 @@ function App() {
           status: "info",
           message: "Server is ready. Uploading file...",
         });
-        socket.send(fileToUpload);
+        uploadInChunks(socket, fileToUpload, data.upload?.chunkSize);
         return;
       }
 
@@ -118,6 +150,7 @@ function App() {
         // When refactor is complete, ensure the last major step is marked as success.
         addLog({ type: "major_step_end" });
         setDownloadPath(data.download_path);
+        setPatchDownloadPath(data.patch_download_path);
         setIsUpgrading(false);
         socket.close();
       }
@@ -152,6 +185,7 @@ function App() {
       return;
     }
     setDownloadPath(null);
+    setPatchDownloadPath(null);
     setLogs([]);
     setResults(null);
     setSelectedPackages([]);
@@ -194,6 +228,7 @@ function App() {
           onFileChange={onFileChange}
           disabled={isProcessing || isUpgrading}
           downloadPath={downloadPath}
+          patchDownloadPath={patchDownloadPath}
         />
         <LogViewer logGroups={logs} />
         <ActionItemsPanel
@@ -12,10 +12,18 @@ const statusIcons = {
 };
 
 const LogLine = ({ log }) => (
-  <div className={`log-line status-${log.status}`}>
-    {statusIcons[log.status] || <span className="log-icon-space" />}
-    <span className="log-message">{log.message}</span>
-  </div>
+  <>
+    <div className={`log-line status-${log.status}`}>
+      {statusIcons[log.status] || <span className="log-icon-space" />}
+      <span className="log-message">{log.message}</span>
+    </div>
+    {log.patch && (
+      <details className="log-patch">
+        <summary>View changes</summary>
+        <pre>{log.patch}</pre>
+      </details>
+    )}
+  </>
 );
 
 const LogGroup = ({ group }) => {
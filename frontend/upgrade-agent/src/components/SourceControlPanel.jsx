@@ -1,7 +1,7 @@
 import React, { useRef } from 'react';
 import { FaGithub, FaBitbucket, FaDownload } from 'react-icons/fa';
 
-function SourceControlPanel({ onFileChange, disabled, downloadPath }) {
+function SourceControlPanel({ onFileChange, disabled, downloadPath, patchDownloadPath }) {
   const fileInputRef = useRef(null);
 
   const handleButtonClick = () => {
@@ -29,6 +29,11 @@ function SourceControlPanel({ onFileChange, disabled, downloadPath }) {
           <a href={`http://localhost:8000/${downloadPath}`} download className="download-button">
             <FaDownload /> Download Upgraded Project
           </a>
+          {patchDownloadPath && (
+            <a href={`http://localhost:8000/${patchDownloadPath}`} download className="download-button">
+              <FaDownload /> Download Changed Files Only
+            </a>
+          )}
         </div>
       )}
 